@@ -6,9 +6,10 @@ Created on 14 mai 2013
 @author: Jérôme SANTOUL
 '''
 from __future__ import division
-from pandas import concat, DataFrame
-from numpy import array, arange, NaN
+from pandas import concat, DataFrame, MultiIndex, Index
+from numpy import array, arange, hstack, unique, isscalar, isnan, NaN
 from src.lib.cohorts.cohort import Cohorts
+from src.lib.cohorts.cube import CohortCube, CohortGrid, birth_cohort_view, age_class_starts, age_class_sums
 import matplotlib.pyplot as plt
 
 class AccountingCohorts(Cohorts):
@@ -18,11 +19,14 @@ class AccountingCohorts(Cohorts):
     Default columns are 'year', set col_names if different.
     Methods of this class allow index computation for national accounting.
     '''
+    _state = Cohorts._state + ['_tail']
 
 
     def __init__(self, data=None, index=None, columns=None, 
                  dtype=None, copy=False):
         super(AccountingCohorts, self).__init__(data, index, columns , dtype, copy)
+        if data is not None:
+            self._tail = dict()   # present value of the generations born after the last year
      
     def extract_generation(self, year, typ, age = None):
         """
@@ -93,7 +97,54 @@ class AccountingCohorts(Cohorts):
         generation_cohort = Cohorts(res)
         generation_cohort.columns = [typ]
         return generation_cohort
- 
+
+    def extract_generations(self, typ, birth_years = None):
+        """
+        Returns the life path of every generation of the cohort, read along the birth cohort diagonals
+        of the (age, sex, year) cube in one pass.
+
+        Parameters
+        ----------
+        typ : Str
+              A column or a list of columns of the cohort that one wants to follow
+        birth_years : List, default None
+                      The birth years of the generations to return. Default is every generation
+                      observed at least once in the cohort.
+
+        Returns
+        -------
+        generations : a dataframe indexed by birth year whose columns are indexed by (typ, sex, age).
+                      Ages at which a generation is not observed are NaN.
+        """
+        columns = [typ] if isinstance(typ, basestring) else list(typ)
+        for col in columns:
+            if col not in self.columns:
+                raise Exception('the column %s is not in the cohort' % col)
+
+        cube = self.to_cube(columns)
+        grid = cube.grid
+        nb_ages, nb_sexes, nb_years = grid.shape
+        first_birth_year = grid.years[0] - grid.ages[-1]
+        all_birth_years = arange(first_birth_year, first_birth_year + nb_ages + nb_years - 1)
+        if birth_years is None:
+            rows = slice(None)
+            birth_years = all_birth_years
+        else:
+            birth_years = array(birth_years)
+            rows = birth_years - first_birth_year
+            if (rows < 0).any() or (rows >= len(all_birth_years)).any():
+                raise Exception('some birth years are not observed in the cohort')
+
+        # Each diagonal view is (sex, birth year, age): put sexes and ages side by side in the columns
+        blocks = [birth_cohort_view(cube[col])[:, rows, :].transpose(1, 0, 2).reshape(len(birth_years), -1)
+                  for col in columns]
+        labels = [arange(len(columns)).repeat(nb_sexes*nb_ages),
+                  arange(nb_sexes).repeat(nb_ages).tolist()*len(columns),
+                  arange(nb_ages).tolist()*(len(columns)*nb_sexes)]
+        res_columns = MultiIndex(levels=[columns, grid.sexes, grid.ages], labels=labels,
+                                 names=['typ', 'sex', 'age'])
+        return DataFrame(hstack(blocks), index=Index(birth_years, name='birth_year'), columns=res_columns)
+
  
     
     def create_age_class(self, step = 1, typ = None):
@@ -103,48 +154,58 @@ class AccountingCohorts(Cohorts):
          
         Parameters
         ----------
-        step : Int
-        The number of years included in the age class
+        step : Int or List
+        The number of years included in the age class, or the list of the first ages of the classes
          
         Returns
         -------
         res : A DataFrame of the Cohorts class with age indexes replaced with class indicies
         """
-        
+        return self.create_age_classes([step], typ)[self._step_key(step)]
+
+    @staticmethod
+    def _step_key(step):
+        return step if isscalar(step) else tuple(step)
+
+    def create_age_classes(self, steps, typ = None):
+        """
+        Regroups the ages in age classes for several class definitions at once. Every column is summed
+        over the age classes, then the columns typ are divided by the summed population 'pop' so that
+        they take in account the change of population over the years.
+         
+        Parameters
+        ----------
+        steps : List
+                The class definitions: numbers of years included in the age classes, 
+                or lists of the first ages of the classes
+        typ : Str or List
+              The columns to weight by the population. Default is the types of the cohort.
+         
+        Returns
+        -------
+        res : a dict of AccountingCohorts indexed by age class, sex and year, whose keys are the steps
+              (lists of first ages are turned into tuples)
+        """
         if typ is None:
             typ = self._types
+        weighted = [typ] if isinstance(typ, basestring) else list(typ)
         
-        # Separating Men and Women
-        pvm = self.xs(0, level='sex')
-        pvf = self.xs(1, level='sex')
-        pvm.reset_index(inplace = True)
-        pvf.reset_index(inplace = True)
-         
-        #Transforming the age indexes
-        serie = array(pvm.age)
-        pvm['age'] = array((serie//step)*step)
-        pvf['age'] = array((serie//step)*step)
-        
-#         #Old version of age class creation using the simulation.percapita_pv
-#         age_class_pvm = pvm.groupby(['age', 'year']).mean()
-#         age_class_pvf = pvf.groupby(['age', 'year']).mean() 
-
-       
-        #New version which takes in account the change of population over the years
-        print pvm        
-        age_class_pvm = pvm.groupby(['age', 'year']).sum()
-        age_class_pvf = pvf.groupby(['age', 'year']).sum()
-        print age_class_pvm
+        cube = self.to_cube()
+        grid = cube.grid
+        class_starts = [age_class_starts(grid.ages, step) for step in steps]
+        sums = age_class_sums(array([cube[col] for col in cube.columns]), class_starts)
         
-        age_class_pvm[typ] *= 1.0/age_class_pvm['pop']
-        age_class_pvf[typ] *= 1.0/age_class_pvf['pop']
-         
-        #Put back the dataframes together
-        pieces = [age_class_pvm, age_class_pvf]
-        res =  concat(pieces, keys = [0,1], names = ["sex"] )
-        res = res.reset_index()
-        res = res.set_index(['age', 'sex', 'year'])
-        return AccountingCohorts(res)            
+        res = dict()
+        for step, starts, values in zip(steps, class_starts, sums):
+            columns = dict(zip(cube.columns, values))
+            for col in weighted:
+                columns[col] = columns[col]/columns['pop']
+            class_grid = CohortGrid(unique(starts), grid.sexes, grid.years)
+            age_class = CohortCube(class_grid, [(col, columns[col]) for col in cube.columns]).to_frame()
+            if isnan(age_class.values).all(axis=1).any():
+                age_class = age_class.dropna(how = 'all')
+            res[self._step_key(step)] = AccountingCohorts(age_class)
+        return res
  
     def compute_ipl(self, typ, net_gov_wealth = None, net_gov_spendings = None, precision=False):
         """
@@ -164,7 +225,8 @@ class AccountingCohorts(Cohorts):
         -------
          
         ipl : float
-            the value of the intertemporal public liability
+            the value of the intertemporal public liability, including the generations born after the 
+            last year when the present values were computed with an infinite horizon tail
         """
         if net_gov_wealth is None:
             net_gov_wealth = 0
@@ -185,14 +247,14 @@ class AccountingCohorts(Cohorts):
          
         future_gen_dataframe = self.xs(0, level = 'age')
         future_gen_dataframe = future_gen_dataframe.cumsum()
-        future_gen_transfer = future_gen_dataframe.get_value((1, year_max), typ)
+        future_gen_transfer = future_gen_dataframe.get_value((1, year_max), typ) + self._tail.get(typ, 0)
 #         print '    future_gen_transfer =', future_gen_transfer
         
         #Note : do not forget to eliminate values counted twice
         ipl = net_gov_spendings - net_gov_wealth - future_gen_transfer - past_gen_transfer + past_gen_dataframe.get_value((0, 0), typ)
         
         if precision:
-            future_gen_transfer_last = future_gen_dataframe.get_value((1, before_year_max), typ)
+            future_gen_transfer_last = future_gen_dataframe.get_value((1, before_year_max), typ) + self._tail.get(typ, 0)
             last_ipl = net_gov_spendings - net_gov_wealth - past_gen_transfer - future_gen_transfer_last + past_gen_dataframe.get_value((0, 0), typ)
             
             to_return = (ipl - last_ipl)/ipl
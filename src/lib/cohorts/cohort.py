@@ -7,16 +7,86 @@ Created on May 22, 2012
 '''
 
 from __future__ import division
-from pandas import DataFrame, read_csv, concat, ExcelFile, HDFStore
-from numpy import NaN, arange, hstack, array
+from copy import deepcopy
+from pandas import DataFrame, Series, read_csv, concat, ExcelFile, HDFStore
+from numpy import NaN, arange, hstack, array, asarray, isscalar, cumprod, concatenate, ones
+from src.lib.cohorts.cube import CohortGrid, CohortCube
+from src.lib.utils import LRUCache
 import os
 
+
+_year_factors = LRUCache(maxsize = 256)
+
+def rate_path(rate, nb_years):
+    """
+    Returns the rates of nb_years years: a constant rate is repeated, a path of rates by year
+    is cut or extended with its last rate
+    """
+    if isscalar(rate):
+        return rate + 0*arange(nb_years, dtype=float)
+    rate = asarray(rate, dtype=float)
+    return hstack([rate, rate[-1].repeat(max(nb_years - len(rate), 0))])[:nb_years]
+
+def long_run_rate(rate, nb_years):
+    """
+    Returns the rate after the last of nb_years years, the rate itself if it is constant. A path of 
+    rates is cut or extended to nb_years years as in rate_path: the rate of its last year applies
+    from then on.
+    """
+    if isscalar(rate):
+        return rate
+    rate = asarray(rate, dtype=float)
+    return float(rate[min(nb_years, len(rate)) - 1])
+
+def rate_key(rate):
+    """
+    Returns a hashable key of a constant rate or of a path of rates
+    """
+    return rate if isscalar(rate) else tuple(asarray(rate, dtype=float))
+
+def path_factors(rates, nb_years, discount=False):
+    """
+    Returns the compounding factors of several paths of rates by year, of shape (..., year), or their 
+    discount factors if discount is True: the cumulative products of 1+rate, every path being cut
+    or extended with its last rate as in rate_path. Unlike year_factors, the factors are not cached.
+    """
+    rates = asarray(rates, dtype=float)
+    missing = max(nb_years - rates.shape[-1], 0)
+    rates = concatenate([rates, rates[..., -1:].repeat(missing, axis=-1)], axis=-1)[..., :nb_years]
+    factors = ones(rates.shape)
+    factors[..., 1:] = cumprod(1 + rates[..., :-1], axis=-1)
+    if discount:
+        factors = 1/factors
+    return factors
+
+def year_factors(rate, nb_years, discount=False):
+    """
+    Returns the cached vector of compounding factors (1+rate)**t for t in range(nb_years),
+    or of discount factors 1/(1+rate)**t if discount is True.
+    The rate can be a path of rates by year (see rate_path), the rate of year t applying from year t 
+    to year t+1: the factors are then the cumulative products of 1+rate. The vector is shared by every 
+    cohort and scenario with the same rates: it must not be modified in place.
+    """
+    def create():
+        if isscalar(rate):
+            factors = (1+rate)**arange(nb_years)
+        else:
+            factors = path_factors(rate, nb_years)
+        if discount:
+            factors = 1/factors
+        factors.flags.writeable = False
+        return factors
+    return _year_factors.get_or_create((rate_key(rate), nb_years, discount), create)
+
 class Cohorts(DataFrame):
     """
     Stores data for some cohortes. Data should be a data frame with multindexing and at most one 
     column dimension. 
     Default columns are 'year', set col_names if different.
     """
+    # Attributes kept by clone
+    _state = ['index_sets', '_begin', '_end', '_agemin', '_agemax', '_agg', '_nb_type', '_types',
+              '_types_years', '_year_min', '_year_max', '_factors', 'name']
     def __init__(self, data=None, index=None, columns=None, 
                  dtype=None, copy=False):
         super(Cohorts, self).__init__(data, index, columns , dtype, copy)
@@ -36,6 +106,8 @@ class Cohorts(DataFrame):
             self._types_years = dict()   # TODO: merge this dict with the previous list
             self._year_min = None
             self._year_max = None
+            self._grid = None
+            self._factors = dict()
             self.name = None
             self.post_init()
 
@@ -44,10 +116,10 @@ class Cohorts(DataFrame):
         """
         Post initialization, computes index_sets, _agemin, _agemax attributes
         """
-        temp = zip(*self.index)
-        name = self.index.names 
-        for t, n in zip(temp, name):
-            self.index_sets[n] = set(t)
+        grid = self.grid
+        self.index_sets['age'] = set(grid.ages)
+        self.index_sets['sex'] = set(grid.sexes)
+        self.index_sets['year'] = set(grid.years)
 
         self._agemin = min(self.index_sets['age'])
         self._agemax = max(self.index_sets['age'])
@@ -55,6 +127,100 @@ class Cohorts(DataFrame):
         self._year_max = max(self.index_sets['year'])
 
 
+    def clone(self):
+        """
+        Returns a copy of the cohort and of its attributes (types, per-year factors, projection parameters)
+        """
+        res = self.__class__(DataFrame.copy(self))
+        for attribute in self._state:
+            setattr(res, attribute, deepcopy(getattr(self, attribute)))
+        return res
+
+    @property
+    def grid(self):
+        """
+        The CohortGrid mapping (age, sex, year) labels to array offsets, rebuilt when the index changes
+        """
+        cached = getattr(self, '_grid', None)
+        if cached is None or cached[0] is not self.index:
+            grid = CohortGrid.from_index(self.index)
+            self._grid = (self.index, grid, grid.row_offsets(self.index))
+        return self._grid[1]
+
+    @property
+    def row_offsets(self):
+        """
+        The age, sex and year offsets of every row of the cohort in its grid
+        """
+        self.grid
+        return self._grid[2]
+
+    def __getitem__(self, key):
+        factors = getattr(self, '_factors', None)
+        if factors and isinstance(key, basestring) and key in factors and key not in self.columns:
+            return self.factor(key)
+        return super(Cohorts, self).__getitem__(key)
+
+    def get_value(self, index, col):
+        factors = getattr(self, '_factors', None)
+        if factors and col in factors and col not in self.columns:
+            year = index[self.index.names.index('year')]
+            return factors[col][self.grid.year_offset(year)]
+        return super(Cohorts, self).get_value(index, col)
+
+    def set_factor(self, name, values):
+        """
+        Stores a per-year factor which is broadcast over ages and sexes when read as cohort[name].
+        A factor is not a column: clone keeps it but the DataFrame methods returning a new frame 
+        (copy, xs, ...) do not, and save_simulation writes it as a column.
+        
+        Parameters
+        ----------
+        name : str
+               Name of the factor
+        values : array
+                 One value per year of the cohort, in increasing year order
+        """
+        if len(values) != len(self.grid.years):
+            raise Exception('factor %s should have one value per year' % name)
+        self._factors[name] = values
+
+    def factor(self, name, per_year=False):
+        """
+        Returns the factor name broadcast to every row of the cohort
+        
+        Parameters
+        ----------
+        name : str
+               Name of the factor (for instance 'grth', 'dsct' or 'actualization')
+        per_year : boolean, default False
+                   if True returns the per-year vector instead of the broadcast Series
+        """
+        if name not in self._factors:
+            raise Exception('%s is not a factor of the cohort' % name)
+        if per_year:
+            return Series(self._factors[name], index=self.grid.years)
+        year = self.row_offsets[2]
+        return Series(self._factors[name][year], index=self.index, name=name)
+
+    def to_cube(self, columns=None):
+        """
+        Returns the columns of the cohort as a CohortCube of ndarray[age, sex, year]
+        
+        Parameters
+        ----------
+        columns : list, default None
+                  the columns to store in the cube, all the columns if None
+        """
+        return CohortCube.from_frame(self, columns, grid=self.grid, offsets=self.row_offsets)
+
+    @classmethod
+    def from_cube(cls, cube, columns=None):
+        """
+        Builds a cohort from the columns of a CohortCube
+        """
+        return cube.to_frame(columns, cls=cls)
+
     def totaux(self, by, column, pivot = False):
         """
         Compute a pivot table 
@@ -83,18 +249,20 @@ class Cohorts(DataFrame):
         return df 
             
     
-    def new_type(self, name ):
+    def new_type(self, name, values=NaN):
         """
-        Creates a new empty column
+        Creates a new column, empty unless values are given
         
         Parameters
         ----------
         
         name : str
-               Name of the new empty column
+               Name of the new column
+        values : scalar or array, default NaN
+                 Initial values of the column
         """
         if name not in self._types:
-            self[name] = NaN
+            self[name] = values
             self._nb_type += 1
             self._types.append(name)
         else:
@@ -164,48 +332,73 @@ class Cohorts(DataFrame):
 
     
     def gen_grth(self, g):
+        """
+        Generates the growth factor 'grth' = (1+g)**t, broadcast lazily over ages and sexes.
+        g can be a path of growth rates by year (see year_factors).
+        """
         self._growth_rate = g
-        self['grth'] = NaN
-        grouped = self.groupby(level = ['sex', 'age'])['grth']
-        nb_years = len(self.index_sets['year'])
-        self['grth'] = grouped.transform(lambda x: ((1+g)**(arange(nb_years))))
+        self.set_factor('grth', year_factors(g, len(self.grid.years)))
 
     def gen_dsct(self, r):
+        """
+        Generates the discount factor 'dsct' = 1/(1+r)**t, broadcast lazily over ages and sexes.
+        r can be a path of discount rates by year (see year_factors).
+        """
         self._discount_rate = r 
-        self['dsct'] = NaN
-        grouped = self.groupby(level = ['sex', 'age'])['dsct']
-        nb_years = len(self.index_sets['year'])
-        self['dsct'] = grouped.transform(lambda x: 1/((1+r)**arange(nb_years)))
+        self.set_factor('dsct', year_factors(r, len(self.grid.years), discount=True))
     
     def gen_actualization(self, arg1 , arg2):
         """
-        A method to generate a column of actualization coefficients to be used with profiles data
+        A method to generate the actualization coefficients to be used with profiles data.
+        They are stored as the per-year factor 'actualization'.
         
         Parameters
         ----------
-        arg1 : any growth rate 
-        arg2 : any discount rate (such as interest rate)
+        arg1 : any growth rate, or path of growth rates by year
+        arg2 : any discount rate (such as interest rate), or path of discount rates by year
         """
-        self['actualization']= NaN
-        grouped = self.groupby(level = ['sex', 'age'])['actualization']
-        nb_years = len(self.index_sets['year'])
-        self['actualization'] = grouped.transform(lambda x: ((1+ arg1)/(1+ arg2)**arange(nb_years)))        
+        nb_years = len(self.grid.years)
+        self.set_factor('actualization', (1+ rate_path(arg1, nb_years))/year_factors(arg2, nb_years))
+
 
+    def row_mask(self, age=None, sex=None, year=None):
+        """
+        Returns a boolean mask of the rows of the cohort whose labels are selected, None if every row is.
+        The mask is built from the membership of the labels of each level (see CohortGrid.select).
+        
+        Parameters
+        ----------
+        age, sex, year : scalar, List or slice, default None
+                         The selected labels of each level, every label if None
+        """
+        grid = self.grid
+        selected = None
+        for name, labels, offsets in zip(['age', 'sex', 'year'], [age, sex, year], self.row_offsets):
+            if labels is None:
+                continue
+            level_selected = grid.select(name, labels)[offsets]
+            selected = level_selected if selected is None else selected & level_selected
+        return selected
 
-    def filter_value(self, age=None, sex=None, year=None, typ=None):
+    def filter_value(self, age=None, sex=None, year=None, typ=None, copy=True):
         """
         A method to filter a multi-index Cohort in an easy fashion.
+        The rows are selected with the offsets of the labels in the grid of the cohort.
         
         Parameters
         ----------
-        age : List
-            The values of the age index have to be between 0 and 100 included
-        sex : 0 or 1
+        age : scalar, List or slice
+            The ages we are interested in. A slice selects the ages between its bounds included.
+        sex : 0, 1 or List
             The sex index we are interested in. 0 stands for males and 1 for females. Default is both.
-        year : List
-            The years we are interested in.
-        typ : Str
+        year : scalar, List or slice
+            The years we are interested in. A slice selects the years between its bounds included.
+        typ : Str or List
             The data we want to select
+        copy : boolean, default True
+            If False and the selected rows are contiguous (for instance a range of ages of a sorted cohort)
+            the values of the returned cohort are a view on the values of this cohort, which avoids a copy
+            but changes this cohort when the returned one is changed in place.
             
         Returns
         -------
@@ -214,56 +407,28 @@ class Cohorts(DataFrame):
         #Setting up defaults arguments if not given
         if typ is None:
             typ = self._types
-        #Setting up filter to check if the arguments are valid
-#         if typ not in self._types:
-#             raise Exception('This is not a valid column of the cohort')
-        #Setting up filters
-        if age is not None:
-            filter_age = array([x in age for x in self.index.get_level_values(0)])
-        if sex is not None:
-            filter_sex = array(self.index.get_level_values(1) == sex)     
-        if year is not None:
-            filter_year = array([x in year for x in self.index.get_level_values(2)])
+        columns = [typ] if isinstance(typ, basestring) else list(typ)
+        
+        selected = self.row_mask(age, sex, year)
         
         #Filtering the cohort
-        if age is None:
-            if sex is None:
-                if year is None:
-                    restricted_cohort = self.loc[:, typ]  
-#                     return restricted_cohort
-                else:
-                    restricted_cohort = self.loc[filter_year, typ]
-#                     return restricted_cohort
-            else:
-                if year is None:
-                    restricted_cohort = self.loc[filter_sex, typ]
-#                     return restricted_cohort
-                else:
-                    filter_SY = array(filter_sex & filter_year)
-                    restricted_cohort = self.loc[filter_SY, typ]
-#                     return restricted_cohort
+        if selected is None:
+            rows = slice(None)
         else:
-            if sex is None:
-                if year is None:
-                    restricted_cohort = self.loc[filter_age, typ]  
-#                     return restricted_cohort
-                else:
-                    filter_AY = array(filter_age & filter_year)
-                    restricted_cohort = self.loc[filter_AY, typ]
-#                     return restricted_cohort
+            positions = selected.nonzero()[0]
+            if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+                rows = slice(positions[0], positions[-1] + 1)
             else:
-                if year is None:
-                    filter_AS = array(filter_age & filter_sex)
-                    restricted_cohort = self.loc[filter_AS, typ]
-#                     return restricted_cohort
-                else:
-                    filter3 = array(filter_age & filter_sex & filter_year)
-#                     print filter3
-                    restricted_cohort = self.loc[ filter3, typ]
-#                     return restricted_cohort
-        restricted_cohort_ = Cohorts(restricted_cohort)
-        restricted_cohort_.columns = [typ]
-        return restricted_cohort_
+                rows = positions
+        values = [self[col].values for col in columns]
+        if len(values) == 1:
+            # A 2d slice of the column keeps sharing its memory
+            data = values[0][rows][:, None]
+            if copy and isinstance(rows, slice):
+                data = data.copy()
+        else:
+            data = dict((col, value[rows]) for col, value in zip(columns, values))
+        return Cohorts(DataFrame(data, index=self.index[rows], columns=columns))
 
 
 
@@ -0,0 +1,454 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Dense ndarray[age, sex, year] storage of the cohorts and the array kernels of the present values
+'''
+from __future__ import division
+from pandas import DataFrame, MultiIndex
+from numpy import (array, asarray, empty, zeros, NaN, unique, searchsorted, arange, isscalar,
+                   hstack, isnan, where, add)
+from numpy.lib.stride_tricks import as_strided
+
+INDEX_NAMES = ['age', 'sex', 'year']
+
+
+class CohortGrid(object):
+    """
+    Label <-> offset mapping of a full rectangular (age, sex, year) grid.
+    Offsets are the positions of the labels in the sorted arrays of ages, sexes and years.
+    """
+    def __init__(self, ages, sexes, years):
+        self.ages = array(sorted(ages))
+        self.sexes = array(sorted(sexes))
+        self.years = array(sorted(years))
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Builds the grid spanned by the labels actually used in a (age, sex, year) MultiIndex
+        """
+        values = dict()
+        for name in INDEX_NAMES:
+            level = index.names.index(name)
+            values[name] = index.levels[level].values[unique(index.labels[level])]
+        return cls(values['age'], values['sex'], values['year'])
+
+    @property
+    def shape(self):
+        return (len(self.ages), len(self.sexes), len(self.years))
+
+    @property
+    def size(self):
+        return len(self.ages)*len(self.sexes)*len(self.years)
+
+    def __eq__(self, other):
+        return (isinstance(other, CohortGrid) and self.shape == other.shape and
+                (self.ages == other.ages).all() and (self.sexes == other.sexes).all() and
+                (self.years == other.years).all())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def lookup(self, name, labels):
+        """
+        Returns the offsets of labels along the axis name ('age', 'sex' or 'year')
+        and a boolean mask of the labels found in the grid. Offsets of missing labels are meaningless.
+        """
+        values = getattr(self, {'age': 'ages', 'sex': 'sexes', 'year': 'years'}[name])
+        labels = asarray(labels)
+        offsets = searchsorted(values, labels).clip(0, max(len(values)-1, 0))
+        return offsets, values[offsets] == labels
+
+    def select(self, name, labels):
+        """
+        Returns a boolean mask over the labels of the axis name ('age', 'sex' or 'year')
+        flagging the selected labels
+
+        Parameters
+        ----------
+        name : str
+               the axis, 'age', 'sex' or 'year'
+        labels : scalar, list, range or slice
+                 the selected labels. A slice selects the labels between its start and stop included,
+                 as label slices of pandas do.
+        """
+        values = getattr(self, {'age': 'ages', 'sex': 'sexes', 'year': 'years'}[name])
+        if isinstance(labels, slice):
+            start = 0 if labels.start is None else searchsorted(values, labels.start, 'left')
+            stop = len(values) if labels.stop is None else searchsorted(values, labels.stop, 'right')
+            selected = zeros(len(values), dtype=bool)
+            selected[start:stop] = True
+            return selected
+        if isscalar(labels):
+            labels = [labels]
+        offsets, found = self.lookup(name, list(labels))
+        selected = zeros(len(values), dtype=bool)
+        selected[offsets[found]] = True
+        return selected
+
+    def _offset(self, labels, values, name):
+        labels = asarray(labels)
+        offsets = searchsorted(values, labels)
+        if (offsets >= len(values)).any() or (values[offsets.clip(0, len(values)-1)] != labels).any():
+            raise Exception('%s labels are not in the grid' % name)
+        return offsets
+
+    def age_offset(self, age):
+        return self._offset(age, self.ages, 'age')
+
+    def sex_offset(self, sex):
+        return self._offset(sex, self.sexes, 'sex')
+
+    def year_offset(self, year):
+        return self._offset(year, self.years, 'year')
+
+    def offset(self, age, sex, year):
+        """
+        Returns the (age, sex, year) offsets of the given labels
+        """
+        return self.age_offset(age), self.sex_offset(sex), self.year_offset(year)
+
+    def row_offsets(self, index):
+        """
+        Returns the age, sex and year offsets of every row of a (age, sex, year) MultiIndex
+        """
+        offsets = []
+        for name, values in zip(INDEX_NAMES, [self.ages, self.sexes, self.years]):
+            level = index.names.index(name)
+            level_values = index.levels[level].values
+            level_offsets = searchsorted(values, level_values).clip(0, max(len(values)-1, 0))
+            labels = index.labels[level]
+            if len(labels) and (values[level_offsets[labels]] != level_values[labels]).any():
+                raise Exception('%s labels are not in the grid' % name)
+            offsets.append(level_offsets[labels])
+        return tuple(offsets)
+
+    def index(self):
+        """
+        Returns the (age, sex, year) MultiIndex of the grid in lexicographic order
+        """
+        if getattr(self, '_index', None) is None:
+            self._index = self._build_index()
+        return self._index
+
+    def _build_index(self):
+        nb_ages, nb_sexes, nb_years = self.shape
+        labels = [arange(nb_ages).repeat(nb_sexes*nb_years),
+                  arange(nb_sexes).repeat(nb_years).tolist()*nb_ages,
+                  arange(nb_years).tolist()*(nb_ages*nb_sexes)]
+        return MultiIndex(levels=[self.ages, self.sexes, self.years], labels=labels,
+                          names=list(INDEX_NAMES))
+
+
+class CohortCube(object):
+    """
+    Stores cohort columns as contiguous ndarray[age, sex, year] cubes sharing a CohortGrid.
+    This is the array backend of Cohorts: a DataFrame view is only built on demand with to_frame.
+    """
+    def __init__(self, grid, columns=None):
+        self.grid = grid
+        self._columns = list()
+        self._data = dict()
+        if columns is not None:
+            for name, values in columns:
+                self[name] = values
+
+    @classmethod
+    def from_frame(cls, df, columns=None, grid=None, offsets=None):
+        """
+        Builds a cube from a DataFrame indexed by age, sex and year
+
+        Parameters
+        ----------
+        df : DataFrame
+             a dataframe with an (age, sex, year) MultiIndex
+        columns : list, default None
+                  the columns to store, all the columns if None
+        grid : CohortGrid, default None
+               the grid of the cube, spanned by the index of df if None
+        offsets : tuple, default None
+                  the row offsets of df in grid if already known
+        """
+        if grid is None:
+            grid = CohortGrid.from_index(df.index)
+        if columns is None:
+            columns = list(df.columns)
+        if offsets is None:
+            offsets = grid.row_offsets(df.index)
+        age, sex, year = offsets
+        cube = cls(grid)
+        for name in columns:
+            values = cls.empty_values(grid)
+            values[age, sex, year] = df[name].values
+            cube[name] = values
+        return cube
+
+    @staticmethod
+    def empty_values(grid):
+        """
+        Returns a cube of the shape of grid filled with NaN
+        """
+        values = empty(grid.shape)
+        values.fill(NaN)
+        return values
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __getitem__(self, name):
+        return self._data[name]
+
+    def __setitem__(self, name, values):
+        values = asarray(values, dtype=float)
+        if values.shape != self.grid.shape:
+            raise Exception('%s has shape %s instead of %s' % (name, values.shape, self.grid.shape))
+        if name not in self._data:
+            self._columns.append(name)
+        self._data[name] = values
+
+    def __delitem__(self, name):
+        del self._data[name]
+        self._columns.remove(name)
+
+    def get_value(self, key, name):
+        """
+        Returns the value of column name at the (age, sex, year) label key
+        """
+        return self._data[name][self.grid.offset(*key)]
+
+    def to_frame(self, columns=None, cls=DataFrame):
+        """
+        Returns the cube as a DataFrame (or a subclass given in cls) indexed by age, sex and year
+        """
+        if columns is None:
+            columns = self._columns
+        data = dict((name, self._data[name].ravel()) for name in columns)
+        return cls(DataFrame(data, index=self.grid.index(), columns=columns))
+
+
+def diagonal_suffix_sum(values):
+    """
+    Sums values along each birth cohort diagonal from (age, year) to the end of the grid, ie
+    res[a, s, y] = values[a, s, y] + res[a+1, s, y+1], for every sex in one array pass.
+    This is the backward recursion of generational present values.
+
+    Parameters
+    ----------
+    values : ndarray
+             an array of shape (..., age, sex, year), leading axes are batched
+
+    Returns
+    -------
+    res : ndarray of the same shape as values
+    """
+    values = asarray(values, dtype=float)
+    return _diagonal_suffix_sum(values, diagonal_positions(*values.shape[-3:]))
+
+
+def diagonal_positions(nb_ages, nb_sexes, nb_years):
+    """
+    Returns the position of every (age, sex, year) cell, in this order, in a flattened
+    (sex, birth cohort, age) array where each birth cohort is a row
+    """
+    nb_cohorts = nb_ages + nb_years - 1
+    age = arange(nb_ages)[:, None, None]
+    sex = arange(nb_sexes)[None, :, None]
+    year = arange(nb_years)[None, None, :]
+    cohort = year - age + nb_ages - 1
+    return ((sex*nb_cohorts + cohort)*nb_ages + age).ravel()
+
+
+def _diagonal_suffix_sum(values, positions):
+    nb_ages = values.shape[-3]
+    batch = values.shape[:-3]
+    # Shear the (age, year) plane so that each birth cohort is a row of the (cohort, age) plane
+    sheared = zeros(batch + (values.shape[-2]*(nb_ages + values.shape[-1] - 1)*nb_ages,))
+    sheared[..., positions] = values.reshape(batch + (-1,))
+    sheared = sheared.reshape(batch + (-1, nb_ages))[..., ::-1].cumsum(axis=-1)[..., ::-1]
+    return sheared.reshape(batch + (-1,))[..., positions].reshape(values.shape)
+
+
+class PresentValueOperator(object):
+    """
+    The linear operator mapping yearly flows to generational present values on a grid for a discount rate:
+    flows are discounted to the first year of the grid then summed along the birth cohort diagonals.
+    It only depends on the grid and the discount rate, so it is built once and applied to any profile.
+    """
+    def __init__(self, grid, discount_factors):
+        """
+        Parameters
+        ----------
+        grid : CohortGrid
+               the grid of the flows
+        discount_factors : array
+                           one discount factor per year of the grid
+        """
+        self.grid = grid
+        self.discount_factors = asarray(discount_factors, dtype=float)
+        self._positions = diagonal_positions(*grid.shape)
+
+    def discount(self, values):
+        """
+        Returns the flows values of shape (..., age, sex, year) discounted to the first year of the grid
+        """
+        return asarray(values, dtype=float)*self.discount_factors
+
+    def accumulate(self, values):
+        """
+        Returns the sums of discounted flows of shape (..., age, sex, year) along the birth cohort diagonals
+        """
+        values = asarray(values, dtype=float)
+        if values.shape[-3:] != self.grid.shape:
+            raise Exception('flows of shape %s do not match the grid %s' % (values.shape[-3:], self.grid.shape))
+        return _diagonal_suffix_sum(values, self._positions)
+
+    def apply(self, values):
+        """
+        Returns the generational present values of the flows values of shape (..., age, sex, year)
+        """
+        return self.accumulate(self.discount(values))
+
+
+def birth_cohort_view(values):
+    """
+    Rearranges a cube along its birth cohort diagonals: res[s, c, a] = values[a, s, c + a - (nb_ages-1)],
+    ie row c holds the life path of the generation born nb_ages-1-c years before the first year of the grid.
+    Ages outside the years of the grid are NaN. The result is a strided view on a padded copy of values.
+
+    Parameters
+    ----------
+    values : ndarray
+             an array of shape (age, sex, year)
+
+    Returns
+    -------
+    res : ndarray of shape (sex, age + year - 1, age)
+    """
+    values = asarray(values, dtype=float)
+    nb_ages, nb_sexes, nb_years = values.shape
+    padded = empty((nb_ages, nb_sexes, nb_years + 2*(nb_ages-1)))
+    padded.fill(NaN)
+    padded[:, :, nb_ages-1:nb_ages-1+nb_years] = values
+    age_stride, sex_stride, year_stride = padded.strides
+    return as_strided(padded, shape=(nb_sexes, nb_ages + nb_years - 1, nb_ages),
+                      strides=(sex_stride, year_stride, age_stride + year_stride))
+
+
+def age_class_starts(ages, step):
+    """
+    Returns the first age of the age class of every age
+
+    Parameters
+    ----------
+    ages : array
+           sorted ages
+    step : int or list
+           the size of the age classes, or the list of the first ages of the classes
+    """
+    ages = asarray(ages)
+    if isscalar(step):
+        return (ages//step)*step
+    edges = array(sorted(step))
+    if len(edges) == 0 or edges[0] > ages[0]:
+        raise Exception('the first age class should start at or before age %s' % ages[0])
+    return edges[searchsorted(edges, ages, 'right') - 1]
+
+
+def age_class_sums(values, class_starts):
+    """
+    Sums values over several partitions of the ages in age classes, reading values only once:
+    the partitions are summed from their common refinement.
+
+    Parameters
+    ----------
+    values : ndarray
+             an array of shape (..., age, sex, year), NaN are ignored
+    class_starts : list of arrays
+                   for each partition, the first age of the class of every age (see age_class_starts)
+
+    Returns
+    -------
+    sums : list of ndarray
+           for each partition, an array of shape (..., class, sex, year). Classes without any value are NaN.
+    """
+    values = asarray(values, dtype=float)
+    age_axis = values.ndim - 3
+    # Positions where a class starts, in each partition and in their common refinement
+    bounds = [hstack([[0], (starts[1:] != starts[:-1]).nonzero()[0] + 1]) for starts in class_starts]
+    fine_bounds = unique(hstack(bounds))
+    missing = isnan(values)
+    fine = add.reduceat(where(missing, 0, values), fine_bounds, axis=age_axis)
+    fine_counts = add.reduceat(~missing, fine_bounds, axis=age_axis)
+    sums = []
+    for partition_bounds in bounds:
+        positions = searchsorted(fine_bounds, partition_bounds)
+        partition = add.reduceat(fine, positions, axis=age_axis)
+        counts = add.reduceat(fine_counts, positions, axis=age_axis)
+        partition[counts == 0] = NaN
+        sums.append(partition)
+    return sums
+
+
+def tail_completion(last, ratio):
+    """
+    Completes the flows of the last year of a grid with their constant growth continuation:
+    res[a, s] = sum over k >= 1 of last[a+k, s]*ratio**k, ie the flows received after the last year
+    by the people aged a in the last year, when the age profile is shifted by ratio every year.
+
+    Parameters
+    ----------
+    last : ndarray
+           flows of the last year, of shape (..., age, sex)
+    ratio : float or ndarray
+            growth ratio of discounted flows from one year to the next, of the shape of the leading axes of last
+    """
+    last = asarray(last, dtype=float)
+    ratio = asarray(ratio, dtype=float)[..., None]
+    res = zeros(last.shape)
+    accumulated = zeros(last.shape[:-2] + last.shape[-1:])
+    for age in range(last.shape[-2]-1, -1, -1):
+        res[..., age, :] = ratio*accumulated
+        accumulated = last[..., age, :] + ratio*accumulated
+    return res
+
+
+def tail_completion_derivative(last, ratio):
+    """
+    Returns the derivative of tail_completion(last, ratio) with respect to ratio:
+    res[a, s] = sum over k >= 1 of k*last[a+k, s]*ratio**(k-1)
+
+    Parameters
+    ----------
+    last : ndarray
+           flows of the last year, of shape (..., age, sex)
+    ratio : float or ndarray
+            growth ratio of discounted flows, of the shape of the leading axes of last
+    """
+    last = asarray(last, dtype=float)
+    ratio = asarray(ratio, dtype=float)[..., None]
+    res = zeros(last.shape)
+    accumulated = zeros(last.shape[:-2] + last.shape[-1:])
+    derivative = zeros(accumulated.shape)
+    for age in range(last.shape[-2]-1, -1, -1):
+        derivative = accumulated + ratio*derivative
+        res[..., age, :] = derivative
+        accumulated = last[..., age, :] + ratio*accumulated
+    return res
+
+
+def geometric_remainder(ratio):
+    """
+    Returns the sum of ratio**k for k >= 1
+    """
+    ratio = asarray(ratio, dtype=float)
+    if (ratio >= 1).any():
+        raise Exception('the infinite horizon tail does not converge (growth ratio %s >= 1)' % ratio)
+    return ratio/(1 - ratio)
+
+
+if __name__ == '__main__':
+    pass
@@ -7,9 +7,14 @@ Created on 14 mai 2013
 '''
 from __future__ import division
 from pandas import DataFrame, read_csv, concat, ExcelFile, HDFStore
-from numpy import NaN, arange, hstack, array
+from numpy import NaN, arange, hstack, array, empty, zeros, isnan, add
 from src.lib.cohorts.accounting_cohorts import AccountingCohorts
-from src.lib.cohorts.cohort import Cohorts
+from src.lib.cohorts.cohort import Cohorts, year_factors, long_run_rate, rate_key
+from src.lib.cohorts.cube import (CohortGrid, PresentValueOperator, tail_completion, geometric_remainder)
+from src.lib.utils import LRUCache
+
+# Present value operators shared by the cohorts with the same grid and discount rate
+_present_value_operators = LRUCache(maxsize = 16)
 
 class DataCohorts(Cohorts):
     '''
@@ -18,11 +23,16 @@ class DataCohorts(Cohorts):
     Default columns are 'year', set col_names if different.
     Methods of this class allow to fill the object and create accounting_Cohorts objects.
     '''
+    _state = Cohorts._state + ['_types_growth', '_net_definitions', '_population_growth_rate']
 
 
     def __init__(self, data=None, index=None, columns=None, 
                  dtype=None, copy=False):
         super(DataCohorts, self).__init__(data, index, columns , dtype, copy)
+        if data is not None:
+            self._types_growth = dict()   # yearly growth factor of each projected profile
+            self._net_definitions = dict()   # (weight, profile) pairs combined into each net transfer
+            self._population_growth_rate = None
 
         
     def set_population_from_csv(self, datafile):
@@ -56,38 +66,36 @@ class DataCohorts(Cohorts):
             df = DataFrame(df)
 
         for col_name in df.columns:
-            if col_name not in self._types:
-                self.new_type(col_name)
-                typ = col_name
-                tmp = df[typ]
-                tmp = tmp.unstack(level="year")
-                tmp = tmp.dropna(axis=1, how="all")
-                self._types_years[typ] = tmp.columns
-                
-            else:
+            if col_name in self._types:
                 raise Exception("column already exists")
-        
-        if year is None:
-            df_insert = df.reset_index(level='year', drop=True)
-            years = sorted(self.index_sets['year'])
-            list_df = [df_insert] * len(years)
-            df_tot = concat(list_df, keys = years, names =['year'])
-            df_tot = df_tot.reorder_levels(['age','sex','year'], axis=0)
-            
-        else:
-            yr = year
-            df_tot = None
-            df_insert = df.reset_index()
-            df_insert['year'] = yr
-            if df_tot is None:
-                df_tot = df_insert
+
+        # Profiles are stored once per age and sex and broadcast to every row with one take
+        grid = self.grid
+        age, sex, yr = self.row_offsets
+        profile_age, found_age = grid.lookup('age', df.index.get_level_values('age'))
+        profile_sex, found_sex = grid.lookup('sex', df.index.get_level_values('sex'))
+        found = found_age & found_sex
+        profile_age, profile_sex = profile_age[found], profile_sex[found]
+        if year is not None:
+            filled = (yr == grid.year_offset(year))
+            age, sex = age[filled], sex[filled]
+
+        for typ in df.columns:
+            tmp = df[typ]
+            tmp = tmp.unstack(level="year")
+            tmp = tmp.dropna(axis=1, how="all")
+            self._types_years[typ] = tmp.columns
+
+            profile = empty(grid.shape[:2])
+            profile.fill(NaN)
+            profile[profile_age, profile_sex] = df[typ].values[found]
+            if year is None:
+                self.new_type(typ, profile[age, sex])
             else:
-                df_tot.append(df_insert, ignore_index=True)
-                df_tot = df_tot.set_index(['age','sex','year'])
-        
-#         print df_tot
-#         print len(df_tot)
-        self.update(df_tot)
+                self.new_type(typ)
+                values = self[typ].values.copy()
+                values[filled] = profile[age, sex]
+                self[typ] = values
 
 
     def population_project(self, year_length = None, method = None, growth_rate = None):
@@ -100,6 +108,9 @@ class DataCohorts(Cohorts):
                       Duration to continue the population projection
         method : str, default None
                  The value must be 'stable' or 'exp_growth'  
+        growth_rate : float, default None
+                      The growth rate of the population for the 'exp_growth' method.
+                      It is recorded as the growth rate of the infinite horizon tail
         """
 
         if 'pop' not in self.columns:
@@ -115,6 +126,7 @@ class DataCohorts(Cohorts):
         if ( first_year + year_length ) > last_year:
             new_last_year = first_year + year_length
         else:
+            self._population_growth_rate = growth_rate if method == 'exp_growth' else 0
             return
 
         if method == 'stable':
@@ -127,6 +139,7 @@ class DataCohorts(Cohorts):
             pop = pop.reorder_levels(['age','sex','year'], axis=0)
             combined = self.combine_first(pop)
             self.__init__(data = combined, columns = ['pop'])
+            self._population_growth_rate = 0
             
 
         if method == 'exp_growth':
@@ -143,10 +156,10 @@ class DataCohorts(Cohorts):
             pop = Cohorts(pop)
             pop.gen_grth(growth_rate)
             pop['pop'] *= pop['grth']
-            del pop['grth']
             
             combined = self.combine_first(pop)
             self.__init__(data = combined, columns = ['pop'])
+            self._population_growth_rate = growth_rate
 
 
     def proj_tax(self, rate = None , inflation_rate = None , typ = None, method = None, payments_list=[]):
@@ -159,8 +172,9 @@ class DataCohorts(Cohorts):
         Parameters
         ----------        
         rate : float,
-               Growth rate of the economy
-        discount_rate : float
+               Growth rate of the economy, or path of growth rates by year (see year_factors)
+        inflation_rate : float
+                         Inflation rate, or path of inflation rates by year
         typ : the type of data which has to be expanded.
             The cohort should have one column for the population and at least one other column (the profile)
             which will be expanded
@@ -186,20 +200,17 @@ class DataCohorts(Cohorts):
             self.gen_grth(rate)
             if method == "per_capita":
                 self[typ] = self[typ]*self['grth']
+                self._types_growth[typ] = 1 + long_run_rate(rate, len(self.grid.years))
                 
             if method == 'desynchronized':
                 for tax in typ:
                     self[tax] *= self['grth']
+                    self._types_growth[tax] = 1 + long_run_rate(rate, len(self.grid.years))
                 
-                self['inflation'] = NaN
-                grouped = self.groupby(level = ['sex', 'age'])['inflation']
-                nb_years = len(self.index_sets['year'])
-                self['inflation'] = grouped.transform(lambda x: ((1+inflation_rate)**(arange(nb_years))))
-                
+                self.set_factor('inflation', year_factors(inflation_rate, len(self.grid.years)))
                 for payment in payments_list:
                     self[payment] *= self['inflation']
-                
-                del self['inflation']
+                    self._types_growth[payment] = 1 + long_run_rate(inflation_rate, len(self.grid.years))
                 
             if method == "aggregate":
                 typ_years = self._types_years[typ]
@@ -214,13 +225,72 @@ class DataCohorts(Cohorts):
                 
                 
                 self[typ] = self[typ]*self['grth']*frozen_pop["pop"]/self["pop"]
+                self._types_growth[typ] = (1 + long_run_rate(rate, len(self.grid.years)))/(1 + (self._population_growth_rate or 0))
                 # print self
 #             else:
 #                 raise NotImplementedError
 
-    def compute_net_transfers(self, name = 'net_transfers', taxes_list = [], payments_list = []):
+    def year_values(self, typ, year):
+        """
+        Returns the values of the column typ in the given year as an array of shape (age, sex)
+        """
+        grid = self.grid
+        age, sex, yr = self.row_offsets
+        in_year = (yr == grid.year_offset(year))
+        values = empty(grid.shape[:2])
+        values.fill(NaN)
+        values[age[in_year], sex[in_year]] = self[typ].values[in_year]
+        return values
+
+    def extend_years(self, nb_years):
+        """
+        Extends the cohort by nb_years years, reusing the years already projected.
+        The population and every projected profile keep growing at their projection rates,
+        net transfers are recombined from their components and factors keep their yearly ratio.
+        
+        Parameters
+        ----------
+        nb_years : int
+                   Number of years to add after the last year
+        """
+        grid = self.grid
+        last_year = grid.years[-1]
+        new_grid = CohortGrid(grid.ages, grid.sexes, range(last_year+1, last_year+nb_years+1))
+        steps = arange(1, nb_years+1)
+        
+        growth = dict(self._types_growth)
+        growth['pop'] = 1 + (self._population_growth_rate or 0)
+        new_block = dict()
+        for col in ['pop'] + [typ for typ in self._types if typ not in self._net_definitions]:
+            last = self.year_values(col, last_year)
+            new_block[col] = (last[:, :, None]*growth.get(col, 1)**steps).ravel()
+        for name, combination in self._net_definitions.iteritems():
+            new_block[name] = sum(weight*new_block[col] for weight, col in combination)
+        new_block = DataFrame(new_block, index=new_grid.index())
+        
+        # __init__ resets the attributes describing the columns: keep them
+        state = dict((attribute, getattr(self, attribute)) for attribute in 
+                     ['_types', '_nb_type', '_types_years', '_types_growth', '_net_definitions', 
+                      '_population_growth_rate', 'name'])
+        rates = dict((attribute, getattr(self, attribute)) for attribute in ['_growth_rate', '_discount_rate']
+                     if hasattr(self, attribute))
+        factors = self._factors
+        combined = concat([DataFrame(self), new_block]).sortlevel()
+        self.__init__(data = combined)
+        for attribute, value in state.items() + rates.items():
+            setattr(self, attribute, value)
+        for name, values in factors.iteritems():
+            ratio = values[-1]/values[-2] if len(values) > 1 else 1
+            extended = hstack([values, values[-1]*ratio**steps])
+            extended.flags.writeable = False
+            self.set_factor(name, extended)
+
+    def compute_net_transfers(self, name = 'net_transfers', taxes_list = [], payments_list = [], weights = None,
+                              definitions = None):
         """
-        Creates a new column total_payments in the DataCohorts which combines the profiles.
+        Creates a new column name in the DataCohorts which combines the profiles: the weighted sum
+        of the taxes minus the weighted sum of the payments.
+        Every definition is computed in one product of the stacked profiles by a matrix of signed weights.
         
         Parameters
         ----------
@@ -230,29 +300,48 @@ class DataCohorts(Cohorts):
             A list of the name of the columns containing all the taxes profiles
         payments_list : list
             A list of the names of the columns containing all the subsidies and payments profiles
+        weights : dict, default None
+            The weight of some profiles in the sums, the other profiles have a weight of 1
+        definitions : dict, default None
+            Several net transfers to compute at once: maps their names to (taxes_list, payments_list).
+            When given, name, taxes_list and payments_list are ignored.
         """
-
-        self.new_type(name)
-        self['total_taxes'] = 0
-        self['total_payments'] = 0
-        for typ in taxes_list:
-            if typ not in self._types:
-                self._nb_type += 1
-                self._types.append(typ)
-            self['total_taxes'] += hstack(self[typ])
-        
-        for typ in payments_list:
+        if definitions is None:
+            definitions = {name: (taxes_list, payments_list)}
+        if weights is None:
+            weights = dict()
+        
+        profiles = list()
+        combinations = dict()
+        for net_name, (taxes, payments) in definitions.iteritems():
+            combinations[net_name] = ([(weights.get(typ, 1), typ) for typ in taxes] + 
+                                      [(-weights.get(typ, 1), typ) for typ in payments])
+            for typ in list(taxes) + list(payments):
+                if typ not in profiles:
+                    profiles.append(typ)
                 if typ not in self._types:
                     self._nb_type += 1
                     self._types.append(typ)
-                self['total_payments'] += hstack(self[typ])
-    
-        self[name] = self['total_taxes'] - self['total_payments']
-        if self[name].all() == 0:
-            raise Exception('The computed column contains only zeros')
+        
+        names = sorted(definitions)
+        weights_matrix = zeros((len(profiles), len(names)))
+        for j, net_name in enumerate(names):
+            for weight, typ in combinations[net_name]:
+                weights_matrix[profiles.index(typ), j] += weight
+        if len(profiles):
+            net_values = DataFrame(self, columns = profiles).values.dot(weights_matrix)
+        else:
+            net_values = zeros((len(self), len(names)))
+        
+        for j, net_name in enumerate(names):
+            if (net_values[:, j] == 0).all():
+                raise Exception('The computed column %s contains only zeros' % net_name)
+            self.new_type(net_name)
+            self._net_definitions[net_name] = combinations[net_name]
+            self[net_name] = net_values[:, j]
 
          
-    def aggregate_generation_present_value(self, typ, discount_rate=None):
+    def aggregate_generation_present_value(self, typ, discount_rate=None, tail=False):
         """
         Computes the present value of one column for the whole generation
         
@@ -260,43 +349,204 @@ class DataCohorts(Cohorts):
         ----------
         typ : str
               Name of the column of the per capita profile of tax or transfer
-        discount_rate : float
+        discount_rate : float or path of rates by year
                         Rate used to calculate the present value
+        tail : boolean, default False
+               if True adds the flows after the last year in closed form, assuming that population
+               and profiles keep growing at their projection rates (see tail_ratio)
         Returns
         -------
         res : an AccountingCohorts with column 'typ' containing the aggregat present value of typ 
         """
-        if typ not in self._types:
-            raise Exception('cohort: variable %s is not in self._types' %typ)
-            return
+        return self.aggregate_generation_present_values([typ], discount_rate, tail=tail)
+
+    def aggregate_generation_present_values(self, typ_list=None, discount_rate=None, tail=False):
+        """
+        Computes the present values of several columns for the whole generation,
+        discounting and accumulating all the columns together
+        
+        Parameters
+        ----------
+        typ_list : list, default None
+                   Names of the columns of the per capita profiles of taxes or transfers. 
+                   Default is every type of the cohort.
+        discount_rate : float or path of rates by year
+                        Rate used to calculate the present value
+        tail : boolean, default False
+               if True adds the flows after the last year in closed form (see aggregate_generation_present_value)
+        Returns
+        -------
+        res : an AccountingCohorts with one column per type containing its aggregate present value
+        """
+        typ_list = self._check_types(typ_list)
         if discount_rate is None:
             discount_rate = 0.0
         if 'dsct' not in self._types:
             self.gen_dsct(discount_rate)
-        tmp = self['dsct']*self[typ]*self['pop']
-        tmp = tmp.unstack(level = 'year')  # untack year indices to columns
+        tmp = DataFrame(self, columns = typ_list).values*self['pop'].values[:, None]
+        return self._generation_present_values(tmp, typ_list, tail=tail)
+
+    def present_value_operator(self, discount_rate=None):
+        """
+        Returns the operator mapping flows on the grid of the cohort to their generational present values
+        at the discount rate. The operator is built once per grid and rate and kept in a bounded cache,
+        so that present values of new profiles, reforms or scenarios only apply it.
         
-        pvm = tmp.xs(0, level='sex')
-        pvf = tmp.xs(1, level='sex') #Assuming 1 is the index for females resp. 0 is male.
+        Parameters
+        ----------
+        discount_rate : float or path of rates by year, default None
+                        the discount rate, the rate of the discount factor 'dsct' of the cohort if None
+        """
+        if discount_rate is None:
+            discount_rate = getattr(self, '_discount_rate', 0.0)
+        grid = self.grid
+        key = (rate_key(discount_rate), tuple(grid.ages), tuple(grid.sexes), tuple(grid.years))
+        return _present_value_operators.get_or_create(key, lambda: 
+                    PresentValueOperator(grid, year_factors(discount_rate, len(grid.years), discount=True)))
+
+    def _check_types(self, typ_list):
+        """
+        Returns the list of types typ_list, every type of the cohort if None, and checks that they exist
+        """
+        if typ_list is None:
+            typ_list = list(self._types)
+        for typ in typ_list:
+            if typ not in self._types:
+                raise Exception('cohort: variable %s is not in self._types' %typ)
+        return list(typ_list)
+
+    def tail_ratio(self, typ, with_pop=True, discount_rate=None):
+        """
+        Returns the yearly growth ratio of the discounted flows of the column typ after the last year,
+        ie (1+g)(1+n)/(1+r) for a per capita profile projected at the growth rate g, a population growing
+        at the rate n and the discount rate r. With paths of rates, the rates after the last year 
+        are the rates of the last year of the cohort (see long_run_rate).
         
-        yr_min = array(list(self.index_sets['year'])).min()
-        yr_max = array(list(self.index_sets['year'])).max()
+        Parameters
+        ----------
+        typ : str
+              Name of a projected profile column
+        with_pop : boolean, default True
+                   if False returns the ratio of per capita flows
+        discount_rate : float or List, default None
+                        the discount rate, the rate of the factor 'dsct' if None
+        """
+        if discount_rate is None:
+            discount_rate = getattr(self, '_discount_rate', 0)
+        ratio = self._types_growth.get(typ, 1)/(1 + long_run_rate(discount_rate, len(self.grid.years)))
+        if with_pop:
+            ratio *= 1 + (self._population_growth_rate or 0)
+        return ratio
+
+    def _tail_components(self, typ):
+        """
+        Returns the (weight, column) pairs which combine into typ
+        """
+        return self._net_definitions.get(typ, [(1, typ)])
+
+    def _tail_terms(self, flows, col, with_pop=True, discount_rate=None):
+        """
+        Returns the completion of the discounted flows of the column col in the last year (see tail_completion)
+        and the present value of the generations born after the last year
+        """
+        ratio = self.tail_ratio(col, with_pop, discount_rate)
+        completion = tail_completion(flows, ratio)
+        return completion, (flows[0] + completion[0]).sum()*geometric_remainder(ratio)
+
+    def delta_present_values(self, typ, deltas, discount_rate=None, tail=False):
+        """
+        Returns the aggregate present values of a change of the profiles combined into typ, without 
+        modifying the cohort: present values are linear in the profiles, so the present values of a reform
+        are the present values of the baseline plus the present values of the change.
         
-        for yr in arange(yr_min, yr_max)[::-1]:
-            pvm[yr] += hstack( [ pvm[yr+1].values[1:], 0]  )
-            pvf[yr] += hstack( [ pvf[yr+1].values[1:], 0]  )
-            
-        pieces = [pvm, pvf]
-        res =  concat(pieces, keys = [0,1], names = ["sex"] )
-        res = res.stack()
-        res = res.reset_index()
-        res = res.set_index(['age', 'sex', 'year'])
-        res.columns = [typ]
-        res = DataFrame(res)
-        return AccountingCohorts(res)
+        Parameters
+        ----------
+        typ : str
+              Name of a profile or of a net transfer column (see compute_net_transfers)
+        deltas : dict
+                 maps the names of profiles to (rows, values): the positions of the changed rows 
+                 of the cohort and the per capita changes of the profile at these rows
+        discount_rate : float, default None
+                        the discount rate, the rate of the factor 'dsct' if None
+        tail : boolean, default False
+               if True adds the changes after the last year in closed form, the changes of the last year
+               growing at the projection rates of the profiles
+        
+        Returns
+        -------
+        res : an AccountingCohorts with column typ defined on the whole grid, and its tail if requested
+        """
+        grid = self.grid
+        operator = self.present_value_operator(discount_rate)
+        age, sex, year = self.row_offsets
+        pop = self['pop'].values
+        cube = zeros(grid.shape)
+        remainder = 0
+        for weight, col in self._tail_components(typ):
+            if col not in deltas:
+                continue
+            rows, values = deltas[col]
+            col_cube = zeros(grid.shape)
+            add.at(col_cube, (age[rows], sex[rows], year[rows]), values*pop[rows])
+            col_cube = operator.discount(col_cube)
+            if tail:
+                col_completion, col_remainder = self._tail_terms(col_cube[:, :, -1], col, discount_rate=discount_rate)
+                col_cube[:, :, -1] += col_completion
+                remainder += weight*col_remainder
+            cube += weight*col_cube
+        res = AccountingCohorts(DataFrame({typ: operator.accumulate(cube).ravel()}, index = grid.index()))
+        if tail:
+            res._tail[typ] = remainder
+        return res
 
+    def _generation_present_values(self, values, typ_list, tail=False, with_pop=True):
+        """
+        Accumulates discounted values backward along every birth cohort diagonal, for several columns at once.
+        This is a private method.
+        
+        Parameters
+        ----------
+        values : array
+                 undiscounted flows of shape (rows of the cohort, len(typ_list)), discounted here at the
+                 rate of the factor 'dsct' with the present value operator of the cohort
+        typ_list : list
+                   names of the columns of the returned AccountingCohorts
+        tail : boolean, default False
+               if True completes the last year with the closed form of the flows after the last year
+               and records the present value of the generations born after the last year in res._tail
+        with_pop : boolean, default True
+                   indicates wether values are aggregate or per capita flows
+        """
+        grid = self.grid
+        operator = self.present_value_operator()
+        age, sex, year = self.row_offsets
+        cube = empty((len(typ_list),) + grid.shape)
+        cube.fill(NaN)
+        cube[:, age, sex, year] = values.T
+        cube = operator.discount(cube)
+        remainders = dict()
+        if tail:
+            last = len(grid.years) - 1
+            for k, typ in enumerate(typ_list):
+                completion = 0
+                remainders[typ] = 0
+                for weight, col in self._tail_components(typ):
+                    flows = self.year_values(col, grid.years[last])*operator.discount_factors[last]
+                    if with_pop:
+                        flows *= self.year_values('pop', grid.years[last])
+                    col_completion, col_remainder = self._tail_terms(flows, col, with_pop)
+                    completion = completion + weight*col_completion
+                    remainders[typ] += weight*col_remainder
+                cube[k, :, :, last] += completion
+        cube = operator.accumulate(cube).reshape(len(typ_list), -1)
+        res = DataFrame(cube.T, index = grid.index(), columns = typ_list)
+        if isnan(cube).any():
+            res = res.dropna()
+        res = AccountingCohorts(res)
+        res._tail.update(remainders)
+        return res
 
-    def per_capita_generation_present_value(self, typ, discount_rate = None):
+    def per_capita_generation_present_value(self, typ, discount_rate = None, tail=False):
         """
         Returns present net value per capita of the data typ 
         
@@ -305,23 +555,41 @@ class DataCohorts(Cohorts):
         typ : str
               Column name
         discount_rate : float
+        tail : boolean, default False
+               if True adds the flows after the last year in closed form
         
         Returns
         -------
         pv_percapita : an AccountingCohorts with column 'typ' containing the per capita present value of typ 
         
         """
+        return self.per_capita_generation_present_values([typ], discount_rate, tail=tail)
 
-        if typ not in self._types:
-            raise Exception('cohort: variable %s is not in self._types' %typ)
-        pv_gen = self.aggregate_generation_present_value(typ, discount_rate)
-        pop = DataFrame({'pop' : self['pop']})
-        pv_percapita = DataFrame(pv_gen[typ]/pop['pop'])
-        pv_percapita['pop'] = pop['pop']
-        pv_percapita.columns = [typ, 'pop']
+    def per_capita_generation_present_values(self, typ_list = None, discount_rate = None, tail=False):
+        """
+        Returns present net values per capita of several columns, computed together
+        
+        Parameters
+        ----------
+        typ_list : list, default None
+                   Column names, default is every type of the cohort
+        discount_rate : float
+        tail : boolean, default False
+               if True adds the flows after the last year in closed form
+        
+        Returns
+        -------
+        pv_percapita : an AccountingCohorts with one column per type containing its per capita present value 
+                       and the column 'pop'
+        """
+        typ_list = self._check_types(typ_list)
+        pv_gen = self.aggregate_generation_present_values(typ_list, discount_rate, tail=tail)
+        pop = self['pop'].reindex(pv_gen.index).values
+        pv_percapita = DataFrame(pv_gen.values/pop[:, None], index = pv_gen.index, columns = typ_list)
+        pv_percapita['pop'] = pop
         return AccountingCohorts(pv_percapita)
     
-    def new_per_capita_generation_present_value(self, typ, discount_rate = None):
+    def new_per_capita_generation_present_value(self, typ, discount_rate = None, tail=False):
         """
         Returns present net value per capita of the data typ 
         
@@ -330,40 +598,21 @@ class DataCohorts(Cohorts):
         typ : str
               Column name
         discount_rate : float
+        tail : boolean, default False
+               if True adds the flows after the last year in closed form
         
         Returns
         -------
         pv_percapita : an AccountingCohorts with column 'typ' containing the per capita present value of typ 
         
         """
-        if typ not in self._types:
-            raise Exception('cohort: variable %s is not in self._types' %typ)
-            return
+        typ_list = self._check_types([typ])
         if discount_rate is None:
             discount_rate = 0.0
         if 'dsct' not in self._types:
             self.gen_dsct(discount_rate)
-        tmp = self['dsct']*self[typ]
-        tmp = tmp.unstack(level = 'year')  # untack year indices to columns
-        
-        pvm = tmp.xs(0, level='sex')
-        pvf = tmp.xs(1, level='sex') #Assuming 1 is the index for females resp. 0 is male.
-        
-        yr_min = array(list(self.index_sets['year'])).min()
-        yr_max = array(list(self.index_sets['year'])).max()
-        
-        for yr in arange(yr_min, yr_max)[::-1]:
-            pvm[yr] += hstack( [ pvm[yr+1].values[1:], 0]  )
-            pvf[yr] += hstack( [ pvf[yr+1].values[1:], 0]  )
-            
-        pieces = [pvm, pvf]
-        res =  concat(pieces, keys = [0,1], names = ["sex"] )
-        res = res.stack()
-        res = res.reset_index()
-        res = res.set_index(['age', 'sex', 'year'])
-        res.columns = [typ]
-        res = DataFrame(res)
-        return AccountingCohorts(res)
+        tmp = self[typ].values[:, None]
+        return self._generation_present_values(tmp, typ_list, tail=tail, with_pop=False)
     
     def get_average_difference(self, consumption=[], income=[], year=None):
         """
@@ -0,0 +1,154 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Projection of the population by age and sex with mortality, fertility and migration rates
+'''
+from __future__ import division
+from pandas import DataFrame, Series, concat
+from numpy import asarray, broadcast_arrays, empty, rollaxis, zeros
+
+from src.lib.cohorts.cube import CohortGrid
+
+# Share of boys among the newborns, 105 boys for 100 girls
+BOYS_SHARE = 105/205
+
+
+def leslie_step(population, survival, fertility, migration = None, boys_share = BOYS_SHARE, female = 1):
+    """
+    Returns the population of the next year: the product of the population by the Leslie matrix of every sex,
+    applied through its two non zero diagonals (the survival below the diagonal and the fertility in the
+    first row) without building the matrix, plus the net migration.
+
+    Parameters
+    ----------
+    population : ndarray
+                 the population of shape (..., age, sex), the last age being an open age group
+    survival : ndarray
+               the probabilities to survive from each age to the next during the year, of shape (..., age, sex)
+    fertility : ndarray
+                the births during the year per woman of each age at the beginning of the year, of shape (..., age)
+    migration : ndarray, default None
+                the net migrants of the year by age and sex at the end of the year, of shape (..., age, sex)
+    boys_share : float, default BOYS_SHARE
+                 the share of boys among the newborns
+    female : int, default 1
+             the position of the women on the sex axis, the men being at the other position
+    """
+    survivors = population*survival
+    res = empty(survivors.shape)
+    res[..., 1:, :] = survivors[..., :-1, :]
+    res[..., -1, :] += survivors[..., -1, :]
+    births = (fertility*population[..., female]).sum(axis=-1)
+    res[..., 0, female] = (1 - boys_share)*births
+    res[..., 0, 1 - female] = boys_share*births
+    if migration is not None:
+        res += migration
+    return res
+
+
+def project_cube(population, survival, fertility, nb_years, migration = None, boys_share = BOYS_SHARE,
+                 female = 1, by_year = False):
+    """
+    Projects a population year by year with leslie_step, for several demographic variants at once
+
+    Parameters
+    ----------
+    population : ndarray
+                 the population of the first year, of shape (..., age, sex)
+    survival, fertility, migration : ndarray
+                 the demographic rates (see leslie_step), broadcast with the population: their leading axes
+                 index the variants
+    nb_years : int
+               the number of projected years
+    boys_share, female : see leslie_step
+    by_year : boolean, default False
+              if True the first axis of the rates indexes the projected years, the rates of the year t being
+              applied from the year t to the year t+1
+
+    Returns
+    -------
+    res : ndarray of shape (..., age, sex, year), the first year being the given population
+    """
+    rates = [asarray(survival, dtype=float), asarray(fertility, dtype=float)[..., None]]
+    if migration is not None:
+        rates.append(asarray(migration, dtype=float))
+    step_rates = [rate[0] for rate in rates] if by_year else rates
+    shapes = [rate.shape for rate in broadcast_arrays(asarray(population, dtype=float), *step_rates)]
+    # The years are the first axis while projecting, so that every step reads and writes contiguous blocks
+    res = zeros((nb_years + 1,) + shapes[0])
+    res[0] = population
+    for year in range(nb_years):
+        if by_year:
+            step_rates = [rate[min(year, len(rate) - 1)] for rate in rates]
+        survival, fertility = step_rates[0], step_rates[1][..., 0]
+        migration = step_rates[2] if len(step_rates) > 2 else None
+        res[year + 1] = leslie_step(res[year], survival, fertility, migration, boys_share, female)
+    return rollaxis(res, 0, res.ndim)
+
+
+def _by_age_sex(values, ages, sexes):
+    """
+    Returns the values of a Series indexed by age and sex, or by age only, as an array of shape (age, sex)
+    or (age,) ordered as ages and sexes. Arrays are returned as they are.
+    """
+    if not isinstance(values, Series):
+        return asarray(values, dtype=float)
+    if values.index.nlevels == 1:
+        return values.reindex(ages).values
+    return values.unstack(level=1).reindex(index=ages, columns=sexes).values
+
+
+def cohort_component_projection(population, survival, fertility, nb_years, migration = None,
+                                boys_share = BOYS_SHARE, female = 1, by_year = False, variants = None):
+    """
+    Projects the last year of a population by ageing, mortality, fertility and migration (cohort component
+    method), for one or several demographic variants. The result is a population which can be given to
+    Simulation.set_population, the population projection of the simulation continuing it after its last year.
+
+    Parameters
+    ----------
+    population : DataFrame
+                 the population indexed by age, sex and year with a column 'pop', as read in the population files
+    survival : Series or ndarray
+               the probabilities to survive from each age to the next, a Series indexed by age and sex
+               or an array of shape (..., age, sex) whose leading axes index the variants
+    fertility : Series or ndarray
+                the births per woman of each age, a Series indexed by age or an array of shape (..., age)
+    nb_years : int
+               the number of projected years after the last year of the population
+    migration : Series or ndarray, default None
+                the net migrants of each year by age and sex, as survival
+    boys_share, female, by_year : see project_cube
+    variants : List, default None
+               the names of the variants, ie of the leading axis of the rates
+
+    Returns
+    -------
+    res : a DataFrame indexed by age, sex and year with the given and the projected years,
+          or a dict of such DataFrames indexed by variant if variants is not None
+    """
+    last_year = max(population.index.get_level_values('year'))
+    last = population.xs(last_year, level='year')['pop']
+    grid = CohortGrid.from_index(population.index)
+    start = _by_age_sex(last, grid.ages, grid.sexes)
+    rates = [_by_age_sex(values, grid.ages, grid.sexes) if values is not None else None
+             for values in [survival, fertility, migration]]
+    cube = project_cube(start, rates[0], rates[1], nb_years, rates[2], boys_share, female, by_year)
+
+    projected_grid = CohortGrid(grid.ages, grid.sexes, range(last_year + 1, last_year + nb_years + 1))
+    index = projected_grid.index()
+    observed = DataFrame(population['pop'])
+    def to_population(values):
+        projected = DataFrame({'pop': values[..., 1:].ravel()}, index=index)
+        return concat([observed, projected]).sortlevel()
+
+    if variants is None:
+        return to_population(cube)
+    cube = cube.reshape((-1,) + cube.shape[-3:])
+    if len(cube) != len(variants):
+        raise Exception('the rates define %i variants, not %i' %(len(cube), len(variants)))
+    return dict((variant, to_population(values)) for variant, values in zip(variants, cube))
+
+
+if __name__ == '__main__':
+    pass
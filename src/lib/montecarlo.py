@@ -0,0 +1,307 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Monte Carlo evaluation of the ipl and of the generational imbalance over random rate scenarios
+'''
+from __future__ import division
+from pandas import DataFrame, Index, MultiIndex
+from numpy import (arange, array, asarray, empty, errstate, maximum, minimum, percentile, sign, sort, sqrt, tile, 
+                   unique, where, zeros)
+from numpy.random import RandomState
+import warnings
+
+from src.lib.cohorts.cohort import rate_path
+from src.lib.scenarios import ScenarioGrid, INDICATORS, PATH_PARAMETERS
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class StreamingMoments(object):
+    """
+    Count, mean and variance of several series updated by batches of observations,
+    with the parallel form of Welford's algorithm
+    """
+    def __init__(self, size):
+        self.count = 0
+        self.mean = zeros(size)
+        self._squares = zeros(size)
+
+    def update(self, values):
+        """
+        Adds a batch of observations of shape (observation, series)
+        """
+        values = asarray(values, dtype=float)
+        nb_values = len(values)
+        if nb_values == 0:
+            return
+        mean = values.mean(axis=0)
+        squares = ((values - mean)**2).sum(axis=0)
+        count = self.count + nb_values
+        delta = mean - self.mean
+        self._squares += squares + delta**2*self.count*nb_values/count
+        self.mean += delta*nb_values/count
+        self.count = count
+
+    @property
+    def variance(self):
+        """
+        The unbiased variance of every series
+        """
+        if self.count < 2:
+            return self.mean*float('nan')
+        return self._squares/(self.count - 1)
+
+
+class P2Quantiles(object):
+    """
+    Estimates of fixed quantiles of several series from five markers per quantile and series
+    (the P² algorithm of Jain and Chlamtac), in constant memory whatever the number of observations
+    """
+    def __init__(self, quantiles, size):
+        """
+        Parameters
+        ----------
+        quantiles : List
+                    the probabilities of the quantiles
+        size : int
+               the number of series
+        """
+        self.quantiles = list(quantiles)
+        self.size = size
+        p = tile(asarray(self.quantiles, dtype=float), size)
+        self._heights = zeros((5, len(p)))
+        self._positions = arange(5, dtype=float)[:, None] + zeros(len(p))
+        self._desired = array([0*p, 2*p, 4*p, 2 + 2*p, 4 + 0*p])
+        self._increments = array([0*p, p/2, p, (1 + p)/2, 1 + 0*p])
+        self._first = list()
+        self.count = 0
+
+    def update(self, values):
+        """
+        Adds observations of shape (observation, series), one at a time
+        """
+        with errstate(divide='ignore', invalid='ignore'):
+            for value in asarray(values, dtype=float).repeat(len(self.quantiles), axis=1):
+                self._add(value)
+
+    def _add(self, x):
+        self.count += 1
+        if self.count <= 5:
+            self._first.append(x)
+            if self.count == 5:
+                self._heights = sort(array(self._first), axis=0)
+            return
+        q, n = self._heights, self._positions
+        minimum(q[0], x, q[0])
+        maximum(q[4], x, q[4])
+        n[1:4] += x < q[1:4]
+        n[4] += 1
+        self._desired += self._increments
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            move = ((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1))
+            if not move.any():
+                continue
+            step = sign(d)*move
+            up, down = n[i+1] - n[i], n[i] - n[i-1]
+            slope_up, slope_down = (q[i+1] - q[i])/up, (q[i] - q[i-1])/down
+            parabolic = q[i] + step/(up + down)*((down + step)*slope_up + (up - step)*slope_down)
+            linear = q[i] + step*where(step > 0, slope_up, slope_down)
+            inside = (q[i-1] < parabolic) & (parabolic < q[i+1])
+            q[i] = where(inside, parabolic, linear)
+            n[i] += step
+
+    def result(self):
+        """
+        Returns the estimates of the quantiles of shape (series, quantile), exact for less than five observations
+        """
+        if self.count == 0:
+            return zeros((self.size, len(self.quantiles)))*float('nan')
+        if self.count < 5:
+            values = array(self._first)[:, ::len(self.quantiles)]
+            return array([percentile(values, 100*p, axis=0) for p in self.quantiles]).T
+        return self._heights[2].reshape(self.size, len(self.quantiles))
+
+
+class StreamingSummary(object):
+    """
+    Mean, standard deviation and quantiles of named series updated by batches of observations
+    """
+    def __init__(self, columns, quantiles = QUANTILES):
+        self.columns = columns
+        self.moments = StreamingMoments(len(columns))
+        self.sketch = P2Quantiles(quantiles, len(columns))
+
+    def update(self, values):
+        """
+        Adds a batch of observations of shape (observation, series)
+        """
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def result(self):
+        """
+        Returns a DataFrame indexed by series whose columns are the mean, the standard deviation and the quantiles
+        """
+        res = DataFrame(self.sketch.result(), index=self.columns, columns=self.sketch.quantiles)
+        res.insert(0, 'std', sqrt(self.moments.variance))
+        res.insert(0, 'mean', self.moments.mean)
+        return res
+
+
+def normal_sampler(population_scenarios = None, probabilities = None, **rates):
+    """
+    Returns a sampler for monte_carlo drawing independent normal rates and a population scenario
+
+    Parameters
+    ----------
+    population_scenarios : List, default None
+                           the population scenarios drawn, ie the keys of the simulations of monte_carlo
+    probabilities : List, default None
+                    the probabilities of the population scenarios, uniform if None
+    discount_rate, growth_rate, population_growth_rate, inflation_rate : tuple
+                    the mean and the standard deviation of the rate
+    """
+    def sampler(random_state, size):
+        draws = dict()
+        for key in sorted(rates):
+            mean, std = rates[key]
+            draws[key] = random_state.normal(mean, std, size)
+        if population_scenarios is not None:
+            draws['population_scenario'] = asarray(population_scenarios)[
+                random_state.choice(len(population_scenarios), size, p=probabilities)]
+        return draws
+    return sampler
+
+
+def path_sampler(nb_years, persistence = 0.9, population_scenarios = None, probabilities = None, **rates):
+    """
+    Returns a sampler for monte_carlo drawing paths of rates by year around mean paths, the deviations
+    from the mean paths following independent stationary AR(1) processes, and a population scenario
+
+    Parameters
+    ----------
+    nb_years : int
+               the number of years of the paths, the paths being extended with their last rate 
+               after nb_years (see year_factors)
+    persistence : float, default 0.9
+                  the autocorrelation of the deviations from one year to the next, between 0 and 1. 
+                  With 1 every path is a constant rate drawn around the mean path.
+    population_scenarios, probabilities : see normal_sampler
+    discount_rate, growth_rate, inflation_rate : tuple
+                    the mean rate, or the mean path of rates by year, and the standard deviation of the rates
+    population_growth_rate : tuple
+                             the mean and the standard deviation of the constant population growth rate
+    """
+    if not 0 <= persistence <= 1:
+        raise Exception('the persistence should be between 0 and 1')
+    innovation = sqrt(1 - persistence**2)
+    def sampler(random_state, size):
+        draws = dict()
+        for key in sorted(rates):
+            mean, std = rates[key]
+            if key not in PATH_PARAMETERS:
+                draws[key] = random_state.normal(mean, std, size)
+                continue
+            shocks = random_state.standard_normal((size, nb_years))
+            deviations = empty((size, nb_years))
+            deviations[:, 0] = shocks[:, 0]
+            for t in range(1, nb_years):
+                deviations[:, t] = persistence*deviations[:, t-1] + innovation*shocks[:, t]
+            draws[key] = rate_path(mean, nb_years) + std*deviations
+        if population_scenarios is not None:
+            draws['population_scenario'] = asarray(population_scenarios)[
+                random_state.choice(len(population_scenarios), size, p=probabilities)]
+        return draws
+    return sampler
+
+
+def monte_carlo(simulation, sampler, nb_draws, typ = 'net_transfers', seed = None, batch_size = 256,
+                quantiles = QUANTILES, gov_spendings = None, per_capita = False, years = None):
+    """
+    Evaluates the ipl and the generational imbalance of random hypotheses sets by batches (see ScenarioGrid.evaluate,
+    or ScenarioGrid.evaluate_paths when the sampler draws paths of rates by year) and keeps only the summary 
+    statistics of the draws, so that the memory does not depend on nb_draws. With the infinite horizon tail,
+    the draws whose tail does not converge (see ScenarioGrid.convergent) are excluded with a warning.
+
+    Parameters
+    ----------
+    simulation : Simulation or dict
+                 a simulation whose cohorts have been created, or a dict of simulations indexed by
+                 population scenario
+    sampler : function
+              called with a numpy RandomState and a number of draws, returns a dict of arrays of the drawn
+              rates, of shape (draw,) or (draw, year) for paths of rates, and, with a dict of simulations, 
+              of the drawn population scenarios under 'population_scenario' (see normal_sampler and 
+              path_sampler). The missing rates take the values of the simulation.
+    nb_draws : int
+               the number of draws
+    typ : str
+          the name of the column of net transfers
+    seed : int, default None
+           the seed of the draws. The results are reproducible for a given seed and batch_size.
+    batch_size : int, default 256
+                 the number of draws evaluated together
+    quantiles : List
+                the probabilities of the quantiles estimated
+    gov_spendings, per_capita, years : see ScenarioGrid.evaluate
+                                       with years the statistics are computed for every base year
+
+    Returns
+    -------
+    res : a DataFrame indexed by indicator, or by indicator and base year, whose columns are the number 
+          of draws kept, the mean, the standard deviation and the quantiles of the draws
+    """
+    simulations = simulation if isinstance(simulation, dict) else {None: simulation}
+    grids = dict()
+    for name, scenario_simulation in simulations.iteritems():
+        scenario_simulation.update()
+        grids[name] = ScenarioGrid(scenario_simulation, typ)
+
+    if years is None:
+        columns = Index(INDICATORS)
+    else:
+        columns = MultiIndex.from_tuples([(key, year) for key in INDICATORS for year in years],
+                                         names=['indicator', 'year'])
+    summary = StreamingSummary(columns, quantiles)
+    random_state = RandomState(seed)
+    excluded = 0
+    for start in range(0, nb_draws, batch_size):
+        size = min(batch_size, nb_draws - start)
+        draws = sampler(random_state, size)
+        names = draws.pop('population_scenario', None)
+        if names is None:
+            groups = [(None, draws)]
+        else:
+            names = asarray(names)
+            groups = [(name, dict((key, asarray(value)[names == name]) for key, value in draws.iteritems()))
+                      for name in unique(names)]
+        for name, rates in groups:
+            kept = grids[name].convergent(gov_spendings, per_capita, **rates)
+            if not kept.all():
+                excluded += (~kept).sum()
+                rates = dict((key, asarray(value)[kept]) for key, value in rates.iteritems())
+            if not kept.any():
+                continue
+            if any(asarray(value).ndim > 1 for value in rates.itervalues()):
+                res = grids[name].evaluate_paths(gov_spendings, per_capita, years, **rates)
+            else:
+                res = grids[name].evaluate(gov_spendings, per_capita, years, **rates)
+            values = res[INDICATORS].values
+            if years is not None:
+                values = values.reshape(-1, len(years), len(INDICATORS)).transpose(0, 2, 1).reshape(len(values)//len(years), -1)
+            summary.update(values)
+    if excluded:
+        warnings.warn('%i draws out of %i are excluded: their infinite horizon tail does not converge' 
+                      % (excluded, nb_draws))
+    res = summary.result()
+    res.insert(0, 'count', summary.count)
+    return res
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,653 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Evaluation of many hypotheses sets at once from the present values of a simulation
+'''
+from __future__ import division
+from pandas import DataFrame, MultiIndex, concat
+from numpy import arange, array, asarray, broadcast_arrays, isnan, isscalar, where, zeros, ones, maximum, dot, einsum
+
+from src.lib.cohorts.cube import (tail_completion, tail_completion_derivative, geometric_remainder, 
+                                  diagonal_suffix_sum)
+from src.lib.cohorts.cohort import path_factors
+from src.lib.spendings import geometric_sum, path_present_value
+
+PARAMETERS = ['discount_rate', 'growth_rate', 'population_growth_rate', 'inflation_rate']
+# Parameters which can be paths of rates by year (see ScenarioGrid.evaluate_paths)
+PATH_PARAMETERS = ['discount_rate', 'growth_rate', 'inflation_rate']
+INDICATORS = ['ipl', 'n_1', 'n_0', 'difference', 'ratio']
+
+
+def _suffix_sum(values):
+    """
+    Returns the sums of values from each position to the end of the last axis
+    """
+    return values[..., ::-1].cumsum(axis=-1)[..., ::-1]
+
+
+def generational_indicators(pv, pop, base, discount_rate, growth_rate, gov_spendings, gov_wealth,
+                            tail = 0, newborns_ratio = None, percapita = None, discount_factors = None, 
+                            growth_factors = None):
+    """
+    Returns the ipl and the generational imbalance (see Simulation.compute_ipl and 
+    Simulation.compute_gen_imbalance) for several base years and scenarios at once.
+    The present values at base year b are the present values at the first year of the years from b on,
+    discounted to b.
+
+    Parameters
+    ----------
+    pv : ndarray
+         the present values at the first year of the generations, of shape (..., age, sex, year) where the
+         leading axes index the scenarios
+    pop : ndarray
+          the population, of the shape of pv
+    base : array
+           the year offsets of the base years
+    discount_rate, growth_rate, gov_spendings, gov_wealth : float or ndarray of the leading shape
+    tail : float or ndarray of the leading shape, default 0
+           the present value of the generations born after the last year
+    newborns_ratio : float or ndarray of the leading shape, default None
+                     the ratio (1+n)/(1+r) of the generations born after the last year in the mu_1 coefficient
+                     with the infinite horizon tail, None without the tail
+    percapita : ndarray, default None
+                the per capita present values, default is pv/pop
+    discount_factors, growth_factors : ndarray, default None
+                the discount and growth factors of every year, of shape (..., year), replacing the constant
+                discount and growth rates for paths of rates by year (see year_factors)
+
+    Returns
+    -------
+    res : a dict of arrays of shape (..., base) indexed by the names of the indicators
+    """
+    pv = where(isnan(pv), 0, pv)
+    base = asarray(base)
+    if (base >= pv.shape[-1] - 1).any():
+        raise Exception('the last year of the cohorts can not be a base year')
+    G, W, tail = [asarray(value, dtype=float)[..., None] for value in [gov_spendings, gov_wealth, tail]]
+    years = arange(pv.shape[-1])
+    if discount_factors is None:
+        compounding = (1 + asarray(discount_rate, dtype=float)[..., None])**years
+    else:
+        compounding = 1/asarray(discount_factors, dtype=float)
+    if growth_factors is None:
+        growth = 1 + asarray(growth_rate, dtype=float)[..., None]
+    else:
+        growth = asarray(growth_factors, dtype=float)[..., base + 1]/asarray(growth_factors, dtype=float)[..., base]
+    
+    # Present values of the generations alive in the base year, and of the generations born after
+    scale = compounding[..., base]
+    past = pv[..., base].sum(axis=(-3, -2))
+    future = _suffix_sum(pv[..., 0, :, :].sum(axis=-2))[..., base] + tail
+    ipl = G - W - scale*(future + past - pv[..., 0, 0, base])
+    
+    # Newborns after the base year actualized at the growth and discount rates
+    newborns = pop[..., 0, :, :].sum(axis=-2)
+    discounted = newborns/compounding
+    actualized = _suffix_sum(discounted)[..., base + 1]
+    if newborns_ratio is not None:
+        actualized = actualized + discounted[..., -1:]*geometric_remainder(newborns_ratio)[..., None]
+    n_1 = (G - W - scale*past)/(growth*compounding[..., base + 1]*actualized)
+    if percapita is None:
+        percapita = pv[..., 0, :, :][..., base]/pop[..., 0, :, :][..., base]
+    else:
+        percapita = percapita[..., 0, :, :][..., base]
+    n_0 = scale*percapita.mean(axis=-2)
+    return {'ipl': ipl, 'n_1': n_1, 'n_0': n_0, 'difference': n_1 - n_0, 'ratio': n_1/n_0}
+
+
+class ScenarioGrid(object):
+    """
+    Evaluates the ipl, the generational imbalance and the generational accounts of a simulation
+    for many hypothesis sets (discount rate r, growth rate g, population growth rate n, inflation rate pi) at once.
+
+    The flows of a profile are the product of a base cube (population and profile before growth) by per-year
+    factors which only depend on the rates: (1+g)**t or (1+pi)**t for the profile, (1+n)**t after the last
+    year of population data and 1/(1+r)**t for the discount. Present values are linear in the flows, so every
+    indicator is a product of the (scenario, profile, year) matrix of factors by sums of the base cubes
+    computed once. The profiles must have been projected with the 'per_capita' or 'desynchronized' method.
+    """
+    def __init__(self, simulation, typ = 'net_transfers'):
+        """
+        Parameters
+        ----------
+        simulation : Simulation
+                     a simulation whose baseline cohorts have been created, which provide the base cubes
+        typ : str
+              the name of the column of net transfers, or of a profile
+        """
+        cohorts = simulation.cohorts
+        if cohorts is None:
+            raise Exception('the cohorts of the simulation should be created')
+        projection = simulation._projection()
+        tax_projection = projection['tax_projection']
+        if tax_projection['method'] not in ['per_capita', 'desynchronized']:
+            raise Exception('scenarios need profiles projected per capita or desynchronized')
+        if not all(isscalar(rate) for rate in [simulation.discount_rate, simulation.growth_rate, 
+                                               tax_projection.get('inflation_rate', 0)]):
+            raise Exception('scenarios need constant rates, not paths of rates by year')
+        self.simulation = simulation
+        self.typ = typ
+        self.tail = simulation._tail_mode()
+        self.year_length = projection['year_length']
+        self.exp_growth = projection['population_projection']['method'] == 'exp_growth'
+
+        grid = cohorts.grid
+        self.grid = grid
+        nb_ages, nb_sexes, nb_years = grid.shape
+        self._t = arange(nb_years)
+        last_data_year = min(max(simulation.population.index.get_level_values('year')), grid.years[-1])
+        self._pop_t = maximum(self._t - grid.year_offset(last_data_year) - 1, 0)
+
+        # Base cubes: the population and the profiles divided by their baseline growth factors
+        base_pop = cohorts.to_cube(['pop'])['pop']/self._pop_factors(cohorts._population_growth_rate or 0)
+        self.base_pop = where(isnan(base_pop), 0, base_pop)
+        payments = tax_projection.get('payments_list', []) if tax_projection['method'] == 'desynchronized' else []
+        self.components = list()
+        base = list()
+        for weight, col in cohorts._tail_components(typ):
+            if col in payments:
+                kind = 'inflation_rate'
+            elif col in cohorts._types_growth:
+                kind = 'growth_rate'
+            else:
+                kind = None
+            profile = cohorts.to_cube([col])[col]/cohorts._types_growth.get(col, 1)**self._t
+            flows = where(isnan(profile), 0, profile)*self.base_pop
+            self.components.append((weight, col, kind))
+            base.append(flows)
+        base = array(base)
+        self._base = base
+
+        # Sums of the base cubes on which the indicators depend
+        age = arange(nb_ages)[:, None]
+        year = arange(nb_years)[None, :]
+        self._future = (base*(year >= age)[None, :, None, :]).sum(axis=(1, 2))
+        diagonals = zeros((len(base), nb_years, nb_ages, nb_sexes))
+        for t in range(min(nb_years, nb_ages)):
+            diagonals[:, t, :nb_ages-t, :] = base[:, t:, :, t]
+        self._diagonals = diagonals.reshape(len(base)*nb_years, nb_ages*nb_sexes)
+        self._base_last = base[:, :, :, -1]
+        self._newborns = self.base_pop[0, :, :].sum(axis=0)
+
+    def _pop_factors(self, population_growth_rate):
+        """
+        Returns the growth factors of the population per year, of shape (..., year)
+        """
+        rate = asarray(population_growth_rate, dtype=float)[..., None]
+        if not self.exp_growth:
+            rate = 0*rate
+        return (1 + rate)**self._pop_t
+
+    def parameters(self, **kwargs):
+        """
+        Returns a DataFrame with one row per scenario: the given arrays of parameters broadcast together,
+        the missing parameters taking the values of the simulation
+        """
+        simulation = self.simulation
+        defaults = {'discount_rate': simulation.discount_rate,
+                    'growth_rate': simulation.growth_rate,
+                    'population_growth_rate': simulation.population_growth_rate or 0,
+                    'inflation_rate': simulation._projection()['tax_projection'].get('inflation_rate', 0) or 0}
+        for key in kwargs:
+            if key not in PARAMETERS:
+                raise Exception('%s is not a parameter of the scenarios' % key)
+        values = [kwargs.get(key) if kwargs.get(key) is not None else defaults[key] for key in PARAMETERS]
+        values = broadcast_arrays(*[asarray(value, dtype=float) for value in values])
+        return DataFrame(dict((key, value.ravel()) for key, value in zip(PARAMETERS, values)), columns=PARAMETERS)
+
+    def _compounding(self, parameters, paths = None):
+        """
+        Returns the compounding factors of the discount, growth and inflation rates of every scenario,
+        of shape (scenario, year), indexed by parameter: (1+x)**t for a constant rate, the cumulative 
+        products of the rates for the paths of rates by year of paths (see evaluate_paths)
+        """
+        res = dict()
+        for key in PATH_PARAMETERS:
+            if paths is not None and key in paths:
+                res[key] = path_factors(paths[key], len(self._t))
+            else:
+                res[key] = (1 + parameters[key].values[:, None])**self._t
+        return res
+
+    def _factors(self, parameters, paths = None):
+        """
+        Returns the factors of the base cubes of shape (scenario, profile, year), the growth factors 
+        of the population of shape (scenario, year) and the growth ratios of the discounted flows 
+        of each profile after the last year, of shape (profile, scenario). With paths of rates, 
+        the rates after the last year are the rates of the parameters.
+        """
+        r = parameters['discount_rate'].values[:, None]
+        n = parameters['population_growth_rate'].values if self.exp_growth else 0*r[:, 0]
+        pop_factors = self._pop_factors(n)
+        compounding = self._compounding(parameters, paths)
+        discount = pop_factors/compounding['discount_rate']
+        factors = list()
+        ratios = list()
+        for weight, col, kind in self.components:
+            growth = 1 if kind is None else 1 + parameters[kind].values[:, None]
+            factors.append(weight*discount*(1 if kind is None else compounding[kind]))
+            ratios.append(growth*(1 + n[:, None])/(1 + r))
+        factors = array(factors).transpose(1, 0, 2)
+        return factors, pop_factors, array(ratios)[:, :, 0]
+
+    def _log_derivatives(self, parameters, parameter):
+        """
+        Returns the derivatives with respect to a parameter of the logarithms of the yearly growth of 
+        the factors of each profile, of shape (profile, scenario), and of the yearly growth of the population, 
+        of shape (scenario,): the factors (1+x)**t have the derivatives t/(1+x) times the factors
+        """
+        if parameter not in PARAMETERS:
+            raise Exception('%s is not a parameter of the scenarios' % parameter)
+        rate = parameters[parameter].values
+        nb_scenarios = len(parameters)
+        population = zeros(nb_scenarios)
+        if parameter == 'population_growth_rate' and self.exp_growth:
+            population = 1/(1 + rate)
+        profiles = zeros((len(self.components), nb_scenarios))
+        for k, (weight, col, kind) in enumerate(self.components):
+            if parameter == 'discount_rate':
+                profiles[k] = -1/(1 + rate)
+            elif kind == parameter:
+                profiles[k] = 1/(1 + rate)
+        return profiles, population
+
+    def _present_values(self, parameters, parameter = None):
+        """
+        Returns the present values of the flows on which the indicators depend, one row per scenario:
+        the present values at the first year by age and sex, the present value of the generations born
+        from the first year and the growth factors of the population.
+        If parameter is given, returns the derivatives of these values with respect to the parameter,
+        propagated forward from the derivatives of the factors.
+        """
+        factors, pop_factors, ratios = self._factors(parameters)
+        if parameter is not None:
+            profiles, population = self._log_derivatives(parameters, parameter)
+            derivatives = factors*(profiles.T[:, :, None]*self._t + population[:, None, None]*self._pop_t)
+            pop_derivatives = pop_factors*population[:, None]*self._pop_t
+            ratio_derivatives = ratios*(profiles + population)
+        else:
+            derivatives = factors
+
+        nb_ages, nb_sexes, nb_years = self.grid.shape
+        accounts = dot(derivatives.reshape(len(parameters), -1), self._diagonals).reshape(-1, nb_ages, nb_sexes)
+        future = (derivatives*self._future[None, :, :]).sum(axis=(1, 2))
+        if self.tail:
+            for k, ratio in enumerate(ratios):
+                last = factors[:, k, -1][:, None, None]*self._base_last[k]
+                completion = tail_completion(last, ratio)
+                newborns = (last[:, 0, :] + completion[:, 0, :]).sum(axis=1)
+                remainder = newborns*geometric_remainder(ratio)
+                if parameter is not None:
+                    # The tail is linear in the flows of the last year but not in the ratio
+                    ratio_derivative = ratio_derivatives[k]
+                    last_derivative = derivatives[:, k, -1][:, None, None]*self._base_last[k]
+                    completion = (tail_completion(last_derivative, ratio) + 
+                                  ratio_derivative[:, None, None]*tail_completion_derivative(last, ratio))
+                    remainder = ((last_derivative[:, 0, :] + completion[:, 0, :]).sum(axis=1)*geometric_remainder(ratio) + 
+                                 newborns*ratio_derivative/(1 - ratio)**2)
+                # The completion of the last year belongs to the generations aged nb_years-1 or less
+                reached = nb_ages - nb_years + 1
+                if reached > 0:
+                    accounts[:, :reached, :] += completion[:, nb_years-1:, :]
+                future += completion[:, :nb_years, :].sum(axis=(1, 2))
+                future += remainder
+        if parameter is not None:
+            return accounts, future, pop_derivatives
+        return accounts, future, pop_factors
+
+    def _present_value_cubes(self, parameters, paths = None):
+        """
+        Returns the present values at the first year of the generations of every scenario, of shape
+        (scenario, age, sex, year), the present values of the generations born after the last year 
+        and the growth factors of the population
+        """
+        factors, pop_factors, ratios = self._factors(parameters, paths)
+        flows = einsum('jky,kasy->jasy', factors, self._base)
+        tail = zeros(len(parameters))
+        if self.tail:
+            for k, ratio in enumerate(ratios):
+                last = factors[:, k, -1][:, None, None]*self._base_last[k]
+                completion = tail_completion(last, ratio)
+                flows[..., -1] += completion
+                tail += (last[:, 0, :] + completion[:, 0, :]).sum(axis=1)*geometric_remainder(ratio)
+        return diagonal_suffix_sum(flows), tail, pop_factors
+
+    def _gov_spendings(self, parameters, gov_spendings, per_capita = False, paths = None):
+        """
+        Returns the present value of the government spendings of every scenario (see Simulation.set_gov_spendings)
+        """
+        if gov_spendings is None:
+            return self.simulation.net_gov_spendings + 0*parameters['discount_rate'].values
+        g = parameters['growth_rate'].values
+        r = parameters['discount_rate'].values
+        if paths is not None:
+            # As Simulation.set_gov_spendings with paths of rates, over the years of the cohorts
+            path = gov_spendings*self._compounding(parameters, paths)['growth_rate']
+            if per_capita:
+                population = self.base_pop.sum(axis=(0, 1))*self._pop_factors(parameters['population_growth_rate'].values)
+                path = path*population/population[:, :1]
+            return path_present_value(path, paths.get('discount_rate', r), tail = self.tail)
+        if per_capita:
+            n = parameters['population_growth_rate'].values
+            population = self.base_pop.sum(axis=(0, 1))*self._pop_factors(n)
+            path = gov_spendings*(1 + g[:, None])**self._t*population/population[:, :1]
+            return path_present_value(path, r, tail = self.tail)
+        if self.tail:
+            return gov_spendings*geometric_remainder((1 + g)/(1 + r))
+        return gov_spendings*geometric_sum((1 + g)/(1 + r), self.year_length)
+
+    def evaluate(self, gov_spendings = None, per_capita = False, years = None, chunk_size = 32, **kwargs):
+        """
+        Returns the ipl and the generational imbalance of every scenario.
+
+        Parameters
+        ----------
+        gov_spendings : float, default None
+                        the spendings of the reference year, whose present value is computed for each scenario
+                        as in Simulation.set_gov_spendings with compute=True. If None the present value of
+                        the spendings of the simulation is used for every scenario.
+        per_capita : boolean, default False
+                     if True the spendings per capita grow at the growth rate of each scenario and 
+                     their present value is computed over the years of the cohorts
+        years : List, default None
+                the base years (see Simulation.compute_evolution), default is the first year only
+        chunk_size : int, default 32
+                     the number of scenarios whose present values are computed together for several base years
+        discount_rate, growth_rate, population_growth_rate, inflation_rate : float or array, default None
+                        the parameters of the scenarios, broadcast together. Missing parameters take the
+                        values of the simulation. The population growth rate only matters for the 'exp_growth'
+                        population projection.
+
+        Returns
+        -------
+        res : a DataFrame with one row per scenario (and base year): its parameters, the ipl and the n_1, n_0, 
+              difference and ratio of Simulation.compute_gen_imbalance
+        """
+        res = self.parameters(**kwargs)
+        if years is not None:
+            return self._evaluate_years(res, gov_spendings, per_capita, years, chunk_size)
+        accounts, future, pop_factors = self._present_values(res)
+
+        spendings = self._gov_spendings(res, gov_spendings, per_capita)
+        wealth = self.simulation.net_gov_wealth
+        past = accounts.sum(axis=(1, 2))
+        res['ipl'] = spendings - wealth - future - past + accounts[:, 0, 0]
+
+        res['n_1'] = (spendings - wealth - past)/self._newborns_weight(res, pop_factors)
+        first_pop = self.base_pop[0, :, 0]*pop_factors[:, :1]
+        res['n_0'] = (accounts[:, 0, :]/first_pop).mean(axis=1)
+        res['difference'] = res['n_1'] - res['n_0']
+        res['ratio'] = res['n_1']/res['n_0']
+        return res
+
+    def evaluate_paths(self, gov_spendings = None, per_capita = False, years = None, chunk_size = 32, **kwargs):
+        """
+        Returns the ipl and the generational imbalance of scenarios whose discount, growth and inflation rates
+        are paths of rates by year, as Simulation.compute_evolution for a simulation with these paths
+        (see year_factors). The rates after the last year are the last rates of the paths.
+
+        Parameters
+        ----------
+        gov_spendings : float, default None
+                        the spendings of the reference year, whose present value is computed over the years 
+                        of the cohorts as in Simulation.set_gov_spendings with compute=True and paths of rates. 
+                        If None the present value of the spendings of the simulation is used for every scenario.
+        per_capita : boolean, default False
+                     if True the spendings per capita grow at the growth rates of each scenario
+        years : List, default None
+                the base years (see Simulation.compute_evolution), default is the first year only
+        chunk_size : int, default 32
+                     the number of scenarios whose present values are computed together
+        discount_rate, growth_rate, inflation_rate : array, default None
+                        the paths of rates of every scenario, of shape (scenario, year), or constant rates 
+                        of shape (scenario,), broadcast with the other parameters. A path shorter than the 
+                        cohorts is extended with its last rate.
+        population_growth_rate : float or array, default None
+                                 the constant population growth rate of every scenario
+
+        Returns
+        -------
+        res : a DataFrame with one row per scenario (and base year): its parameters, which are the rates 
+              after the last year of the paths, the ipl and the n_1, n_0, difference and ratio of 
+              Simulation.compute_gen_imbalance
+        """
+        parameters, paths = self._path_parameters(**kwargs)
+        res = self._evaluate_years(parameters, gov_spendings, per_capita, 
+                                   [self.grid.years[0]] if years is None else years, chunk_size, paths)
+        if years is None:
+            del res['year']
+        return res
+
+    def _path_parameters(self, **kwargs):
+        """
+        Returns the parameters of the scenarios, whose rates are the rates of the paths at the last year 
+        of the grid (see long_run_rate), and the dict of the paths of rates of shape (scenario, year) indexed by parameter
+        """
+        paths = dict()
+        for key in PATH_PARAMETERS:
+            value = kwargs.get(key)
+            if value is not None and asarray(value).ndim > 1:
+                paths[key] = asarray(value, dtype=float)
+                kwargs[key] = paths[key][:, min(len(self.grid.years), paths[key].shape[1]) - 1]
+        parameters = self.parameters(**kwargs)
+        for key, path in paths.iteritems():
+            if len(path) != len(parameters):
+                raise Exception('the paths of %s do not match the %i scenarios' % (key, len(parameters)))
+        return parameters, paths
+
+    def convergent(self, gov_spendings = None, per_capita = False, **kwargs):
+        """
+        Returns a boolean array indicating for every scenario wether its infinite horizon tail converges, 
+        ie wether the growth ratios of the discounted flows after the last year are below 1. 
+        Every scenario converges without the tail.
+
+        Parameters
+        ----------
+        gov_spendings, per_capita : see evaluate, the tail of the spendings being checked if gov_spendings is given
+        discount_rate, growth_rate, population_growth_rate, inflation_rate : float or array, default None
+                        the parameters of the scenarios, or paths of rates (see evaluate_paths)
+        """
+        parameters, paths = self._path_parameters(**kwargs)
+        if not self.tail:
+            return ones(len(parameters), dtype=bool)
+        r = parameters['discount_rate'].values
+        n = parameters['population_growth_rate'].values if self.exp_growth else 0*r
+        ratios = [(1 + n)/(1 + r)]
+        for weight, col, kind in self.components:
+            growth = 1 if kind is None else 1 + parameters[kind].values
+            ratios.append(growth*(1 + n)/(1 + r))
+        if gov_spendings is not None:
+            growth = 1 + parameters['growth_rate'].values
+            ratios.append(growth*(1 + n)/(1 + r) if per_capita else growth/(1 + r))
+        return (array(ratios) < 1).all(axis=0)
+
+    def _newborns_weight(self, parameters, pop_factors, parameter = None, pop_derivatives = None):
+        """
+        Returns the newborns of the years after the first year actualized as in Simulation.compute_gen_imbalance,
+        the denominator of n_1. If parameter is given, returns also the derivative with respect to it.
+        """
+        newborns = self._newborns*pop_factors
+        g = parameters['growth_rate'].values[:, None]
+        r = parameters['discount_rate'].values[:, None]
+        n = parameters['population_growth_rate'].values if self.exp_growth else 0*r[:, 0]
+        actualization = (1 + g)/(1 + r)**self._t[:-1]*newborns[:, 1:]/newborns[:, 1:2]
+        mu_1 = actualization.sum(axis=1)
+        if self.tail:
+            ratio = (1 + n)/(1 + r[:, 0])
+            mu_1 += actualization[:, -1]*geometric_remainder(ratio)
+        weight = mu_1*newborns[:, 1]
+        if parameter is None:
+            return weight
+
+        # Derivatives of the logarithms of the actualization factors and of the newborns
+        newborns_derivatives = self._newborns*pop_derivatives
+        log_derivatives = newborns_derivatives[:, 1:]/newborns[:, 1:] - newborns_derivatives[:, 1:2]/newborns[:, 1:2]
+        ratio_log_derivative = 0
+        if parameter == 'growth_rate':
+            log_derivatives = log_derivatives + 1/(1 + g)
+        elif parameter == 'discount_rate':
+            log_derivatives = log_derivatives - self._t[:-1]/(1 + r)
+            ratio_log_derivative = -1/(1 + r[:, 0])
+        elif parameter == 'population_growth_rate' and self.exp_growth:
+            ratio_log_derivative = 1/(1 + n)
+        mu_1_derivative = (actualization*log_derivatives).sum(axis=1)
+        if self.tail:
+            mu_1_derivative += actualization[:, -1]*(log_derivatives[:, -1]*geometric_remainder(ratio) + 
+                                                     ratio*ratio_log_derivative/(1 - ratio)**2)
+        return weight, mu_1_derivative*newborns[:, 1] + mu_1*newborns_derivatives[:, 1]
+
+    def _gov_spendings_derivative(self, parameters, gov_spendings, per_capita, parameter):
+        """
+        Returns the derivative with respect to a parameter of the present value of the government spendings 
+        of every scenario (see _gov_spendings)
+        """
+        if gov_spendings is None:
+            return zeros(len(parameters))
+        g = parameters['growth_rate'].values
+        r = parameters['discount_rate'].values
+        n = parameters['population_growth_rate'].values
+        # Derivatives of the logarithms of the yearly growth of the discounted spendings and of the population
+        log_derivative = zeros(len(parameters))
+        if parameter == 'growth_rate':
+            log_derivative = 1/(1 + g)
+        elif parameter == 'discount_rate':
+            log_derivative = -1/(1 + r)
+        population_log_derivative = zeros(len(parameters))
+        if per_capita and parameter == 'population_growth_rate' and self.exp_growth:
+            population_log_derivative = 1/(1 + n)
+        if per_capita:
+            population = self.base_pop.sum(axis=(0, 1))*self._pop_factors(n)
+            path = gov_spendings*(1 + g[:, None])**self._t*population/population[:, :1]
+            discounted = path/(1 + r[:, None])**self._t
+            log_derivatives = log_derivative[:, None]*self._t + population_log_derivative[:, None]*self._pop_t
+            res = (discounted*log_derivatives)[:, 1:].sum(axis=1)
+            if self.tail:
+                ratio = discounted[:, -1]/discounted[:, -2]
+                ratio_derivative = ratio*(log_derivatives[:, -1] - log_derivatives[:, -2])
+                res += discounted[:, -1]*(log_derivatives[:, -1]*geometric_remainder(ratio) + 
+                                          ratio_derivative/(1 - ratio)**2)
+            return res
+        ratio = (1 + g)/(1 + r)
+        if self.tail:
+            return gov_spendings*log_derivative*ratio/(1 - ratio)**2
+        terms = arange(1, self.year_length + 1)
+        return gov_spendings*log_derivative*(terms*ratio[:, None]**terms).sum(axis=1)
+
+    def sensitivities(self, gov_spendings = None, per_capita = False, wrt = None, **kwargs):
+        """
+        Returns the derivatives of the ipl and of the generational imbalance of every scenario with respect to 
+        its parameters. The derivatives are propagated forward from the derivatives of the factors of the base cubes, 
+        in one evaluation per parameter instead of two simulations per parameter.
+
+        Parameters
+        ----------
+        gov_spendings, per_capita : see evaluate
+        wrt : List, default None
+              the parameters of the derivatives, default is every parameter
+        discount_rate, growth_rate, population_growth_rate, inflation_rate : float or array, default None
+                        the parameters of the scenarios (see evaluate)
+
+        Returns
+        -------
+        res : a DataFrame with one row per scenario and parameter: the parameters of the scenario, 
+              the parameter of the derivatives and the derivatives of the indicators of evaluate
+        """
+        parameters = self.parameters(**kwargs)
+        wrt = PARAMETERS if wrt is None else wrt
+        accounts, future, pop_factors = self._present_values(parameters)
+        spendings = self._gov_spendings(parameters, gov_spendings, per_capita)
+        wealth = self.simulation.net_gov_wealth
+        past = accounts.sum(axis=(1, 2))
+        first_pop = self.base_pop[0, :, 0]*pop_factors[:, :1]
+        n_0 = (accounts[:, 0, :]/first_pop).mean(axis=1)
+
+        pieces = list()
+        for parameter in wrt:
+            derivatives, future_derivative, pop_derivatives = self._present_values(parameters, parameter)
+            spendings_derivative = self._gov_spendings_derivative(parameters, gov_spendings, per_capita, parameter)
+            past_derivative = derivatives.sum(axis=(1, 2))
+            weight, weight_derivative = self._newborns_weight(parameters, pop_factors, parameter, pop_derivatives)
+            n_1 = (spendings - wealth - past)/weight
+            n_1_derivative = (spendings_derivative - past_derivative - n_1*weight_derivative)/weight
+            first_pop_derivative = self.base_pop[0, :, 0]*pop_derivatives[:, :1]
+            n_0_derivative = ((derivatives[:, 0, :] - accounts[:, 0, :]*first_pop_derivative/first_pop)/first_pop).mean(axis=1)
+
+            piece = parameters.copy()
+            piece['parameter'] = parameter
+            piece['ipl'] = spendings_derivative - future_derivative - past_derivative + derivatives[:, 0, 0]
+            piece['n_1'] = n_1_derivative
+            piece['n_0'] = n_0_derivative
+            piece['difference'] = n_1_derivative - n_0_derivative
+            piece['ratio'] = (n_1_derivative - n_1/n_0*n_0_derivative)/n_0
+            pieces.append(piece)
+        return concat(pieces, ignore_index=True)
+
+    def _evaluate_years(self, parameters, gov_spendings, per_capita, years, chunk_size, paths = None):
+        """
+        Returns the indicators of every scenario and base year, computed from the present value cubes
+        of chunk_size scenarios at a time
+        """
+        spendings = self._gov_spendings(parameters, gov_spendings, per_capita, paths)
+        wealth = self.simulation.net_gov_wealth
+        base = self.grid.year_offset(years)
+        pieces = list()
+        for start in range(0, len(parameters), chunk_size):
+            stop = min(start + chunk_size, len(parameters))
+            chunk = parameters.iloc[start:stop]
+            chunk_paths = discount_factors = growth_factors = None
+            if paths is not None:
+                chunk_paths = dict((key, path[start:stop]) for key, path in paths.iteritems())
+                compounding = self._compounding(chunk, chunk_paths)
+                discount_factors, growth_factors = 1/compounding['discount_rate'], compounding['growth_rate']
+            pv, tail, pop_factors = self._present_value_cubes(chunk, chunk_paths)
+            pop = self.base_pop[None, :, :, :]*pop_factors[:, None, None, :]
+            r = chunk['discount_rate'].values
+            newborns_ratio = None
+            if self.tail:
+                n = chunk['population_growth_rate'].values if self.exp_growth else 0*r
+                newborns_ratio = (1 + n)/(1 + r)
+            indicators = generational_indicators(pv, pop, base, r, chunk['growth_rate'].values, 
+                                                 spendings[start:stop], wealth, tail, newborns_ratio,
+                                                 discount_factors = discount_factors, 
+                                                 growth_factors = growth_factors)
+            piece = DataFrame(dict((key, chunk[key].values.repeat(len(base))) for key in PARAMETERS))
+            piece['year'] = list(years)*len(chunk)
+            for key in INDICATORS:
+                piece[key] = indicators[key].ravel()
+            pieces.append(piece)
+        return concat(pieces, ignore_index=True)[PARAMETERS + ['year'] + INDICATORS]
+
+    def accounts(self, parameter = None, **kwargs):
+        """
+        Returns the per capita generational accounts of the generations alive in the first year for every
+        scenario, ie the per capita present values at the first year by sex and age.
+
+        Parameters
+        ----------
+        parameter : str, default None
+                    if given, the derivatives of the accounts with respect to this parameter are returned
+        discount_rate, growth_rate, population_growth_rate, inflation_rate : float or array, default None
+                        the parameters of the scenarios (see evaluate)
+
+        Returns
+        -------
+        res : a DataFrame with one row per scenario whose columns are indexed by (sex, age)
+        """
+        parameters = self.parameters(**kwargs)
+        accounts, future, pop_factors = self._present_values(parameters)
+        first_pop = self.base_pop[:, :, 0][None, :, :]*pop_factors[:, None, :1]
+        percapita = accounts/first_pop
+        if parameter is not None:
+            derivatives, future, pop_derivatives = self._present_values(parameters, parameter)
+            first_pop_derivative = self.base_pop[:, :, 0][None, :, :]*pop_derivatives[:, None, :1]
+            percapita = (derivatives - percapita*first_pop_derivative)/first_pop
+        percapita = percapita.transpose(0, 2, 1).reshape(len(parameters), -1)
+        nb_ages, nb_sexes = self.grid.shape[:2]
+        columns = MultiIndex(levels=[self.grid.sexes, self.grid.ages],
+                             labels=[arange(nb_sexes).repeat(nb_ages), arange(nb_ages).tolist()*nb_sexes],
+                             names=['sex', 'age'])
+        return DataFrame(percapita, columns=columns)
+
+
+if __name__ == '__main__':
+    pass
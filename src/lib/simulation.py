@@ -6,24 +6,89 @@ Created on 20 mars 2013
 @author: M Benjelloul, J Santoul
 '''
 from __future__ import division
-from pandas import HDFStore
+from pandas import HDFStore, DataFrame, Index, concat
 from pandas.io.parsers import ExcelFile
+from numpy import arange, ones, hstack, isnan, where, isscalar, array_equal
 
 from cohorts.data_cohorts import DataCohorts
+from src.lib.cohorts.accounting_cohorts import AccountingCohorts
+from src.lib.cohorts.cohort import year_factors, long_run_rate, rate_key
+from src.lib.cohorts.cube import geometric_remainder
+from src.lib.scenarios import ScenarioGrid, generational_indicators, INDICATORS, PARAMETERS
+from src.lib.montecarlo import monte_carlo
+from src.lib.spendings import spendings_path, path_present_value, geometric_sum
+from src.lib.utils import LRUCache, frame_key
 from src import SRC_PATH
 
 import os, warnings
+from copy import deepcopy
+
+# Stages of the creation of cohorts shared by the simulations, keyed by a hash of their inputs
+_stage_cache = LRUCache(maxsize = 8)
+
+# Outputs of a hypotheses set and the attributes of the set they are computed from. The profiles, 
+# the projections and the year length shared by both sets are recorded by each set when its cohorts 
+# are created (see Simulation._projection), so that they do not make the outputs stale.
+_DEPENDENCIES = {'cohorts': ['population', 'growth_rate', 'discount_rate', 'population_growth_rate'],
+                 'aggregate_pv': ['cohorts', 'discount_rate'],
+                 'percapita_pv': ['cohorts', 'discount_rate'],
+                 'net_gov_spendings': ['cohorts', 'growth_rate', 'discount_rate'],
+                 '_transfers': ['aggregate_pv']}
+
+def _downstream():
+    """
+    Returns the outputs depending directly or not on each attribute, for both hypotheses sets
+    """
+    direct = dict()
+    for suffix in ['', '_alt']:
+        for output, inputs in _DEPENDENCIES.iteritems():
+            for name in inputs:
+                direct.setdefault(name + suffix, set()).add(output + suffix)
+    res = dict()
+    for name in direct:
+        stale, todo = set(), list(direct[name])
+        while todo:
+            output = todo.pop()
+            if output not in stale:
+                stale.add(output)
+                todo.extend(direct.get(output, []))
+        res[name] = stale
+    return res
+
+_DOWNSTREAM = _downstream()
+
+# Hypotheses of the baseline taken by the alternative set in create_reform_present_values
+_REFORM_HYPOTHESES = ['growth_rate', 'discount_rate', 'population_growth_rate', 'net_gov_wealth', 
+                      'net_gov_spendings']
+
+def _same(value, other):
+    """
+    Returns True if two hypotheses, scalars, arrays or None, are equal
+    """
+    if value is None or other is None:
+        return value is other
+    return array_equal(value, other)
 
 class Simulation(object):
     """
     A simulation object contains all parameters to compute a simulation. And perform multiple comparisons.
     For now one can only compare two different scenarii.
     
+    The outputs (cohorts, present values, spendings) are marked stale when an attribute they depend on
+    is set, and update computes again the stale outputs which were created by the methods of the simulation.
+    Outputs set by hand are kept as they are, and so are cohorts changed in place (with a warning).
+    The profiles, the projections and the year length are shared by both hypotheses sets: each set uses 
+    those of the time its cohorts were created, and create_cohorts must be called again to apply new ones.
+    
     TODO: Prepare the arrival of the sub-level hypothesis sets : 
     """
     def __init__(self):
         # These attributes are the core data of a simulation
         super(Simulation, self).__init__()
+        self._dirty = set()   # stale outputs
+        self._recipes = dict()   # arguments of the methods which created the outputs
+        self._transfers = dict()   # ipl of the present values without spendings and wealth, per column
+        self._transfers_alt = dict()
         self.profiles = None
         self.population_projection = None
         self.tax_projection = None
@@ -51,6 +116,59 @@ class Simulation(object):
         self.cohorts_alt = None #A DataCohorts object
         self.aggregate_pv_alt = None #An AccountingCohorts object
         self.percapita_pv_alt = None #An AccountingCohorts object        
+        self.reforms = list() #Reforms of the baseline profiles, see add_reform
+        self._reform_alt = None #Alternative hypotheses set by create_reform_present_values
+
+    def __setattr__(self, name, value):
+        super(Simulation, self).__setattr__(name, value)
+        if '_recipes' in self.__dict__:
+            # An output set by hand is not computed again
+            self._recipes.pop(name, None)
+            self._dirty.discard(name)
+            self._touch(name)
+
+    def _touch(self, name):
+        """
+        Marks as stale the outputs depending on the attribute name
+        """
+        self._dirty.update(_DOWNSTREAM.get(name, []))
+
+    def update(self, default=True):
+        """
+        Computes again the stale outputs of a hypotheses set: the cohorts (and their net transfers), 
+        the present values and the present value of spendings, in this order
+        
+        Parameters
+        ----------
+        default : True or False
+                  indicates wether to update the default hypotheses set or the alternate one
+        """
+        suffix = '' if default else '_alt'
+        dirty = self._dirty
+        recipe = self._recipes.get('cohorts' + suffix)
+        if 'cohorts' + suffix in dirty and recipe is not None:
+            cohorts = getattr(self, 'cohorts' + suffix)
+            if frame_key(cohorts[recipe['columns']]) != recipe['key']:
+                warnings.warn('The cohorts have been changed in place, they are not created again')
+                dirty.discard('cohorts' + suffix)
+                recipe = None
+        if 'cohorts' + suffix in dirty and recipe is not None:
+            definitions = cohorts._net_definitions
+            self._create_cohorts(default, recipe['shared'])
+            for name, combination in definitions.iteritems():
+                profiles, weights = list(), dict()
+                for weight, typ in combination:
+                    if typ not in profiles:
+                        profiles.append(typ)
+                    weights[typ] = weights.get(typ, 0) + weight
+                self.compute_net_transfers(name, profiles, [], default, weights)
+        if 'aggregate_pv' + suffix in dirty and 'aggregate_pv' + suffix in self._recipes:
+            self.create_present_values(self._recipes['aggregate_pv' + suffix], default)
+        if 'net_gov_spendings' + suffix in dirty and 'net_gov_spendings' + suffix in self._recipes:
+            G, compute, rate, per_capita = self._recipes['net_gov_spendings' + suffix]
+            self.set_gov_spendings(G, default, compute, rate, per_capita)
+        if '_transfers' + suffix in dirty:
+            setattr(self, '_transfers' + suffix, dict())
 
         
 #===============================================================================
@@ -120,7 +238,7 @@ class Simulation(object):
         """
         self.profiles = dataframe
     
-    def set_gov_spendings(self, G, default=True, compute=False):
+    def set_gov_spendings(self, G, default=True, compute=False, rate=None, per_capita=False):
         """
         Set the value of unventilated spendings of the government. To perform the computation, 
         you must define first the value of the growth and discount rate.
@@ -128,32 +246,48 @@ class Simulation(object):
         Parameters
         ----------
         
-        G : Number
+        G : Number, or array of the spendings of every year of the cohorts
         default : True or False
                   indicates wether this are the spendings for the default hypotheses set or alternate one
         compute : True/False
                   use this option if you have the spendings only for the reference year. It will compute
-                  the net present value of spendings for the entire time.
+                  the net present value of spendings for the entire time, in closed form if the 
+                  population projection has an infinite horizon tail. If G is an array, compute the present value
+                  of this path of spendings.
+        rate : float, default None
+               with compute, the spendings grow at this rate instead of the growth rate and their present value 
+               is computed over the years of the cohorts (see spendings_path). So is it when the growth 
+               or the discount rate is a path of rates by year.
+        per_capita : True/False
+                     with compute, the spendings are also proportional to the projected population
         """
         if default:
             g = self.growth_rate
             r = self.discount_rate
+            cohorts = self.cohorts
         else:
             g = self.growth_rate_alt
             r = self.discount_rate_alt
+            cohorts = self.cohorts_alt
             
-        if compute:
-            net_gov_spendings = 0
-            for t in range(1, self.year_length+1):
-                year_gov_spending = G*((1+g)/(1+r))**t
-                net_gov_spendings += year_gov_spending
+        if compute and (rate is not None or per_capita or not isscalar(G) or not isscalar(g) or not isscalar(r)):
+            path = G
+            if isscalar(G):
+                path = spendings_path(G, cohorts['pop'], g if rate is None else rate, per_capita)
+            net_gov_spendings = float(path_present_value(path, r, tail = self._tail_mode(default)))
+        elif compute and self._tail_mode(default):
+            net_gov_spendings = G*geometric_remainder((1+g)/(1+r))
+        elif compute:
+            net_gov_spendings = G*float(geometric_sum((1+g)/(1+r), self._projection(default)['year_length']))
         else:
             net_gov_spendings = G
         
         if default:
             self.net_gov_spendings = net_gov_spendings
+            self._recipes['net_gov_spendings'] = (G, compute, rate, per_capita)
         else:
             self.net_gov_spendings_alt = net_gov_spendings
+            self._recipes['net_gov_spendings_alt'] = (G, compute, rate, per_capita)
     
     def set_gov_wealth(self, W, default=True):
         """
@@ -181,8 +315,9 @@ class Simulation(object):
         Parameters
         ----------
         
-        r : float, default set to 0
-            The discount rate
+        r : float or List, default set to 0
+            The discount rate, or a path of discount rates by year from the first year of the cohorts, 
+            extended with its last rate (see year_factors)
         default : True or False
                   indicates wether this is the discount rate for the default hypotheses set or 
                   alternate one
@@ -201,8 +336,9 @@ class Simulation(object):
         Parameters
         ----------
         
-        g : float, default set to 0
-            The growth rate
+        g : float or List, default set to 0
+            The growth rate, or a path of growth rates by year from the first year of the cohorts, 
+            extended with its last rate (see year_factors)
         default : True or False
                   indicates wether this is the growth rate for the default hypotheses set or alternate one
 
@@ -238,6 +374,12 @@ class Simulation(object):
         
         method : str
                  method use to project population
+        year_length : int
+                      number of years of the projection
+        tail : boolean
+               if True the present values add in closed form the flows after the last year, assuming 
+               population and profiles keep growing at constant rates. A horizon of a few decades 
+               after the last data year is then enough.
         """
         if self.population_projection is None:
             self.population_projection = dict()
@@ -280,17 +422,43 @@ class Simulation(object):
         dataframe = store['profiles']
         self.set_profiles(dataframe)
         
-    def compute_net_transfers(self, name = 'net_transfers', taxes_list = None, payments_list = None, default=True):
-        if taxes_list is None:
-            taxes_list = []
-            warnings.warn('No list of taxes provided, using an empty list for computation')
-        if payments_list is None:
-            payments_list = []
-            warnings.warn('No list of subsidies or payments provided, using an empty list for computation')
+    def compute_net_transfers(self, name = 'net_transfers', taxes_list = None, payments_list = None, default=True,
+                              weights = None, definitions = None):
+        if definitions is None:
+            if taxes_list is None:
+                taxes_list = []
+                warnings.warn('No list of taxes provided, using an empty list for computation')
+            if payments_list is None:
+                payments_list = []
+                warnings.warn('No list of subsidies or payments provided, using an empty list for computation')
         if default:
-            self.cohorts.compute_net_transfers(name, taxes_list, payments_list)
+            self.cohorts.compute_net_transfers(name, taxes_list, payments_list, weights, definitions)
         else:
-            self.cohorts_alt.compute_net_transfers(name, taxes_list, payments_list)
+            self.cohorts_alt.compute_net_transfers(name, taxes_list, payments_list, weights, definitions)
+
+    def _projection(self, default=True):
+        """
+        Returns the profiles, the projections and the year length used by a hypotheses set: those recorded 
+        when its cohorts were created, or the current ones
+        """
+        recipe = self._recipes.get('cohorts' if default else 'cohorts_alt')
+        if recipe is not None:
+            return recipe['shared']
+        return self._shared_inputs()
+
+    def _shared_inputs(self):
+        """
+        Returns a copy of the current profiles, projections and year length
+        """
+        return {'profiles': self.profiles, 'population_projection': deepcopy(self.population_projection),
+                'tax_projection': deepcopy(self.tax_projection), 'year_length': self.year_length}
+
+    def _tail_mode(self, default=True):
+        """
+        Indicates wether present values are computed with an infinite horizon tail
+        """
+        population_projection = self._projection(default)['population_projection']
+        return bool(population_projection and population_projection.get('tail', False))
 
 #===============================================================================
 # Set of methods to conduct the simulation itself
@@ -300,17 +468,26 @@ class Simulation(object):
     def create_cohorts(self, default = True):
         """
         Create cohorts according to population, tax and transfers,
-        and state expenses projection    
+        and state expenses projection. The population projection, the filling of profiles 
+        and the tax projection are cached with a hash of their inputs, so that only the stages
+        whose inputs changed are computed again.
+        """
+        self._create_cohorts(default, self._shared_inputs())
+
+    def _create_cohorts(self, default, shared):
+        """
+        Creates the cohorts of a hypotheses set from the shared inputs given by _shared_inputs, 
+        and records these inputs
         """
         if default:
             population = self.population
         else:
             population = self.population_alt
-            
-        cohorts = DataCohorts(data = population, columns = ['pop'])
+        population_projection, tax_projection = shared['population_projection'], shared['tax_projection']
+        profiles = shared['profiles']
         
         # Loading parameters to create a cohort :
-        year_length = self.population_projection["year_length"]
+        year_length = population_projection["year_length"]
 
         if default:
             growth_rate = self.growth_rate
@@ -322,23 +499,42 @@ class Simulation(object):
             pop_growth_rate = self.population_growth_rate_alt
             
         # Complete population projection
-        method = self.population_projection["method"]        
-        cohorts.population_project(year_length, method = method, growth_rate = pop_growth_rate)
+        method = population_projection["method"]
+        def project_population():
+            cohorts = DataCohorts(data = population, columns = ['pop'])
+            cohorts.population_project(year_length, method = method, growth_rate = pop_growth_rate)
+            return cohorts
+        population_key = ('population', frame_key(population), year_length, method, pop_growth_rate)
+        projected = _stage_cache.get_or_create(population_key, project_population)
+        
+        # Fill profiles
+        def fill_profiles():
+            cohorts = projected.clone()
+            cohorts._fill(profiles)
+            return cohorts
+        profiles_key = ('profiles', population_key, frame_key(profiles))
+        filled = _stage_cache.get_or_create(profiles_key, fill_profiles)
+        
+        # Project taxes
+        method = tax_projection["method"]
+        def project_taxes():
+            cohorts = filled.clone()
+            if method == 'desynchronized':
+                cohorts.proj_tax(rate=growth_rate, inflation_rate=tax_projection['inflation_rate'],
+                                 typ=tax_projection["typ"], method=method,
+                                 payments_list=tax_projection["payments_list"])
+            else: cohorts.proj_tax(rate=growth_rate, method=method)
+            return cohorts
+        taxes_key = ('taxes', profiles_key, method, rate_key(growth_rate))
+        if method == 'desynchronized':
+            taxes_key += (rate_key(tax_projection['inflation_rate']), tuple(tax_projection["typ"]),
+                          tuple(tax_projection["payments_list"]))
+        cohorts = _stage_cache.get_or_create(taxes_key, project_taxes).clone()
         
         # Generate discount factor and growth factor
         cohorts.gen_dsct(discount_rate)
         cohorts.gen_grth(growth_rate)
 
-        # Fill profiles
-        cohorts._fill(self.profiles)
-        method = self.tax_projection["method"]
-        if method == 'desynchronized':
-            taxes_list = self.tax_projection["typ"]
-            payments_list = self.tax_projection["payments_list"]
-            inflation_rate = self.tax_projection['inflation_rate']
-            cohorts.proj_tax(rate=growth_rate, inflation_rate=inflation_rate, typ = taxes_list, method=method, payments_list = payments_list)
-        else: cohorts.proj_tax(rate=growth_rate, method=method)
-
         # Project net taxes TOOD: see MainWindow widget
         if default:
             self.cohorts = cohorts
@@ -346,30 +542,218 @@ class Simulation(object):
         else:
             self.cohorts_alt = cohorts
             self.cohorts_alt.name = "cohorte_alternative"
+        self._record_cohorts(default, shared)
+
+    def _record_cohorts(self, default, shared):
+        """
+        Records the shared inputs of the cohorts of a hypotheses set and a hash of their columns, 
+        to detect the changes made in place before creating them again
+        """
+        cohorts = self.cohorts if default else self.cohorts_alt
+        columns = list(cohorts.columns)
+        self._recipes['cohorts' if default else 'cohorts_alt'] = {'shared': shared, 'columns': columns,
+                                                                  'key': frame_key(cohorts[columns])}
         
     
     def create_present_values(self, typ, default=True):
         """
         Create aggregated and per capita present values of net transfers according to the given cohort
         and state expenses projection 
+        
+        Parameters
+        ----------
+        typ : the name of a column or a list of columns, whose present values are computed together
+        default : indicate wether to perform the computation on the default or alternative parameters
         """
+        typ_list = [typ] if isinstance(typ, basestring) else list(typ)
+        tail = self._tail_mode(default)
         if default:
-            self.aggregate_pv = self.cohorts.aggregate_generation_present_value(typ, discount_rate = self.discount_rate)
+            self.aggregate_pv = self.cohorts.aggregate_generation_present_values(typ_list, discount_rate = self.discount_rate, tail = tail)
             self.aggregate_pv.name = 'comptes_gen_agrégés'
             self.aggregate_pv['pop'] = self.cohorts['pop']
             
-            self.percapita_pv = self.cohorts.per_capita_generation_present_value(typ, discount_rate = self.discount_rate)
+            self.percapita_pv = self.cohorts.per_capita_generation_present_values(typ_list, discount_rate = self.discount_rate, tail = tail)
             self.percapita_pv.name = 'comptes_gen_indiv'
             self.percapita_pv['pop'] = self.cohorts['pop']
+            self._recipes['aggregate_pv'] = typ_list
             
         else:
-            self.aggregate_pv_alt = self.cohorts_alt.aggregate_generation_present_value(typ, discount_rate = self.discount_rate_alt)
+            self.aggregate_pv_alt = self.cohorts_alt.aggregate_generation_present_values(typ_list, discount_rate = self.discount_rate_alt, tail = tail)
             self.aggregate_pv_alt.name = 'comptes_agrégés_alternatifs'
             self.aggregate_pv_alt['pop'] = self.cohorts_alt['pop']
             
-            self.percapita_pv_alt = self.cohorts_alt.per_capita_generation_present_value(typ, discount_rate = self.discount_rate_alt)
+            self.percapita_pv_alt = self.cohorts_alt.per_capita_generation_present_values(typ_list, discount_rate = self.discount_rate_alt, tail = tail)
             self.percapita_pv_alt.name = 'comptes_indiv_alternatifs'
             self.percapita_pv_alt['pop'] = self.cohorts_alt['pop']
+            self._recipes['aggregate_pv_alt'] = typ_list
+
+
+    def add_reform(self, typ, factor=None, delta=None, age=None, sex=None, year=None):
+        """
+        Records a reform of a profile of the baseline cohorts: on the selected rows the profile is 
+        multiplied by factor or increased by delta. Reforms are evaluated by create_reform_present_values
+        without projecting the cohorts again. Successive reforms of the same profile are applied in turn:
+        two factors of 1.1 on the same rows multiply the profile by 1.21.
+        
+        Parameters
+        ----------
+        typ : str
+              Name of the reformed profile
+        factor : float, default None
+                 Multiplier of the profile
+        delta : float, default None
+                Per capita change of the profile
+        age, sex, year : scalar, List or slice, default None
+                         The rows of the reform, every label if None (see Cohorts.filter_value)
+        """
+        if (factor is None) == (delta is None):
+            raise Exception('a reform needs either a factor or a delta')
+        self.reforms.append({'typ': typ, 'factor': factor, 'delta': delta, 'age': age, 'sex': sex, 'year': year})
+
+    def clear_reforms(self):
+        """
+        Forgets the recorded reforms
+        """
+        self.reforms = list()
+
+    def reform_deltas(self):
+        """
+        Returns the changes of the baseline profiles due to the recorded reforms as a dict mapping 
+        profiles to (rows, values), the positions of the changed rows of the baseline cohorts and 
+        the per capita changes (see DataCohorts.delta_present_values)
+        """
+        return self._reformed_profiles()[0]
+
+    def _reformed_profiles(self):
+        """
+        Returns the changes of the baseline profiles due to the recorded reforms (see reform_deltas) 
+        and the reformed values of the changed profiles. Each reform applies to the profile changed 
+        by the previous ones, so that successive factors compound.
+        """
+        deltas, profiles = dict(), dict()
+        for reform in self.reforms:
+            typ = reform['typ']
+            if typ not in profiles:
+                profiles[typ] = self.cohorts[typ].values.astype(float)
+            rows, values = self._reform_delta(values=profiles[typ], **reform)
+            profiles[typ][rows] += values
+            if typ in deltas:
+                previous_rows, previous_values = deltas[typ]
+                rows, values = hstack([previous_rows, rows]), hstack([previous_values, values])
+            deltas[typ] = (rows, values)
+        return deltas, profiles
+
+    def _reform_delta(self, typ, factor=None, delta=None, age=None, sex=None, year=None, values=None):
+        """
+        Returns the positions of the rows of the baseline cohorts changed by a reform (see add_reform) 
+        and the per capita changes of the profile typ at these rows. A factor applies to values, 
+        the profile before the reform, which is the baseline profile if None.
+        """
+        cohorts = self.cohorts
+        selected = cohorts.row_mask(age, sex, year)
+        rows = arange(len(cohorts)) if selected is None else selected.nonzero()[0]
+        if factor is not None:
+            if values is None:
+                values = cohorts[typ].values
+            return rows, (factor - 1)*values[rows]
+        return rows, delta*ones(len(rows))
+
+    def solve_fiscal_gap(self, typ, profile, year=None, age=None, sex=None, method='factor'):
+        """
+        Returns the adjustment of a profile of the baseline cohorts which makes the ipl of the baseline 
+        and of the recorded reforms zero. Since present values are linear in the profiles, the ipl is 
+        an affine function of the adjustment and is solved from the present values of the recorded reforms 
+        and of a unit adjustment (see delta_present_values), without projecting the cohorts again.
+        The government spendings and wealth are those of the baseline.
+        
+        Parameters
+        ----------
+        typ : str
+              Name of the net transfers column, whose present values have been created
+        profile : str
+                  Name of the adjusted profile, a tax or a payment entering typ
+        year : scalar, List or slice, default None
+               The years of the adjustment, for instance slice(2015, None) from 2015 on
+        age, sex : scalar, List or slice, default None
+                   The ages and sexes of the adjustment, every label if None
+        method : 'factor' or 'delta', default 'factor'
+                 wether the profile is multiplied by the returned factor or increased by the returned
+                 per capita delta on the selected rows
+        
+        Returns
+        -------
+        adjustment : float, to be recorded by add_reform(profile, factor=adjustment, ...) or 
+                     add_reform(profile, delta=adjustment, ...) to close the gap
+        """
+        if method not in ('factor', 'delta'):
+            raise Exception("the method of the adjustment must be 'factor' or 'delta'")
+        ipl = self.compute_ipl(typ)
+        tail = self._tail_mode()
+        deltas, profiles = self._reformed_profiles()
+        if deltas:
+            reforms_pv = self.cohorts.delta_present_values(typ, deltas, discount_rate = self.discount_rate, 
+                                                           tail = tail)
+            ipl += reforms_pv.compute_ipl(typ)
+        if method == 'factor':
+            unit = self._reform_delta(profile, factor=2, age=age, sex=sex, year=year, 
+                                      values=profiles.get(profile))
+        else:
+            unit = self._reform_delta(profile, delta=1, age=age, sex=sex, year=year)
+        unit_pv = self.cohorts.delta_present_values(typ, {profile: unit}, discount_rate = self.discount_rate, 
+                                                    tail = tail)
+        slope = unit_pv.compute_ipl(typ)
+        if slope == 0:
+            raise Exception('the adjustment of %s does not change the ipl' %profile)
+        adjustment = -ipl/slope
+        if method == 'factor':
+            return 1 + adjustment
+        return adjustment
+
+    def create_reform_present_values(self, typ):
+        """
+        Creates the present values of the alternative scenario as the present values of the baseline 
+        plus the present values of the reforms (see add_reform), which is exact since present values 
+        are linear in the profiles. The alternative scenario takes a copy of the cohorts and the 
+        hypotheses of the baseline: create_present_values(typ) must have been run on the baseline, 
+        and an alternative hypotheses set defined otherwise is not overwritten (an Exception is raised).
+        
+        Parameters
+        ----------
+        typ : str
+              Name of the net transfers column
+        """
+        cohorts = self.cohorts
+        previous = self._reform_alt or dict()
+        if self.cohorts_alt is not None and self.cohorts_alt is not previous.get('cohorts'):
+            raise Exception('the alternative cohorts are already defined and would be overwritten by the reforms')
+        hypotheses = dict()
+        for name in _REFORM_HYPOTHESES:
+            value, default = getattr(self, name + '_alt'), getattr(self, name)
+            if not (_same(value, None) or _same(value, 0) or _same(value, default) 
+                    or (name in previous and _same(value, previous[name]))):
+                raise Exception('%s_alt is already defined and would be overwritten by the reforms' %name)
+            hypotheses[name] = default
+        delta_pv = cohorts.delta_present_values(typ, self.reform_deltas(), discount_rate = self.discount_rate, 
+                                                tail = self._tail_mode())
+        
+        self.cohorts_alt = cohorts.clone()
+        self.cohorts_alt.name = "cohorte_alternative"
+        for name, value in hypotheses.iteritems():
+            setattr(self, name + '_alt', value)
+        hypotheses['cohorts'] = self.cohorts_alt
+        self._reform_alt = hypotheses
+        
+        self.aggregate_pv_alt = AccountingCohorts(self.aggregate_pv, copy=True)
+        delta = delta_pv[typ].reindex(self.aggregate_pv_alt.index).values
+        self.aggregate_pv_alt[typ] += delta
+        self.aggregate_pv_alt._tail = dict(self.aggregate_pv._tail)
+        self.aggregate_pv_alt._tail[typ] = self.aggregate_pv._tail.get(typ, 0) + delta_pv._tail.get(typ, 0)
+        self.aggregate_pv_alt.name = 'comptes_agrégés_alternatifs'
+        
+        self.percapita_pv_alt = AccountingCohorts(self.percapita_pv, copy=True)
+        pop = cohorts['pop'].reindex(self.percapita_pv_alt.index).values
+        self.percapita_pv_alt[typ] += delta_pv[typ].reindex(self.percapita_pv_alt.index).values/pop
+        self.percapita_pv_alt.name = 'comptes_indiv_alternatifs'
 
 
     def compute_ipl(self, typ, default=True, precision=False):
@@ -384,14 +768,69 @@ class Simulation(object):
         default : indicate wether to perform the computation on the default or alternative parameters
         
         precision : to perform the computation of teh precision of the ipl instead of the ipl instead.
-        """
         
+        The stale outputs are computed again first (see update). The part of the ipl which depends 
+        on the present values is kept until they change.
+        """
+        self.update(default)
         if default:
-            IPL = self.aggregate_pv.compute_ipl(typ, net_gov_wealth = self.net_gov_wealth, net_gov_spendings=self.net_gov_spendings, precision=precision)
+            aggregate_pv, W, G, transfers = self.aggregate_pv, self.net_gov_wealth, self.net_gov_spendings, self._transfers
         else:
-            IPL = self.aggregate_pv_alt.compute_ipl(typ, net_gov_wealth = self.net_gov_wealth_alt, net_gov_spendings=self.net_gov_spendings_alt, precision=precision)
+            aggregate_pv, W, G, transfers = (self.aggregate_pv_alt, self.net_gov_wealth_alt, 
+                                             self.net_gov_spendings_alt, self._transfers_alt)
+        if precision:
+            return aggregate_pv.compute_ipl(typ, net_gov_wealth = W, net_gov_spendings = G, precision=precision)
+        if typ not in transfers:
+            transfers[typ] = aggregate_pv.compute_ipl(typ)
+        IPL = G - W + transfers[typ]
         return IPL
     
+    def select_year_length(self, typ, tolerance = 1e-3, step = 50, max_year_length = 1000, default = True):
+        """
+        Extends the horizon of the cohorts by steps, reusing the years already projected, until the
+        relative change of the ipl due to the last year (see compute_ipl with precision=True) is below 
+        tolerance. The present values are updated and the chosen horizon is stored in year_length.
+        The cohorts must have been created, and the government spendings set with compute=True 
+        should be set again afterwards since they depend on the horizon.
+        
+        Parameters
+        ----------
+        typ : the name of the column containing the net transfers
+        tolerance : float, default 1e-3
+                    maximal relative change of the ipl due to the last year
+        step : int, default 50
+               number of years added to the horizon at each iteration
+        max_year_length : int, default 1000
+                          the horizon is not extended beyond this length
+        default : indicate wether to perform the computation on the default or alternative parameters
+        
+        Returns
+        -------
+        year_length : int
+                      the selected horizon
+        """
+        cohorts = self.cohorts if default else self.cohorts_alt
+        while True:
+            self.create_present_values(typ, default=default)
+            year_length = cohorts._year_max - cohorts._year_min
+            if abs(self.compute_ipl(typ, default=default, precision=True)) <= tolerance:
+                break
+            if year_length + step > max_year_length:
+                warnings.warn('The ipl did not converge within %i years' % max_year_length)
+                break
+            cohorts.extend_years(step)
+        
+        self.set_year_length(year_length)
+        if self.population_projection is not None:
+            self.population_projection['year_length'] = year_length
+        shared = self._projection(default)
+        shared['year_length'] = year_length
+        if shared['population_projection'] is not None:
+            shared['population_projection']['year_length'] = year_length
+        if self._recipes.get('cohorts' if default else 'cohorts_alt') is not None:
+            self._record_cohorts(default, shared)
+        return year_length
+
     def create_age_class(self, typ, step = 1, default = True):
         """
         Returns a dataframe containing the average net transfer present values for each age class.
@@ -401,6 +840,16 @@ class Simulation(object):
         else:
             age_class = self.aggregate_pv_alt.create_age_class(step, typ)
         return age_class
+
+    def create_age_classes(self, typ, steps = [1, 5, 10], default = True):
+        """
+        Returns a dict of dataframes containing the average net transfer present values for each 
+        age class, for several age class definitions computed at once (see AccountingCohorts.create_age_classes)
+        """
+        if default:
+            return self.aggregate_pv.create_age_classes(steps, typ)
+        else:
+            return self.aggregate_pv_alt.create_age_classes(steps, typ)
         
     def compute_gen_imbalance(self, typ, default=True, to_return='ratio'):
         """
@@ -429,55 +878,10 @@ class Simulation(object):
         if to_return not in ['difference', 'ratio', 'n_1', 'all']:
             to_return = 'ratio'
             print "Warning : argument to_return not recognized, function will return the default value "
-        # On définit les dataframes sur avec les quelles on veut travailler :     
-        if default:
-            aggregate_pv = self.aggregate_pv
-            cohorts = self.cohorts
-            percapita_pv = self.percapita_pv
-        else:
-            aggregate_pv = self.aggregate_pv_alt
-            cohorts = self.cohorts_alt
-            percapita_pv = self.percapita_pv_alt
-        
-        year_min = aggregate_pv._year_min
-        year_max = aggregate_pv._year_max
-#         age_min = self.aggregate_pv._agemin
-        age_max = aggregate_pv._agemax
-         
-        #Calculating the past transfers for both genders then deducting the equilibrium future transfers
-        past_gen_dataframe = aggregate_pv.xs(year_min, level = 'year')
-        past_gen_dataframe = past_gen_dataframe.cumsum()
-        past_gen_transfer = past_gen_dataframe.get_value((age_max, 1), typ)
-         
-        future_gen_transfer = self.net_gov_spendings - self.net_gov_wealth - past_gen_transfer
-        
-        #Computing the number of people of the unborn generation
-        population_unborn_ma = cohorts.get_value((0,0, year_min+1), 'pop')
-        population_unborn_fe = cohorts.get_value((0,1,year_min+1), 'pop')
-        population_unborn = population_unborn_ma + population_unborn_fe
-         
-        #Reorganizing data to prepare the computation of mu_1
-        population_dataframe = cohorts.filter_value(age = [0], year = range(year_min+1, year_max+1), typ='pop')
-        population_dataframe.gen_actualization(self.growth_rate, self.discount_rate)
-        population_dataframe = population_dataframe.unstack(level='sex')
-        del population_dataframe[('actualization', 1)] #TODO : check if this line is necessary
-        
-        population_dataframe['unborn'] = population_unborn
-        population_dataframe['mixed'] = population_dataframe[('pop', 0)] + population_dataframe[('pop', 1)]
-        population_dataframe[('actualization', 0)] *= population_dataframe['mixed']/population_dataframe['unborn']
- 
-        #Computing the coefficient mu_1
-        population_dataframe = population_dataframe.cumsum()        
-        mu_1 = population_dataframe.get_value((0,year_max), ('actualization', 0))
-        
-        #Computing the final imbalance coefficients
-        population_unborn = population_unborn_ma + population_unborn_fe
-        n_1 = future_gen_transfer/(mu_1*population_unborn) # = percapita_future_gen_transfer
-        n_0 = (percapita_pv.get_value((0, 0, year_min), typ)/2 + 
-                               percapita_pv.get_value((0, 1, year_min), typ)/2) # = actual_gen_transfer
-        
-        difference = n_1 - n_0
-        ratio = n_1/n_0
+        self.update(default)
+        aggregate_pv = self.aggregate_pv if default else self.aggregate_pv_alt
+        res = self.compute_evolution(typ, years = [aggregate_pv._year_min], default = default)
+        n_1, difference, ratio = res.iloc[0][['n_1', 'difference', 'ratio']]
         coefficients = [n_1, difference, ratio]
         
         if to_return == 'difference':
@@ -490,6 +894,129 @@ class Simulation(object):
             return coefficients
     
     
+    def compute_evolution(self, typ, years = None, default = True):
+        """
+        Returns the ipl and the generational imbalance for a range of base years, computed in one pass
+        from the present values of the simulation. The present values at base year b are those of the 
+        generations alive in b or born later, discounted to b: they are the present values at the first 
+        year of the years from b on, so the projected flows and the last year are the same for every 
+        base year. The net government wealth and spendings of the hypotheses set are used for every base year.
+        
+        Parameters
+        ----------
+        typ : Str
+              the name of the column containing the net transfers
+        years : List, default None
+                the base years, default is every year of the cohorts but the last one
+        default : True or False
+                  indicates if the computation should be performed on the default scenario or on the alternative scenario
+        
+        Returns
+        -------
+        res : a DataFrame indexed by base year whose columns are the ipl and the n_1, n_0, difference 
+              and ratio of compute_gen_imbalance
+        """
+        self.update(default)
+        if default:
+            aggregate_pv, percapita_pv, cohorts = self.aggregate_pv, self.percapita_pv, self.cohorts
+            r, g, W, G = self.discount_rate, self.growth_rate, self.net_gov_wealth, self.net_gov_spendings
+        else:
+            aggregate_pv, percapita_pv, cohorts = self.aggregate_pv_alt, self.percapita_pv_alt, self.cohorts_alt
+            r, g, W, G = self.discount_rate_alt, self.growth_rate_alt, self.net_gov_wealth_alt, self.net_gov_spendings_alt
+        
+        grid = aggregate_pv.grid
+        if years is None:
+            years = grid.years[:-1]
+        newborns_ratio = None
+        if self._tail_mode(default):
+            newborns_ratio = (1 + (cohorts._population_growth_rate or 0))/(1 + long_run_rate(r, len(grid.years)))
+        discount_factors = growth_factors = None
+        if not isscalar(r) or not isscalar(g):
+            discount_factors = year_factors(r, len(grid.years), discount=True)
+            growth_factors = year_factors(g, len(grid.years))
+        res = generational_indicators(aggregate_pv.to_cube([typ])[typ], cohorts.to_cube(['pop'])['pop'], 
+                                      grid.year_offset(years), r, g, G, W, 
+                                      tail = aggregate_pv._tail.get(typ, 0), newborns_ratio = newborns_ratio,
+                                      percapita = percapita_pv.to_cube([typ])[typ], 
+                                      discount_factors = discount_factors, growth_factors = growth_factors)
+        return DataFrame(res, index = Index(years, name = 'year'), columns = INDICATORS)
+
+    def evaluate_scenarios(self, typ, gov_spendings = None, per_capita = False, years = None, **kwargs):
+        """
+        Returns the ipl and the generational imbalance of many hypotheses sets at once, computed from
+        the default cohorts (see ScenarioGrid.evaluate). Use it instead of the alternate hypotheses
+        set to compare the default one with several others.
+        
+        Parameters
+        ----------
+        typ : Str
+              the name of the column containing the net transfers
+        gov_spendings : Number, default None
+                        the spendings of the reference year, used as in set_gov_spendings with compute=True.
+                        If None the present value of spendings of the default hypotheses set is used.
+        per_capita : True/False
+                     if True the spendings per capita grow at the growth rate of each scenario
+        years : List, default None
+                the base years of the indicators (see compute_evolution), default is the first year only
+        discount_rate, growth_rate, population_growth_rate, inflation_rate : Number or array
+                        the hypotheses of the scenarios, broadcast together
+        """
+        self.update()
+        return ScenarioGrid(self, typ).evaluate(gov_spendings, per_capita, years, **kwargs)
+
+    def monte_carlo(self, typ, sampler, nb_draws, seed = None, **kwargs):
+        """
+        Returns the mean, the standard deviation and the quantiles of the ipl and of the generational imbalance
+        of random hypotheses sets, evaluated by batches from the default cohorts (see montecarlo.monte_carlo)
+        
+        Parameters
+        ----------
+        typ : Str
+              the name of the column containing the net transfers
+        sampler : function
+                  draws the rates, or the paths of rates, of nb_draws hypotheses sets
+                  (see montecarlo.normal_sampler and montecarlo.path_sampler)
+        nb_draws : int
+                   the number of draws
+        seed : int, default None
+               the seed of the draws
+        batch_size, quantiles, gov_spendings, per_capita, years : see montecarlo.monte_carlo
+        """
+        return monte_carlo(self, sampler, nb_draws, typ, seed, **kwargs)
+
+    def compute_sensitivities(self, typ, gov_spendings = None, per_capita = False, elasticities = False):
+        """
+        Returns the derivatives of the ipl, of the generational imbalance and of the per capita generational 
+        accounts of the default hypotheses set with respect to the discount, growth, population growth and 
+        inflation rates (see ScenarioGrid.sensitivities), computed from the default cohorts without 
+        simulating the perturbed hypotheses.
+        
+        Parameters
+        ----------
+        typ : Str
+              the name of the column containing the net transfers
+        gov_spendings, per_capita : see evaluate_scenarios
+        elasticities : True/False
+                       if True returns the elasticities x/y*dy/dx instead of the derivatives
+        
+        Returns
+        -------
+        indicators : a DataFrame indexed by parameter whose columns are the ipl, n_1, n_0, difference and ratio
+        accounts : a DataFrame indexed by parameter whose columns are indexed by (sex, age)
+        """
+        self.update()
+        grid = ScenarioGrid(self, typ)
+        indicators = grid.sensitivities(gov_spendings, per_capita).set_index('parameter')[INDICATORS]
+        accounts = concat([grid.accounts(parameter) for parameter in PARAMETERS])
+        accounts.index = Index(PARAMETERS, name='parameter')
+        if elasticities:
+            rates = grid.parameters().iloc[0][PARAMETERS].values[:, None]
+            values = grid.evaluate(gov_spendings, per_capita).iloc[0][INDICATORS].values
+            indicators = DataFrame(indicators.values*rates/values, index=indicators.index, columns=INDICATORS)
+            accounts = DataFrame(accounts.values*rates/grid.accounts().values, index=accounts.index, 
+                                 columns=accounts.columns)
+        return indicators, accounts
+
     def break_down_ipl(self, typ, default=True, threshold = 60):
         """
         Returns the Intertemporal Public Liability series component in a dataframe
@@ -501,7 +1028,7 @@ class Simulation(object):
         
         default : indicate wether to perform the computation on the default or alternative parameters
         """
-        
+        self.update(default)
         if default:
             break_down = self.aggregate_pv.break_down_ipl(typ, net_gov_wealth = self.net_gov_wealth, net_gov_spendings=self.net_gov_spendings, threshold = threshold)
         else:
@@ -515,6 +1042,8 @@ class Simulation(object):
         Saves the output dataframe under default directory in an HDF store.
         Warning : will override .h5 file if already existant !
         Warning : the data is saved as a dataframe, one has to recreate the Cohort when reading.
+        The per-year factors of the cohorts ('dsct', 'grth', 'inflation', see Cohorts.set_factor) are 
+        saved as columns, as they were before being stored by year.
 
         Parameters
         ----------
@@ -536,6 +1065,9 @@ class Simulation(object):
                 record = DataFrame(index=value.index)
                 for col in value.columns:
                     record[col] = value[col]
+                for name in getattr(value, '_factors', dict()):
+                    if name not in record:
+                        record[name] = value.factor(name)
                 print 'saving'
                 store[attrib] = record
             else:
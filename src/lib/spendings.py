@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Paths of government spendings and their present values
+'''
+from __future__ import division
+from pandas import Series, Index
+from numpy import arange, asarray, where, isscalar
+
+from src.lib.cohorts.cube import geometric_remainder
+from src.lib.cohorts.cohort import year_factors, path_factors
+
+
+def geometric_sum(ratio, nb_terms):
+    """
+    Returns the sum of ratio**k for k from 1 to nb_terms, in closed form
+
+    Parameters
+    ----------
+    ratio : float or ndarray
+    nb_terms : int
+    """
+    ratio = asarray(ratio, dtype=float)
+    close = abs(ratio - 1) < 1e-12
+    safe = where(close, 0.5, ratio)
+    return where(close, nb_terms, safe*(1 - safe**nb_terms)/(1 - safe))
+
+
+def spendings_path(G, population, rate = 0, per_capita = False):
+    """
+    Returns the spendings of every year of a population: G*(1+rate)**t in the t-th year after the first year,
+    multiplied by the population relative to the first year if per_capita
+
+    Parameters
+    ----------
+    G : float
+        the spendings of the first year
+    population : Series
+                 the population indexed by year, or indexed by age, sex and year
+    rate : float or List, default 0
+           the growth rate of the spendings (per capita if per_capita), or a path of growth rates by year
+           (see year_factors)
+    per_capita : boolean, default False
+                 if True the spendings per capita grow at rate
+    """
+    if population.index.nlevels > 1:
+        population = population.sum(level='year')
+    population = population.sort_index()
+    path = G*year_factors(rate, len(population))
+    if per_capita:
+        path = path*population.values/population.values[0]
+    return Series(path, index=Index(population.index, name='year'))
+
+
+def path_present_value(path, discount_rate, tail = False):
+    """
+    Returns the present value at the first year of the spendings of the following years,
+    in one product of the path by the discount factors
+
+    Parameters
+    ----------
+    path : ndarray or Series
+           the spendings of every year, of shape (..., year)
+    discount_rate : float or ndarray
+                    the discount rate, of the shape of the leading axes of path, or paths of discount rates
+                    by year of shape (..., year) (see path_factors)
+    tail : boolean, default False
+           if True the spendings after the last year keep growing as in the last year, and are discounted
+           at the rate of the last year of path (see long_run_rate)
+    """
+    path = asarray(path, dtype=float)
+    if not isscalar(discount_rate) and asarray(discount_rate).ndim == path.ndim:
+        discounted = path*path_factors(discount_rate, path.shape[-1], discount=True)
+        discount_rate = asarray(discount_rate, dtype=float)
+        discount_rate = discount_rate[..., min(path.shape[-1], discount_rate.shape[-1]) - 1]
+    else:
+        discount_rate = asarray(discount_rate, dtype=float)[..., None]
+        discounted = path/(1 + discount_rate)**arange(path.shape[-1])
+        discount_rate = discount_rate[..., 0]
+    res = discounted[..., 1:].sum(axis=-1)
+    if tail:
+        ratio = path[..., -1]/path[..., -2]/(1 + discount_rate)
+        res = res + discounted[..., -1]*geometric_remainder(ratio)
+    return res
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,159 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Evaluation of the population scenarios of a file over a pool of processes
+'''
+from __future__ import division
+import traceback, time
+from multiprocessing import Pool
+from pandas import HDFStore, concat
+
+from src.lib.simulation import Simulation
+
+# State of a worker process, set once by _init_worker
+_worker = dict()
+
+
+def load_hdf_population(store, population_scenario):
+    """
+    Returns the population of a scenario read in an opened HDFStore such as proj_pop.h5
+    """
+    return store[population_scenario]
+
+
+def _init_worker(population_filename, configure, typ, loader, gov_spendings, rates):
+    """
+    Opens the population file once per worker and keeps the parameters of the sweep
+    """
+    if loader is None:
+        _worker['source'] = HDFStore(population_filename, 'r')
+        _worker['loader'] = load_hdf_population
+    else:
+        _worker['source'] = population_filename
+        _worker['loader'] = loader
+    _worker.update(configure=configure, typ=typ, gov_spendings=gov_spendings, rates=rates)
+
+
+def _run_population_scenario(population_scenario):
+    """
+    Simulates one population scenario and evaluates the rate scenarios on it.
+    Returns the name of the population scenario, the results or None, and the traceback of the failure or None
+    """
+    try:
+        simulation = Simulation()
+        simulation.set_population(_worker['loader'](_worker['source'], population_scenario))
+        _worker['configure'](simulation)
+        res = simulation.evaluate_scenarios(_worker['typ'], _worker['gov_spendings'], **_worker['rates'])
+        res.insert(0, 'population_scenario', population_scenario.lstrip('/'))
+        return population_scenario, res, None
+    except Exception:
+        return population_scenario, None, traceback.format_exc()
+
+
+def population_sweep(population_filename, configure, population_scenarios = None, typ = 'net_transfers',
+                     gov_spendings = None, processes = None, callback = None, loader = None, timeout = 3600,
+                     **rates):
+    """
+    Evaluates the ipl and the generational imbalance of every population scenario of a file
+    (and of every rate scenario, see ScenarioGrid.evaluate) over a pool of processes.
+
+    Parameters
+    ----------
+    population_filename : str
+                          complete path to the hdf5 file of the population scenarios (proj_pop.h5)
+    configure : function
+                a module level function called with a Simulation whose population is set, which sets the
+                profiles and the hypotheses, creates the cohorts and the present values of typ
+    population_scenarios : List, default None
+                           the names of the tables of the population scenarios. Default is every table of the file
+    typ : str
+          the name of the column containing the net transfers
+    gov_spendings : Number, default None
+                    the spendings of the reference year, see ScenarioGrid.evaluate
+    processes : int, default None
+                the number of worker processes, default is the number of cpus. With 1 the sweep runs
+                in the current process.
+    callback : function, default None
+               called in the current process with the results of every population scenario as soon as
+               they are received, for instance to save them while the sweep goes on. The failures of the
+               callback are recorded in errors and do not stop the sweep.
+    loader : function, default None
+             a module level function returning the population of a scenario given population_filename
+             and the name of the scenario. Default reads the tables of the hdf5 file, opened once per worker.
+    timeout : Number, default 3600
+              the number of seconds the pool may run without returning any result. The scenarios still
+              pending then are recorded as failed, since a worker process which died never returns.
+              None waits without limit.
+    discount_rate, growth_rate, population_growth_rate, inflation_rate : Number or array
+             the rate scenarios evaluated for every population scenario
+
+    Returns
+    -------
+    results : a DataFrame with one row per population and rate scenario, None if every scenario failed
+    errors : a dict of the tracebacks of the failed population scenarios
+    """
+    if population_scenarios is None:
+        population_scenarios = Simulation().get_population_choices(population_filename)
+    initargs = (population_filename, configure, typ, loader, gov_spendings, rates)
+
+    pieces = list()
+    errors = dict()
+    def collect(outcome):
+        population_scenario, res, error = outcome
+        if error is not None:
+            errors[population_scenario.lstrip('/')] = error
+            return
+        pieces.append(res)
+        if callback is not None:
+            try:
+                callback(res)
+            except Exception:
+                errors[population_scenario.lstrip('/')] = 'callback failed\n' + traceback.format_exc()
+
+    if processes == 1:
+        _init_worker(*initargs)
+        try:
+            for population_scenario in population_scenarios:
+                collect(_run_population_scenario(population_scenario))
+        finally:
+            if loader is None:
+                _worker['source'].close()
+    else:
+        pool = Pool(processes, _init_worker, initargs)
+        try:
+            pending = [(population_scenario, pool.apply_async(_run_population_scenario, (population_scenario,)))
+                       for population_scenario in population_scenarios]
+            pool.close()
+            last_result = time.time()
+            while pending:
+                pending[0][1].wait(0.1)
+                running = list()
+                for population_scenario, result in pending:
+                    if not result.ready():
+                        running.append((population_scenario, result))
+                        continue
+                    try:
+                        outcome = result.get()
+                    except Exception:
+                        outcome = population_scenario, None, traceback.format_exc()
+                    collect(outcome)
+                    last_result = time.time()
+                pending = running
+                if pending and timeout is not None and time.time() - last_result > timeout:
+                    for population_scenario, result in pending:
+                        errors[population_scenario.lstrip('/')] = ('no result within %s seconds, '
+                                                                   'the worker process may have died' % timeout)
+                    break
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if not pieces:
+        return None, errors
+    order = dict((name.lstrip('/'), i) for i, name in enumerate(population_scenarios))
+    pieces.sort(key=lambda res: order[res['population_scenario'].iloc[0]])
+    return concat(pieces, ignore_index=True), errors
+
+
+if __name__ == '__main__':
+    pass
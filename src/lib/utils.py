@@ -4,6 +4,9 @@ Created on Nov 10, 2012
 '''
 
 import time
+import hashlib
+from collections import OrderedDict
+from numpy import asarray, ascontiguousarray
 
 class Timer(object):
     
@@ -56,5 +59,69 @@ def of_import(module = None, classname = None, country = None):
 
 
 
+class LRUCache(object):
+    """
+    A dict-like cache keeping at most maxsize items: the least recently used item is dropped first
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get_or_create(self, key, create):
+        """
+        Returns the item key, created with create() and stored if missing
+        """
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self[key] = value
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def frame_key(df):
+    """
+    Returns a hash of the values, the index and the columns of a DataFrame,
+    to use its content as a cache key
+    """
+    digest = hashlib.sha1()
+    for values in [df.values] + [df.index.get_level_values(i) for i in range(df.index.nlevels)]:
+        values = asarray(values)
+        if values.dtype.kind == 'O':
+            digest.update(repr(values.tolist()))
+        else:
+            digest.update(str(values.dtype) + str(values.shape))
+            digest.update(ascontiguousarray(values).tostring())
+    digest.update(repr(list(df.columns)) + repr(list(df.index.names)))
+    return digest.hexdigest()
+
+
 if __name__ == '__main__':
     pass
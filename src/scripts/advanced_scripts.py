@@ -9,6 +9,7 @@
 from __future__ import division
 import os
 from src.lib.simulation import Simulation
+from src.lib.sweep import population_sweep
 from src.lib.cohorts.accounting_cohorts import AccountingCohorts
 from pandas import read_csv, HDFStore, concat, ExcelFile, DataFrame, MultiIndex
 from numpy import array, hstack, arange, NaN
@@ -78,7 +79,8 @@ def test_comparison():
 
 
     simulation.cohorts.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-    simulation.create_present_values('net_transfers', default=True)
+    items_list = taxes_list + payments_list + ['net_transfers']
+    simulation.create_present_values(items_list, default=True)
     
     """
     Alternate Hypothesis set : 
@@ -105,16 +107,16 @@ def test_comparison():
     
     #simulation.cohorts_alt.loc[(0,0,2014):, 'cot'] *= (1+0.1)
     simulation.cohorts_alt.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-    simulation.create_present_values('net_transfers', default=False)
+    simulation.create_present_values(items_list, default=False)
 
 
     #Creating age classes
-    cohorts_age_class = simulation.create_age_class(typ = 'net_transfers', step = 5)
-    cohorts_age_class._types = [u'tva', u'tipp', u'cot', u'irpp', u'impot', u'property', u'chomage', u'retraite', u'revsoc', u'maladie', u'educ', u'net_transfers']
+    cohorts_age_class = simulation.create_age_class(typ = items_list, step = 5)
+    cohorts_age_class._types = items_list
     age_class_pv_fe = cohorts_age_class.xs((1, 1996), level = ['sex', 'year'])
     
-    cohorts_age_class_alt = simulation.create_age_class(typ = 'net_transfers', step = 5, default=False)
-    cohorts_age_class_alt._types = [u'tva', u'tipp', u'cot', u'irpp', u'impot', u'property', u'chomage', u'retraite', u'revsoc', u'maladie', u'educ', u'net_transfers']
+    cohorts_age_class_alt = simulation.create_age_class(typ = items_list, step = 5, default=False)
+    cohorts_age_class_alt._types = items_list
     age_class_pv_fe_alt = cohorts_age_class_alt.xs((1, 1996), level = ['sex', 'year'])
     
     print "AGE CLASS PV"
@@ -344,11 +346,13 @@ def simple_scenario():
     ipl_base = simulation.compute_ipl(typ='net_transfers')
     ipl_alt = simulation.compute_ipl(typ='net_transfers', default=False, precision=False)
     
-    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop']]
+    tmp['dsct'] = simulation.cohorts['dsct']
     tmp['running_transfers'] = tmp['net_transfers']
     tmp['net_transfers'] *= tmp['dsct']
 
-    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop']]
+    tmp_2['dsct'] = simulation.cohorts_alt['dsct']
     tmp_2['running_transfers'] = tmp_2['net_transfers']
     tmp_2['net_transfers'] *= tmp_2['dsct']
     
@@ -476,10 +480,56 @@ def transition():
     record.to_excel(xls, 'ipl')
     
     
+def configure_simulation(simulation):
+    """
+    Sets the default hypotheses set on a simulation whose population is loaded, 
+    completes the population between 1996 and 2007 and computes the present values of net transfers
+    """
+    store_pop = HDFStore(os.path.join(SRC_PATH, 'countries', country, 'sources',
+                                           'Carole_Bonnet', 'pop_1996_2006.h5'), 'r')
+    simulation.population = concat([store_pop['population'], simulation.population])
+    store_pop.close()
+    simulation.load_profiles(profiles_filename)
+    
+    year_length = 250
+    taxes_list = ['tva', 'tipp', 'cot', 'irpp', 'impot', 'property']
+    payments_list = ['chomage', 'retraite', 'revsoc', 'maladie', 'educ']
+    simulation.set_year_length(nb_year=year_length)
+    simulation.set_population_projection(year_length=year_length, method="exp_growth")
+    simulation.set_tax_projection(method="desynchronized", rate=0.01, inflation_rate=0.01, 
+                                  typ=taxes_list, payments_list=payments_list)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.00)
+    simulation.create_cohorts()
+    simulation.set_gov_wealth(-3217.7e+09)
+    simulation.set_gov_spendings(1094*1e+09, compute=True)
+    simulation.cohorts.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
+    simulation.create_present_values('net_transfers')
+
+
+def population_scenarios_sweep():
+    """
+    Computes the ipl and the generational imbalance of every INSEE population scenario 
+    for several discount and growth rates, over a pool of processes
+    """
+    results, errors = population_sweep(population_filename, configure_simulation, gov_spendings=1094*1e+09,
+                                       discount_rate=[[0.02], [0.03], [0.04]], growth_rate=[0.01, 0.015, 0.02])
+    for population_scenario, error in errors.items():
+        print 'failed scenario', population_scenario
+        print error
+    if results is None:
+        print 'every population scenario failed'
+        return
+    xls = os.path.join(SRC_PATH, 'countries', country, 'sources', 'Output_folder', 'population_sweep.xlsx')
+    results.to_excel(xls, 'sweep')
+    
+    
 if __name__ == '__main__':
 #     test_comparison()
     simple_scenario()
 #     test_saving()
 #     compute_elasticities()
 #     multiple_scenario()
-#     transition()
\ No newline at end of file
+#     transition()
+#     population_scenarios_sweep()
\ No newline at end of file
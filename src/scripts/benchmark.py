@@ -0,0 +1,233 @@
+# -*- coding:utf-8 -*-
+# Copyright © 2013 Clément Schaff, Mahdi Ben Jelloul, Jérôme Santoul
+'''
+Benchmarks of the array kernels against the pandas implementations they replace.
+Run this file directly to print the timings for several horizon lengths.
+'''
+from __future__ import division
+import time
+from pandas import DataFrame, concat
+from numpy import array, arange, hstack, ones, where, linspace
+from src.lib.cohorts.accounting_cohorts import AccountingCohorts
+from src.scripts.tests.utils import (create_testing_population_dataframe,
+                                     create_constant_profiles_dataframe)
+from src.lib.cohorts.cohort import Cohorts
+from src.lib.cohorts.data_cohorts import DataCohorts
+from src.lib.simulation import Simulation
+from src.lib.demography import project_cube
+
+
+def best_time(func, repeat=3):
+    """
+    Returns the best elapsed time in seconds of repeat calls to func
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def create_benchmark_cohort(year_length):
+    """
+    Returns a DataCohorts with a growing population and two profiles over year_length years
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2001+year_length, rate=0.01)
+    profile = create_constant_profiles_dataframe(population, tax=-1, sub=0.5)
+    cohort = DataCohorts(population)
+    cohort._fill(profile)
+    cohort.proj_tax(0.01, 0.0, None, method = 'per_capita')
+    cohort.gen_dsct(0.03)
+    return cohort
+
+
+def loop_generation_present_value(cohort, tmp, typ):
+    """
+    Reference implementation of the backward recursion of DataCohorts.aggregate_generation_present_value
+    with one pandas column assignment per year and sex
+    """
+    tmp = tmp.unstack(level = 'year')
+    pvm = tmp.xs(0, level='sex')
+    pvf = tmp.xs(1, level='sex')
+    yr_min = array(list(cohort.index_sets['year'])).min()
+    yr_max = array(list(cohort.index_sets['year'])).max()
+    for yr in arange(yr_min, yr_max)[::-1]:
+        pvm[yr] += hstack( [ pvm[yr+1].values[1:], 0]  )
+        pvf[yr] += hstack( [ pvf[yr+1].values[1:], 0]  )
+    res =  concat([pvm, pvf], keys = [0,1], names = ["sex"] )
+    res = res.stack()
+    res = res.reset_index()
+    res = res.set_index(['age', 'sex', 'year'])
+    res.columns = [typ]
+    return AccountingCohorts(DataFrame(res))
+
+
+def bench_generation_present_value(year_lengths=(100, 200, 300), repeat=3):
+    """
+    Compares the diagonal kernel of aggregate_generation_present_value with the year loop
+    """
+    results = []
+    for year_length in year_lengths:
+        cohort = create_benchmark_cohort(year_length)
+        tmp = cohort['dsct']*cohort['tax']*cohort['pop']
+        loop = best_time(lambda: loop_generation_present_value(cohort, tmp, 'tax'), repeat)
+        flows = (cohort['tax']*cohort['pop']).values[:, None]
+        kernel = best_time(lambda: cohort._generation_present_values(flows, ['tax']), repeat)
+        results.append({'year_length': year_length, 'loop': loop, 'kernel': kernel, 'speedup': loop/kernel})
+    return DataFrame(results, columns=['year_length', 'loop', 'kernel', 'speedup'])
+
+
+def membership_filter_value(cohort, age=None, sex=None, year=None, typ=None):
+    """
+    Reference implementation of Cohorts.filter_value with list membership tests on every row
+    """
+    mask = array([True]*len(cohort))
+    if age is not None:
+        mask &= array([x in age for x in cohort.index.get_level_values(0)])
+    if sex is not None:
+        mask &= array(cohort.index.get_level_values(1) == sex)
+    if year is not None:
+        mask &= array([x in year for x in cohort.index.get_level_values(2)])
+    return Cohorts(DataFrame(cohort.loc[mask, typ], columns=[typ]))
+
+
+def bench_filter_value(year_lengths=(100, 200, 300), repeat=3):
+    """
+    Compares the indexed Cohorts.filter_value with the membership tests it replaces,
+    for the selection of the newborns used by Simulation.compute_gen_imbalance
+    """
+    results = []
+    for year_length in year_lengths:
+        cohort = create_benchmark_cohort(year_length)
+        years = range(2002, 2001+year_length)
+        membership = best_time(lambda: membership_filter_value(cohort, age=[0], year=years, typ='pop'), repeat)
+        indexed = best_time(lambda: cohort.filter_value(age=[0], year=years, typ='pop'), repeat)
+        results.append({'year_length': year_length, 'membership': membership, 'indexed': indexed,
+                        'speedup': membership/indexed})
+    return DataFrame(results, columns=['year_length', 'membership', 'indexed', 'speedup'])
+
+
+def bench_extract_generations(year_lengths=(100, 200, 300), repeat=3):
+    """
+    Compares the extraction of every generation born in the cohort years with one extract_generation
+    call per generation
+    """
+    results = []
+    for year_length in year_lengths:
+        cohort = AccountingCohorts(create_benchmark_cohort(year_length))
+        years = range(2001, 2001+year_length)
+        one_by_one = best_time(lambda: [cohort.extract_generation(year, 'tax') for year in years], 1)
+        batch = best_time(lambda: cohort.extract_generations('tax', birth_years=years), repeat)
+        results.append({'year_length': year_length, 'one_by_one': one_by_one, 'batch': batch,
+                        'speedup': one_by_one/batch})
+    return DataFrame(results, columns=['year_length', 'one_by_one', 'batch', 'speedup'])
+
+
+def bench_present_values(year_lengths=(100, 200, 300), nb_columns=12, repeat=3):
+    """
+    Compares the present values of nb_columns columns computed together with one call per column
+    """
+    results = []
+    for year_length in year_lengths:
+        cohort = create_benchmark_cohort(year_length)
+        typ_list = ['item_%i' % i for i in range(nb_columns)]
+        for typ in typ_list:
+            cohort.new_type(typ, cohort['tax'].values)
+        one_by_one = best_time(lambda: [cohort.aggregate_generation_present_value(typ, 0.03) for typ in typ_list],
+                               repeat)
+        together = best_time(lambda: cohort.aggregate_generation_present_values(typ_list, 0.03), repeat)
+        results.append({'year_length': year_length, 'one_by_one': one_by_one, 'together': together,
+                        'speedup': one_by_one/together})
+    return DataFrame(results, columns=['year_length', 'one_by_one', 'together', 'speedup'])
+
+
+def create_benchmark_simulation(year_length, discount_rate=0.03, growth_rate=0.01):
+    """
+    Returns a Simulation of the benchmark profiles whose present values of net transfers are computed
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+    profile = create_constant_profiles_dataframe(population, tax=-1, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population)
+    simulation.set_profiles(profile)
+    simulation.set_year_length(year_length)
+    simulation.set_population_projection(year_length=year_length, method="exp_growth")
+    simulation.set_tax_projection(method="per_capita", rate=growth_rate)
+    simulation.set_growth_rate(growth_rate)
+    simulation.set_discount_rate(discount_rate)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.set_gov_spendings(5, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    return simulation
+
+
+def bench_scenarios(year_lengths=(100, 200), nb_scenarios=10, repeat=1):
+    """
+    Compares the evaluation of nb_scenarios discount and growth rates at once with one simulation
+    per hypotheses set
+    """
+    results = []
+    for year_length in year_lengths:
+        rates = [(0.02 + 0.003*i, 0.01) for i in range(nb_scenarios)]
+        def one_by_one():
+            for r, g in rates:
+                simulation = create_benchmark_simulation(year_length, r, g)
+                simulation.compute_ipl('net_transfers')
+                simulation.compute_gen_imbalance('net_transfers')
+        simulation = create_benchmark_simulation(year_length)
+        grid = best_time(lambda: simulation.evaluate_scenarios('net_transfers', gov_spendings=5,
+                                                              discount_rate=[r for r, g in rates]), repeat)
+        loop = best_time(one_by_one, repeat)
+        results.append({'year_length': year_length, 'one_by_one': loop, 'grid': grid, 'speedup': loop/grid})
+    return DataFrame(results, columns=['year_length', 'one_by_one', 'grid', 'speedup'])
+
+
+def bench_scenario_years(year_lengths=(100, 200), nb_scenarios=10, nb_years=10, repeat=1):
+    """
+    Compares the indicators of nb_scenarios discount rates and nb_years base years computed at once with
+    one Simulation.compute_evolution per hypotheses set
+    """
+    results = []
+    for year_length in year_lengths:
+        rates = [0.02 + 0.003*i for i in range(nb_scenarios)]
+        simulation = create_benchmark_simulation(year_length)
+        years = list(simulation.aggregate_pv._year_min + arange(nb_years))
+        def one_by_one():
+            for r in rates:
+                simulation.set_discount_rate(r)
+                simulation.compute_evolution('net_transfers', years)
+        grid = best_time(lambda: simulation.evaluate_scenarios('net_transfers', years=years, discount_rate=rates), repeat)
+        loop = best_time(one_by_one, repeat)
+        results.append({'year_length': year_length, 'one_by_one': loop, 'grid': grid, 'speedup': loop/grid})
+    return DataFrame(results, columns=['year_length', 'one_by_one', 'grid', 'speedup'])
+
+
+def bench_population_projection(nb_variants=(10, 100), nb_years=300, repeat=3):
+    """
+    Compares the cohort component projection of nb_variants demographic variants at once with one 
+    projection per variant
+    """
+    results = []
+    fertility = where((arange(101) >= 20) & (arange(101) < 40), 0.1, 0)
+    for nb in nb_variants:
+        survival = 0.99*ones((101, 2))*linspace(0.995, 1, nb)[:, None, None]
+        def one_by_one():
+            for variant in survival:
+                project_cube(ones((101, 2)), variant, fertility, nb_years)
+        batch = best_time(lambda: project_cube(ones((101, 2)), survival, fertility, nb_years), repeat)
+        loop = best_time(one_by_one, repeat)
+        results.append({'nb_variants': nb, 'one_by_one': loop, 'batch': batch, 'speedup': loop/batch})
+    return DataFrame(results, columns=['nb_variants', 'one_by_one', 'batch', 'speedup'])
+
+
+if __name__ == '__main__':
+    print bench_generation_present_value().to_string()
+    print bench_filter_value().to_string()
+    print bench_extract_generations().to_string()
+    print bench_present_values().to_string()
+    print bench_scenarios().to_string()
+    print bench_scenario_years().to_string()
+    print bench_population_projection().to_string()
@@ -175,11 +175,13 @@ def produce_gen_accounts(year=1996):
 def produce_percap_transfert_flux(simulation=simulation, year_list = range(1996, 2050, 10), year_min=1996):
     
     print 'producing flux of transfers per capita'
-    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop']]
+    tmp['dsct'] = simulation.cohorts['dsct']
     tmp['running_transfers'] = tmp['net_transfers']
     tmp['net_transfers'] *= tmp['dsct']
 
-    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop']]
+    tmp_2['dsct'] = simulation.cohorts_alt['dsct']
     tmp_2['running_transfers'] = tmp_2['net_transfers']
     tmp_2['net_transfers'] *= tmp_2['dsct']
     print xls
@@ -206,11 +208,13 @@ def produce_percap_transfert_flux(simulation=simulation, year_list = range(1996,
 def produce_agg_transfert_flux(simulation=simulation, year_list = range(1996, 2050, 10), year_min=1996):
     
     print 'entering generation of aggregated flux of payments '
-    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp = simulation.cohorts.loc[:, ['net_transfers', 'pop']]
+    tmp['dsct'] = simulation.cohorts['dsct']
     tmp['running_transfers'] = tmp['net_transfers']
     tmp['net_transfers'] *= tmp['dsct']*tmp['pop']
 
-    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop', 'dsct']]
+    tmp_2 = simulation.cohorts_alt.loc[:, ['net_transfers', 'pop']]
+    tmp_2['dsct'] = simulation.cohorts_alt['dsct']
     tmp_2['running_transfers'] = tmp_2['net_transfers']
     tmp_2['net_transfers'] *= tmp_2['dsct']*tmp_2['pop']
     print type(str(str(xls)+'\agre_agg.xlsx'))
@@ -235,101 +239,37 @@ def produce_agg_transfert_flux(simulation=simulation, year_list = range(1996, 20
 
 def produce_ipl_evolution(simulation, year_min = 1996):
     
-    arrays=arange(year_min, year_min+60)
-    record = DataFrame(index=arrays)
-    record['ipl'] = NaN
-    record['ipl_réforme'] = NaN
+    years = arange(year_min, year_min+60)
+    record = DataFrame(index=years)
     
-    for year in range(year_min, year_min+60):
-        print year
-        #On tente de tronquer la df au fil du temps
-        try:
-            simulation.population = simulation.population.drop(labels=year-1, level='year')
-            simulation.population_alt = simulation.population_alt.drop(labels=year-1, level='year')
-        except:
-            print 'except path'
-            pass
-        
-        taxes_list = ['tva', 'tipp', 'cot', 'irpp', 'impot', 'property']
-        payments_list = ['chomage', 'retraite', 'revsoc', 'maladie', 'educ']
-        
-        simulation.create_cohorts()
-        simulation.create_cohorts(default=False)
-
-        simulation.cohorts.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-        simulation.create_present_values('net_transfers', default=True)
-        
-        simulation.cohorts_alt.loc[[x>=2027 for x in simulation.cohorts_alt.index.get_level_values(2)], 'retraite'] *= (1-0.1)
-        simulation.cohorts_alt.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-        simulation.create_present_values('net_transfers', default=False)
-
-#                     imbalance = simulation.compute_gen_imbalance(typ='net_transfers')
-        ipl = simulation.compute_ipl(typ='net_transfers')
-        ipl_alt = simulation.compute_ipl(typ='net_transfers', default=False)
-       
-        
-        record.loc[year, "ipl"] = ipl/(8050.6e+09*(1+simulation.growth_rate)**(year-year_min))
-        record.loc[year, 'ipl_réforme'] = ipl_alt/(8050.6e+09*(1+simulation.growth_rate)**(year-year_min))
+    # The reform is evaluated from the present value of its change of the baseline profiles
+    simulation.clear_reforms()
+    simulation.add_reform('retraite', factor=1-0.1, year=slice(2027, None))
+    simulation.create_present_values('net_transfers', default=True)
+    simulation.create_reform_present_values('net_transfers')
+    
+    # Every base year is computed from the present values of the first year
+    evolution = simulation.compute_evolution('net_transfers', years=years)
+    evolution_alt = simulation.compute_evolution('net_transfers', years=years, default=False)
+    gdp = 8050.6e+09*(1+simulation.growth_rate)**(years-year_min)
+    record['ipl'] = evolution['ipl'].values/gdp
+    record['ipl_réforme'] = evolution_alt['ipl'].values/gdp
 
     record.to_excel(xls+'\ipl_flux_agre.xlsx', 'ipl_relative_au_pib')
     gc.collect()
 
 def produce_imbalance_evolution(simulation=simulation, year_min = 1996):
     
-    arrays=arange(year_min, year_min+60)
-    record = DataFrame(index=arrays)
-    record['déséquilibre'] = NaN
-    record['déséquilibre_alt'] = NaN
+    years = arange(year_min, year_min+60)
+    record = DataFrame(index=years)
     
-#     for year in range(year_min, year_min+60):
-#         print year
-#         #On tente de tronquer la df au fil du temps
-#         try:
-#             simulation.aggregate_pv = simulation.aggregate_pv.drop(labels=year-1, level='year')
-#             simulation.aggregate_pv_alt = simulation.aggregate_pv_alt.drop(labels=year-1, level='year')
-#         except:
-#             print 'except path'
-#             pass
-#         simulation.aggregate_pv = AccountingCohorts(simulation.aggregate_pv)
-#         simulation.aggregate_pv_alt = AccountingCohorts(simulation.aggregate_pv_alt)
-#         
-#         ratio_base = simulation.compute_gen_imbalance(typ='net_transfers')
-#         ratio_alt = simulation.compute_gen_imbalance(typ='net_transfers', default=False)
-#         record.loc[year, "déséquilibre"] = ratio_base
-#         record.loc[year, 'déséquilibre_alt'] = ratio_alt
-#     print record.head(30).to_string()
-#     record.to_excel(xls+'imbalance_flux.xlsx', 'flux de déséquilibre')
-
-    for year in range(year_min, year_min+60):
-        print year
-        #On tente de tronquer la df au fil du temps
-        try:
-            simulation.population = simulation.population.drop(labels=year-1, level='year')
-            simulation.population_alt = simulation.population_alt.drop(labels=year-1, level='year')
-        except:
-            print 'except path'
-            pass
-        
-        taxes_list = ['tva', 'tipp', 'cot', 'irpp', 'impot', 'property']
-        payments_list = ['chomage', 'retraite', 'revsoc', 'maladie', 'educ']
-        
-        simulation.create_cohorts()
-        simulation.create_cohorts(default=False)
-
-        simulation.cohorts.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-        simulation.create_present_values('net_transfers', default=True)
-        
-        simulation.cohorts_alt.loc[[x>=2027 for x in simulation.cohorts_alt.index.get_level_values(2)], 'retraite'] *= (1-0.1)
-        simulation.cohorts_alt.compute_net_transfers(name = 'net_transfers', taxes_list = taxes_list, payments_list = payments_list)
-        simulation.create_present_values('net_transfers', default=False)
-
-#                     imbalance = simulation.compute_gen_imbalance(typ='net_transfers')
-        imbalance = simulation.compute_gen_imbalance(typ='net_transfers')
-        imbalance_alt = simulation.compute_gen_imbalance(typ='net_transfers', default=False)
-       
-        
-        record.loc[year, "déséquilibre"] = imbalance
-        record.loc[year, 'déséquilibre_alt'] = imbalance_alt
+    simulation.clear_reforms()
+    simulation.add_reform('retraite', factor=1-0.1, year=slice(2027, None))
+    simulation.create_present_values('net_transfers', default=True)
+    simulation.create_reform_present_values('net_transfers')
+    
+    record['déséquilibre'] = simulation.compute_evolution('net_transfers', years=years)['ratio']
+    record['déséquilibre_alt'] = simulation.compute_evolution('net_transfers', years=years, default=False)['ratio']
     record.to_excel(xls+'\imbalance_flux_agre.xlsx', 'flux de déséquilibre')
     
 
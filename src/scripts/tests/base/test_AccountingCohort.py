@@ -8,6 +8,7 @@ import nose
 from src.lib.cohorts.data_cohorts import DataCohorts
 from src.lib.cohorts.accounting_cohorts import AccountingCohorts
 from numpy import array
+from pandas import DataFrame
 from src.scripts.tests.utils import (create_testing_population_dataframe,
                                      create_empty_population_dataframe,
                                      create_constant_profiles_dataframe,
@@ -55,6 +56,30 @@ def test_generation_extraction():
         assert abs((1+g)**(count+(start-2001)) + generation.get_value((count, 1, start+count), 'tax')) == 0.0
         count +=1
 
+def test_generations_extraction():
+    """
+    Testing that every generation read along the diagonals matches the single generation extraction
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2031, rate=0.01)
+    profile = create_constant_profiles_dataframe(population, tax=-1, sub=0.5)
+    cohort = DataCohorts(population)
+    cohort._fill(profile)
+    cohort.proj_tax(0.05, 0, None, method = 'per_capita')
+    cohort = AccountingCohorts(cohort)
+
+    generations = cohort.extract_generations(['tax', 'pop'])
+    assert list(generations.index[[0, -1]]) == [1901, 2030]
+    for birth_year in [1901, 1950, 2010, 2030]:
+        year = max(birth_year, 2001)
+        generation = cohort.extract_generation(year, typ = 'tax', age = year - birth_year)
+        for (age, sex, yr), value in generation['tax'].iteritems():
+            assert generations.get_value(birth_year, ('tax', sex, age)) == value
+        assert generations.loc[birth_year, 'tax'].count() == len(generation)
+
+    subset = cohort.extract_generations('tax', birth_years = [1950, 2010])
+    assert (subset.fillna(0).values == generations['tax'].loc[[1950, 2010]].fillna(0).values).all()
+
+
 def test_create_age_class():
     """
     Testing the method to regroup age classes
@@ -77,6 +102,31 @@ def test_create_age_class():
 
 
 
+def test_create_age_classes():
+    """
+    Testing that several age class definitions computed at once match the sums of the ages grouped by class
+    """
+    population = create_testing_population_dataframe(2001, 2011)
+    profile = create_constant_profiles_dataframe(population, tax = 1.0, sub=-0.5)
+    cohort = DataCohorts(population)
+    cohort._fill(profile)
+    pv = cohort.per_capita_generation_present_value('tax', discount_rate=0)
+
+    age_classes = pv.create_age_classes([5, 10, [0, 18, 65]], typ='tax')
+    frame = DataFrame(pv[['pop', 'tax']]).reset_index()
+    for step, first_age in [(5, lambda age: age//5*5), (10, lambda age: age//10*10),
+                            ((0, 18, 65), lambda age: 0 if age < 18 else (18 if age < 65 else 65))]:
+        grouped = frame.copy()
+        grouped['age'] = grouped['age'].map(first_age)
+        expected = grouped.groupby(['age', 'sex', 'year']).sum()
+        expected['tax'] = expected['tax']/expected['pop']
+        age_class = age_classes[step]
+        assert sorted(age_class.index_sets['age']) == sorted(set(expected.index.get_level_values('age')))
+        for col in ['pop', 'tax']:
+            values = age_class[col].reindex(expected.index)
+            assert (abs(values - expected[col]) < 1e-10*abs(expected[col]).max()).all()
+
+
 if __name__ == "__main__":
 #     test_compute_ipl()
 #     test_create_age_class()
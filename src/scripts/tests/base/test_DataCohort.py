@@ -44,6 +44,15 @@ def test_fill_cohort():
     test_value = cohorts_test.get_value((0,0,2060), 'tax')
     assert test_value == -1
     
+
+def test_fill_cohort_year():
+    population = create_empty_population_dataframe(2001, 2061)
+    profiles = create_constant_profiles_dataframe(population, tax = -1, subsidies = 0.5)
+    cohorts_test = DataCohorts(data = population, columns = ['pop'])
+    cohorts_test._fill(profiles, year = 2010)
+    assert cohorts_test.get_value((3,1,2010), 'subsidies') == 0.5
+    assert cohorts_test['tax'].isnull().sum() == 101*2*59
+
 def test_compute_net_transfers():
     population = create_empty_population_dataframe(2001, 2061)
     profiles = create_constant_profiles_dataframe(population, tax = 1, subsidies = 0.5)
@@ -57,6 +66,22 @@ def test_compute_net_transfers():
     
     pass
 
+def test_compute_net_transfers_definitions():
+    """
+    Testing several weighted net transfer definitions computed at once
+    """
+    population = create_empty_population_dataframe(2001, 2011)
+    profiles = create_constant_profiles_dataframe(population, tax = 1, vat = 2, subsidies = 0.5)
+    cohorts_test = DataCohorts(data = population, columns = ['pop'])
+    cohorts_test._fill(profiles)
+    cohorts_test.compute_net_transfers(weights = {'vat': 0.5},
+                                       definitions = {'net_transfers': (['tax', 'vat'], ['subsidies']),
+                                                      'net_vat': (['vat'], [])})
+    assert cohorts_test.get_value((0, 0, 2010), 'net_transfers') == 1 + 0.5*2 - 0.5
+    assert cohorts_test.get_value((10, 1, 2005), 'net_vat') == 1
+    assert 'total_taxes' not in cohorts_test.columns and 'total_payments' not in cohorts_test.columns
+    assert 'net_transfers' in cohorts_test._types and 'net_vat' in cohorts_test._types
+
 def test_tax_projection():
 
     population = create_empty_population_dataframe(2001, 2061)
@@ -124,6 +149,63 @@ def test_present_value():
         assert cohort3.get_value((count, 1, 2001), 'tax')*size_generation == res_control.get_value((count, 0, 2001), 'tax')
         count +=1
 
+def test_present_values():
+    """
+    Testing the present values of several columns computed together against the sums of the discounted 
+    flows along the birth cohort diagonals
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2041, rate=0.005)
+    profiles = create_constant_profiles_dataframe(population, tax = 1.0, sub = 0.5)
+    cohort = DataCohorts(population)
+    cohort.population_project(40, method = 'exp_growth', growth_rate = 0.005)
+    cohort._fill(profiles)
+    cohort.proj_tax(0.01, method = 'per_capita')
+    cohort.gen_dsct(0.03)
+    cohort.compute_net_transfers(taxes_list = ['tax'], payments_list = ['sub'])
+
+    typ_list = ['tax', 'sub', 'net_transfers']
+    pv = cohort.aggregate_generation_present_values(typ_list, discount_rate = 0.03)
+    percapita_pv = cohort.per_capita_generation_present_values(discount_rate = 0.03)
+    age_max, year_min, year_max = max(cohort.index_sets['age']), cohort._year_min, cohort._year_max
+    for year in [2001, 2021]:
+        for age in range(age_max + 1):
+            control = dict((typ, 0) for typ in typ_list)
+            k = 0
+            while age + k <= age_max and year + k <= year_max:
+                row = (age + k, 1, year + k)
+                for typ in typ_list:
+                    control[typ] += cohort.get_value(row, typ)*cohort.get_value(row, 'pop')/1.03**(year + k - year_min)
+                k += 1
+            for typ in typ_list:
+                assert abs(pv.get_value((age, 1, year), typ) - control[typ]) < 1e-10
+                assert abs(percapita_pv.get_value((age, 1, year), typ)*cohort.get_value((age, 1, year), 'pop') 
+                           - control[typ]) < 1e-10
+
+
+def test_delta_present_values_rate():
+    """
+    Testing that the present values of a change at a given discount rate, with their tail, match those 
+    of a cohort discounted at that rate
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2041, rate=0.005)
+    profiles = create_constant_profiles_dataframe(population, tax = 1.0, sub = 0.5)
+    cohort = DataCohorts(population)
+    cohort.population_project(40, method = 'exp_growth', growth_rate = 0.005)
+    cohort._fill(profiles)
+    cohort.proj_tax(0.01, method = 'per_capita')
+    cohort.compute_net_transfers(taxes_list = ['tax'], payments_list = ['sub'])
+    rows = cohort.row_mask(age = slice(20, 64), year = slice(2030, None)).nonzero()[0]
+    deltas = {'tax': (rows, 0.1 + 0*rows)}
+
+    control = cohort.clone()
+    control.gen_dsct(0.04)
+    expected = control.delta_present_values('net_transfers', deltas, tail = True)
+    cohort.gen_dsct(0.03)
+    pv = cohort.delta_present_values('net_transfers', deltas, discount_rate = 0.04, tail = True)
+    assert (abs(pv['net_transfers'] - expected['net_transfers']) < 1e-10).all()
+    assert abs(pv._tail['net_transfers']/expected._tail['net_transfers'] - 1) < 1e-12
+
+
 if __name__ == "__main__":
     
 #     test_population_projection()
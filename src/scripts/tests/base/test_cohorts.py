@@ -10,7 +10,9 @@
 import nose
 from src.lib.cohorts.cohort import Cohorts
 from src.lib.cohorts.data_cohorts import DataCohorts
-from numpy import array
+from src.lib.cohorts.cube import diagonal_suffix_sum
+from src.lib.utils import LRUCache
+from numpy import array, arange
 from src.scripts.tests.utils import (create_testing_population_dataframe,
                                      create_empty_population_dataframe,
                                      create_constant_profiles_dataframe,
@@ -52,6 +54,23 @@ def test_dsct():
     assert test_value <= 1
     
 
+def test_factors():
+    """
+    Testing that discount and growth factors are cached per-year vectors broadcast on demand
+    """
+    population = create_empty_population_dataframe(2001, 2061)
+    cohorts = Cohorts(data = population, columns = ['pop'])
+    cohorts.gen_dsct(0.05)
+    dsct = cohorts._factors['dsct']
+    cohorts.gen_dsct(0.05)
+    assert 'dsct' not in cohorts.columns
+    assert cohorts._factors['dsct'] is dsct
+    assert cohorts['dsct'].get_value((7, 1, 2003)) == 1/1.05**2
+    cohorts.gen_grth(0.02)
+    grown = cohorts['pop']*cohorts['grth']
+    assert grown.get_value((7, 1, 2003)) == 1.02**2
+
+
 
 def test_filter_value():
     """
@@ -75,6 +94,94 @@ def test_filter_value():
         count +=5
 
 
+def test_filter_value_selectors():
+    """
+    Testing that filter_value accepts scalars, lists and slices and returns a copy unless asked for a view
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2011)
+    cohort = DataCohorts(population)
+
+    by_slice = cohort.filter_value(age=slice(3, 5), typ='pop')
+    by_list = cohort.filter_value(age=[3, 4, 5], typ='pop')
+    assert (by_slice.index == by_list.index).all() and (by_slice['pop'] == by_list['pop']).all()
+    assert len(by_slice) == 3*2*10
+    before = cohort.get_value((4, 1, 2005), 'pop')
+    by_slice['pop'] += 1
+    assert cohort.get_value((4, 1, 2005), 'pop') == before
+    assert by_slice.get_value((4, 1, 2005), 'pop') == before + 1
+    
+    view = cohort.filter_value(age=slice(3, 5), typ='pop', copy=False)
+    view['pop'] += 1
+    assert cohort.get_value((4, 1, 2005), 'pop') == before + 1
+
+    newborn_males = cohort.filter_value(age=0, sex=0, year=range(2005, 2008), typ='pop')
+    assert list(newborn_males.index) == [(0, 0, 2005), (0, 0, 2006), (0, 0, 2007)]
+
+
+
+def test_cube():
+    """
+    Testing the round trip between a cohort and its ndarray[age, sex, year] cube
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2061, rate=0.05)
+    profile = create_constant_profiles_dataframe(population, tax=-1, sub=0.5)
+    cohort = DataCohorts(population)
+    cohort._fill(profile)
+    cube = cohort.to_cube()
+    assert cube['pop'].shape == (101, 2, 60)
+    assert cube.get_value((3, 1, 2010), 'pop') == cohort.get_value((3, 1, 2010), 'pop')
+    assert cube['pop'][3, 1, 9] == cohort.get_value((3, 1, 2010), 'pop')
+    cohort2 = Cohorts.from_cube(cube)
+    assert (cohort2['pop'] == cohort['pop']).all()
+    assert (cohort2['tax'] == cohort['tax']).all()
+
+
+def test_diagonal_suffix_sum():
+    """
+    Testing the kernel of the generational present values against the year by year recursion
+    """
+    values = arange(5*2*7, dtype=float).reshape((5, 2, 7))
+    control = values.copy()
+    for year in range(5, -1, -1):
+        control[:-1, :, year] += control[1:, :, year+1]
+    assert (diagonal_suffix_sum(values) == control).all()
+    batch = diagonal_suffix_sum(array([values, 2*values]))
+    assert (batch[1] == 2*control).all()
+
+
+def test_present_value_operator():
+    """
+    Testing that cohorts on the same grid share the cached present value operator of a discount rate
+    """
+    population = create_testing_population_dataframe(year_start=2001, year_end=2011)
+    profile = create_constant_profiles_dataframe(population, tax=-1, sub=0.5)
+    cohort = DataCohorts(population)
+    cohort._fill(profile)
+    other = DataCohorts(population)
+
+    operator = cohort.present_value_operator(0.03)
+    assert other.present_value_operator(0.03) is operator
+    assert cohort.present_value_operator(0.04) is not operator
+
+    flows = cohort.to_cube(['tax'])['tax']
+    discounted = flows*1.03**-arange(10)
+    assert (abs(operator.apply(flows) - diagonal_suffix_sum(discounted)) < 1e-12).all()
+    pv = cohort.aggregate_generation_present_value('tax', discount_rate=0.03)
+    assert abs(pv.get_value((20, 1, 2003), 'tax') - operator.apply(flows)[20, 1, 2]*cohort.get_value((20, 1, 2003), 'pop')) < 1e-12
+
+
+def test_lru_cache():
+    """
+    Testing that the least recently used item is dropped first
+    """
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert cache.get_or_create('d', lambda: 4) == 4 and len(cache) == 2
+
 
 if __name__ == '__main__':
 
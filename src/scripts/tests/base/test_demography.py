@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+'''
+Tests of the population projection by components
+'''
+from __future__ import division
+import nose
+from numpy import arange, array, ones, where, zeros
+from src.lib.demography import leslie_step, cohort_component_projection, BOYS_SHARE
+from src.lib.simulation import Simulation
+from src.scripts.tests.utils import (create_testing_population_dataframe,
+                                     create_constant_profiles_dataframe)
+
+
+def test_leslie_step():
+    """
+    Testing the ageing, the open age group, the births and the migration of one year
+    """
+    population = arange(10, dtype=float).reshape((5, 2))
+    survival = 0.5*ones((5, 2))
+    fertility = array([0, 1, 1, 0, 0])
+    migration = zeros((5, 2))
+    migration[2, 0] = 3
+    res = leslie_step(population, survival, fertility, migration)
+    assert (res[1:4, :] == 0.5*population[:3, :] + migration[1:4, :]).all()
+    assert (res[4, :] == 0.5*(population[3, :] + population[4, :])).all()
+    births = population[1, 1] + population[2, 1]
+    assert res[0, 0] == BOYS_SHARE*births and res[0, 1] == (1 - BOYS_SHARE)*births
+
+
+def test_cohort_component_projection():
+    """
+    Testing that the variants projected at once match the projections of each variant and that
+    the projected population can be simulated
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2011)
+    ages = arange(101)
+    survival = 0.99*ones((101, 2))
+    fertility = where((ages >= 20) & (ages < 40), 0.1, 0)
+    projected = cohort_component_projection(population_dataframe, survival, fertility, 30)
+    assert abs(projected.get_value((40, 0, 2030), 'pop') - 0.99**20) < 1e-12
+    assert projected.get_value((3, 1, 2005), 'pop') == population_dataframe.get_value((3, 1, 2005), 'pop')
+
+    variants = cohort_component_projection(population_dataframe, array([survival, 0.98*survival]),
+                                           array([fertility, 1.2*fertility]), 30, variants=['low', 'high'])
+    assert (variants['low']['pop'] == projected['pop']).all()
+    control = cohort_component_projection(population_dataframe, 0.98*survival, 1.2*fertility, 30)
+    assert (abs(variants['high']['pop'] - control['pop']) < 1e-12).all()
+
+    simulation = Simulation()
+    simulation.set_population(projected)
+    simulation.set_profiles(create_constant_profiles_dataframe(projected, tax=1.0, sub=0.5))
+    simulation.set_population_projection(year_length=60, method="stable")
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.create_cohorts()
+    assert simulation.cohorts.get_value((40, 0, 2030), 'pop') == projected.get_value((40, 0, 2030), 'pop')
+
+
+if __name__ == '__main__':
+    nose.core.runmodule(argv=[__file__, '-v', '-i test_*.py'])
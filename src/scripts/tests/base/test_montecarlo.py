@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+'''
+Tests of the Monte Carlo evaluation of rate scenarios
+'''
+from __future__ import division
+import nose
+import warnings
+from numpy import percentile
+from numpy.random import RandomState
+from src.lib.simulation import Simulation
+from src.lib.scenarios import ScenarioGrid
+from src.lib.montecarlo import StreamingSummary, normal_sampler, path_sampler
+from src.scripts.tests.utils import (create_testing_population_dataframe,
+                                     create_constant_profiles_dataframe)
+
+
+def test_streaming_summary():
+    """
+    Testing the streaming moments and quantiles against the statistics of the stored observations
+    """
+    values = RandomState(0).standard_normal((5000, 2))*[1, 3] + [0, 2]
+    summary = StreamingSummary(['a', 'b'], quantiles=[0.05, 0.5, 0.95])
+    for start in range(0, len(values), 300):
+        summary.update(values[start:start + 300])
+    res = summary.result()
+    assert summary.count == 5000
+    assert (abs(res['mean'].values - values.mean(axis=0)) < 1e-12).all()
+    assert (abs(res['std'].values - values.std(axis=0, ddof=1)) < 1e-12).all()
+    for p in [0.05, 0.5, 0.95]:
+        assert (abs(res[p].values - percentile(values, 100*p, axis=0)) < 0.05*values.std(axis=0)).all()
+
+
+def create_simulation(discount_rate = 0.04, growth_rate = 0.01):
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(growth_rate)
+    simulation.set_discount_rate(discount_rate)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.set_gov_spendings(5, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    return simulation
+
+
+def test_monte_carlo():
+    """
+    Testing that the draws are reproducible and that their mean is the mean of the evaluated scenarios
+    """
+    simulation = create_simulation()
+
+    sampler = normal_sampler(discount_rate=(0.04, 0.005), growth_rate=(0.01, 0.003))
+    res = simulation.monte_carlo('net_transfers', sampler, 500, seed=1, batch_size=500, gov_spendings=5)
+    assert (res == simulation.monte_carlo('net_transfers', sampler, 500, seed=1, batch_size=500,
+                                          gov_spendings=5)).all().all()
+    scenarios = ScenarioGrid(simulation).evaluate(5, **sampler(RandomState(1), 500))
+    assert abs(res.get_value('ipl', 'mean')/scenarios['ipl'].mean() - 1) < 1e-12
+
+    by_year = simulation.monte_carlo('net_transfers', sampler, 100, seed=1, gov_spendings=5, years=[2001, 2010])
+    assert list(by_year.loc['ipl'].index) == [2001, 2010]
+
+
+def test_divergent_draws():
+    """
+    Testing that the draws whose infinite horizon tail does not converge are excluded and counted
+    """
+    simulation = create_simulation(discount_rate = 0.03, growth_rate = 0.015)
+    sampler = normal_sampler(discount_rate=(0.03, 0.01), growth_rate=(0.015, 0.01))
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        res = simulation.monte_carlo('net_transfers', sampler, 1000, seed=3, batch_size=1000, gov_spendings=5)
+    assert len(caught) == 1
+    
+    draws = sampler(RandomState(3), 1000)
+    r, g = draws['discount_rate'], draws['growth_rate']
+    kept = ((1 + g)*1.005 < 1 + r) & (1.005 < 1 + r)
+    assert 0 < kept.sum() < 1000
+    assert (res['count'] == kept.sum()).all()
+    scenarios = ScenarioGrid(simulation).evaluate(5, discount_rate=r[kept], growth_rate=g[kept])
+    assert abs(res.get_value('ipl', 'mean')/scenarios['ipl'].mean() - 1) < 1e-12
+
+
+def test_path_monte_carlo():
+    """
+    Testing that the draws of paths of rates match simulations with these paths, and that draws without
+    deviations are the mean paths
+    """
+    simulation = create_simulation()
+    discount_rate = [0.05, 0.048, 0.045, 0.04]
+    growth_rate = [0.02, 0.015, 0.01]
+    control = create_simulation(discount_rate, growth_rate)
+    expected = control.compute_evolution('net_transfers', years=[2001, 2010])
+    
+    sampler = path_sampler(30, discount_rate=(discount_rate, 0), growth_rate=(growth_rate, 0))
+    res = simulation.monte_carlo('net_transfers', sampler, 10, seed=1, gov_spendings=5, years=[2001, 2010])
+    for key in ['ipl', 'ratio']:
+        assert (abs(res['mean'][key].values/expected[key].values - 1) < 1e-12).all()
+        assert (res['std'][key].values < 1e-10*abs(expected[key].values)).all()
+    
+    sampler = path_sampler(30, persistence=0.8, discount_rate=(0.04, 0.005), growth_rate=(growth_rate, 0.003))
+    draws = sampler(RandomState(2), 3)
+    assert draws['discount_rate'].shape == (3, 30) and draws['discount_rate'].std(axis=1).min() > 0
+    scenarios = ScenarioGrid(simulation).evaluate_paths(5, **draws)
+    for k in range(3):
+        control = create_simulation(list(draws['discount_rate'][k]), list(draws['growth_rate'][k]))
+        assert abs(scenarios['ipl'][k]/control.compute_ipl('net_transfers') - 1) < 1e-12
+        assert abs(scenarios['ratio'][k]/control.compute_gen_imbalance('net_transfers') - 1) < 1e-12
+
+
+if __name__ == '__main__':
+    nose.core.runmodule(argv=[__file__, '-v', '-i test_*.py'])
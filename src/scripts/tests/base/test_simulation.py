@@ -6,7 +6,9 @@ Created on 26 avr. 2013
 '''
 from __future__ import division
 import nose
-from src.lib.simulation import Simulation
+import warnings
+from src.lib.simulation import Simulation, _stage_cache
+from src.lib.scenarios import ScenarioGrid
 from src.scripts.tests.utils import (create_testing_population_dataframe,
                                      create_constant_profiles_dataframe,
                                      create_neutral_profiles_cohort)
@@ -15,7 +17,8 @@ import os
 from src.lib.simulation import Simulation
 from src.lib.cohorts.accounting_cohorts import AccountingCohorts
 from pandas import read_csv, HDFStore, concat, ExcelFile, DataFrame, MultiIndex
-from numpy import array, hstack, arange, NaN
+from numpy import array, hstack, arange, NaN, ones, where, isnan
+from src.lib.cohorts.cube import diagonal_suffix_sum
 import matplotlib.pyplot as plt
 from src import SRC_PATH
 from src.lib.cohorts.accounting_cohorts import AccountingCohorts
@@ -65,6 +68,534 @@ def test_compute_gen_imbalance():
 #     print gen_imbalance, -5000.0/(2*199.0)
     assert gen_imbalance == -5000.0/(2*199.0)
 
+def test_infinite_horizon_tail():
+    """
+    Testing that the closed form tail makes the ipl and the imbalance independent of the horizon
+    """
+    def simulate(year_length, tail):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        profiles_dataframe.loc[profiles_dataframe.index.get_level_values(0) >= 60, 'sub'] = 2.0
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_year_length(year_length)
+        simulation.set_population_projection(year_length=year_length, method="exp_growth", tail=tail)
+        simulation.set_tax_projection(method="desynchronized", rate=0.01, inflation_rate=0.015, 
+                                      typ=['tax'], payments_list=['sub'])
+        simulation.set_growth_rate(0.01)
+        simulation.set_discount_rate(0.04)
+        simulation.set_population_growth_rate(0.005)
+        simulation.create_cohorts()
+        simulation.set_gov_wealth(-10)
+        simulation.set_gov_spendings(5, compute=True)
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return (simulation.compute_ipl('net_transfers'), 
+                simulation.compute_gen_imbalance('net_transfers', to_return='n_1'))
+    
+    ipl_short, n_1_short = simulate(40, True)
+    ipl_long, n_1_long = simulate(100, True)
+    ipl_truncated, n_1_truncated = simulate(700, False)
+    assert abs(ipl_short/ipl_long - 1) < 1e-10 and abs(n_1_short/n_1_long - 1) < 1e-10
+    assert abs(ipl_short/ipl_truncated - 1) < 1e-5 and abs(n_1_short/n_1_truncated - 1) < 1e-5
+
+
+def test_select_year_length():
+    """
+    Testing that the horizon grows until the ipl converges and that extended years match a projection
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=40, method="exp_growth")
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    
+    year_length = simulation.select_year_length('net_transfers', tolerance=1e-5, step=20)
+    assert year_length > 40 and simulation.year_length == year_length
+    assert abs(simulation.compute_ipl('net_transfers', precision=True)) <= 1e-5
+    
+    control = Simulation()
+    control.set_population(population_dataframe)
+    control.set_profiles(profiles_dataframe)
+    control.set_population_projection(year_length=year_length, method="exp_growth")
+    control.set_tax_projection(method="per_capita", rate=0.01)
+    control.set_growth_rate(0.01)
+    control.set_discount_rate(0.03)
+    control.set_population_growth_rate(0.005)
+    control.create_cohorts()
+    control.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    control.create_present_values('net_transfers')
+    assert abs(control.compute_ipl('net_transfers')/simulation.compute_ipl('net_transfers') - 1) < 1e-10
+
+
+def test_stage_cache():
+    """
+    Testing that a new discount rate reuses the projected cohorts, which are not changed by the simulations
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.02)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=60, method="exp_growth")
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.cohorts['tax'] *= 2
+    
+    hits = _stage_cache.hits
+    simulation.set_discount_rate(0.04)
+    simulation.create_cohorts()
+    assert _stage_cache.hits == hits + 3
+    assert 'net_transfers' not in simulation.cohorts.columns
+    assert simulation.cohorts.get_value((30, 1, 2031), 'tax') == 1.01**30
+    assert simulation.cohorts.get_value((30, 1, 2031), 'dsct') == 1/1.04**30
+    
+    simulation.set_growth_rate(0.02)
+    simulation.set_tax_projection(method="per_capita", rate=0.02)
+    simulation.create_cohorts()
+    assert _stage_cache.hits == hits + 5
+    assert simulation.cohorts.get_value((30, 1, 2031), 'tax') == 1.02**30
+
+
+def test_update():
+    """
+    Testing that the outputs are computed again only when the attributes they depend on change
+    """
+    def create_simulation(r):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_year_length(60)
+        simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+        simulation.set_tax_projection(method="per_capita", rate=0.01)
+        simulation.set_growth_rate(0.01)
+        simulation.set_discount_rate(r)
+        simulation.set_population_growth_rate(0.005)
+        simulation.create_cohorts()
+        simulation.set_gov_wealth(-10)
+        simulation.set_gov_spendings(5, compute=True)
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return simulation
+    
+    simulation = create_simulation(0.03)
+    ipl = simulation.compute_ipl('net_transfers')
+    aggregate_pv = simulation.aggregate_pv
+    simulation.set_gov_wealth(-9)
+    assert simulation.compute_ipl('net_transfers') == ipl - 1
+    assert simulation.aggregate_pv is aggregate_pv
+    
+    simulation.set_discount_rate(0.04)
+    control = create_simulation(0.04)
+    control.set_gov_wealth(-9)
+    assert abs(simulation.compute_ipl('net_transfers')/control.compute_ipl('net_transfers') - 1) < 1e-12
+    assert simulation.aggregate_pv is not aggregate_pv
+    assert simulation.net_gov_spendings == control.net_gov_spendings
+    assert (simulation.cohorts['net_transfers'] == control.cohorts['net_transfers']).all()
+    
+    simulation.aggregate_pv = aggregate_pv
+    simulation.set_discount_rate(0.05)
+    assert simulation.compute_ipl('net_transfers') == ipl - 1 + simulation.net_gov_spendings - 5*1.01/0.02
+
+
+def test_shared_projections():
+    """
+    Testing that the projections set for the alternate hypotheses set do not change the default one,
+    and that cohorts changed in place are not created again
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_population(population_dataframe, default=False)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+    simulation.set_tax_projection(method="desynchronized", inflation_rate=0.005, typ=['tax'], payments_list=['sub'])
+    for default in [True, False]:
+        simulation.set_growth_rate(0.01, default=default)
+        simulation.set_discount_rate(0.03, default=default)
+        simulation.set_population_growth_rate(0.005, default=default)
+    simulation.create_cohorts()
+    simulation.set_gov_wealth(-10)
+    simulation.set_gov_spendings(5, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    ipl = simulation.compute_ipl('net_transfers')
+    
+    simulation.set_tax_projection(method="aggregate")
+    simulation.set_population_projection(tail=False)
+    simulation.create_cohorts(default=False)
+    simulation.set_gov_spendings(5, default=False, compute=True)
+    simulation.cohorts_alt.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers', default=False)
+    assert simulation.compute_ipl('net_transfers', default=False) != ipl
+    assert simulation.compute_ipl('net_transfers') == ipl
+    
+    simulation.set_discount_rate(0.04)
+    control = simulation.compute_ipl('net_transfers')
+    assert control != ipl
+    assert simulation.aggregate_pv._tail
+    
+    cohorts = simulation.cohorts
+    cohorts.loc[cohorts.index.get_level_values(2) >= 2010, 'tax'] *= 0.9
+    cohorts.compute_net_transfers('reformed_net_transfers', taxes_list=['tax'], payments_list=['sub'])
+    simulation.set_discount_rate(0.03)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        simulation.create_present_values('reformed_net_transfers')
+        assert simulation.compute_ipl('reformed_net_transfers') != ipl
+    assert len(caught) == 1
+    assert simulation.cohorts is cohorts
+
+
+def test_compute_evolution():
+    """
+    Testing that the indicators of a base year match a simulation starting in that year with the same last year
+    """
+    def create_simulation(year_start):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        population_dataframe = population_dataframe[population_dataframe.index.get_level_values('year') >= year_start]
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        profiles_dataframe.loc[profiles_dataframe.index.get_level_values(0) >= 60, 'sub'] = 2.0
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_population_projection(year_length=2061-year_start, method="exp_growth", tail=True)
+        simulation.set_tax_projection(method="per_capita", rate=0)
+        simulation.set_growth_rate(0)
+        simulation.set_discount_rate(0.03)
+        simulation.set_population_growth_rate(0.005)
+        simulation.create_cohorts()
+        simulation.set_gov_wealth(-10)
+        simulation.set_gov_spendings(40)
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return simulation
+    
+    simulation = create_simulation(2001)
+    evolution = simulation.compute_evolution('net_transfers')
+    assert list(evolution.index) == range(2001, 2061)
+    scenarios = simulation.evaluate_scenarios('net_transfers', years=[2001, 2012], discount_rate=[0.03, 0.04])
+    assert len(scenarios) == 4
+    for year in [2001, 2012]:
+        control = create_simulation(year)
+        assert abs(evolution.get_value(year, 'ipl')/control.compute_ipl('net_transfers') - 1) < 1e-12
+        assert abs(evolution.get_value(year, 'ratio')/control.compute_gen_imbalance('net_transfers') - 1) < 1e-12
+        row = scenarios[(scenarios['year'] == year) & (scenarios['discount_rate'] == 0.03)]
+        assert abs(row['ipl'].values[0]/evolution.get_value(year, 'ipl') - 1) < 1e-12
+        assert abs(row['ratio'].values[0]/evolution.get_value(year, 'ratio') - 1) < 1e-12
+
+
+def test_alternate_evolution():
+    """
+    Testing that the indicators of the alternate hypotheses set match those of a simulation whose default set 
+    has the same rates
+    """
+    def create_simulation(g, g_alt = None):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        simulation = Simulation()
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+        simulation.set_tax_projection(method="per_capita", rate=0.01)
+        for default, rate in [(True, g), (False, g_alt)]:
+            if rate is None:
+                continue
+            simulation.set_population(population_dataframe, default=default)
+            simulation.set_growth_rate(rate, default=default)
+            simulation.set_discount_rate(0.03, default=default)
+            simulation.set_population_growth_rate(0.005, default=default)
+            simulation.create_cohorts(default=default)
+            simulation.set_gov_wealth(-10, default=default)
+            simulation.set_gov_spendings(5, default=default, compute=True)
+            simulation.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'], default=default)
+            simulation.create_present_values('net_transfers', default=default)
+        return simulation
+    
+    simulation = create_simulation(0.01, 0.02)
+    control = create_simulation(0.02)
+    evolution = simulation.compute_evolution('net_transfers', years=[2001, 2010], default=False)
+    expected = control.compute_evolution('net_transfers', years=[2001, 2010])
+    assert ((evolution/expected - 1).abs() < 1e-12).all().all()
+    default = simulation.compute_evolution('net_transfers', years=[2001, 2010])
+    assert not ((default/expected - 1).abs() < 1e-12).all().all()
+
+
+def test_gov_spendings_path():
+    """
+    Testing the present values of paths of spendings against the sums of discounted spendings
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_year_length(60)
+    simulation.set_population_projection(year_length=60, method="exp_growth")
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    
+    simulation.set_gov_spendings(5, compute=True)
+    assert abs(simulation.net_gov_spendings/sum(5*(1.01/1.03)**t for t in range(1, 61)) - 1) < 1e-12
+    
+    population = simulation.cohorts['pop'].sum(level='year')
+    simulation.set_gov_spendings(5, compute=True, per_capita=True)
+    control = sum(5*1.01**t*population.values[t]/population.values[0]/1.03**t for t in range(1, len(population)))
+    assert abs(simulation.net_gov_spendings/control - 1) < 1e-12
+    res = simulation.evaluate_scenarios('net_transfers', gov_spendings=5, per_capita=True, discount_rate=[0.03, 0.04])
+    simulation.set_discount_rate(0.04)
+    assert abs(res['ipl'][1]/simulation.compute_ipl('net_transfers') - 1) < 1e-12
+    
+    simulation.set_gov_spendings(5*ones(len(population)), compute=True)
+    assert abs(simulation.net_gov_spendings - sum(5/1.04**t for t in range(1, len(population)))) < 1e-10
+
+
+def test_rate_paths():
+    """
+    Testing that paths of rates by year discount and project by cumulative products, and that a constant 
+    path gives the results of the constant rate
+    """
+    def create_simulation(r, g, tail):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_year_length(60)
+        simulation.set_population_projection(year_length=60, method="exp_growth", tail=tail)
+        simulation.set_tax_projection(method="per_capita", rate=g)
+        simulation.set_growth_rate(g)
+        simulation.set_discount_rate(r)
+        simulation.set_population_growth_rate(0.005)
+        simulation.create_cohorts()
+        simulation.set_gov_wealth(-10)
+        simulation.set_gov_spendings(5, compute=True)
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return simulation
+    
+    simulation = create_simulation(0.03, 0.01, tail=True)
+    control = create_simulation([0.03]*20, [0.01]*10, tail=True)
+    assert abs(simulation.compute_ipl('net_transfers')/control.compute_ipl('net_transfers') - 1) < 1e-12
+    assert abs(simulation.compute_gen_imbalance('net_transfers')/control.compute_gen_imbalance('net_transfers') - 1) < 1e-12
+    
+    r, g = arange(0.02, 0.045, 0.001), arange(0.02, 0.01, -0.001)
+    simulation = create_simulation(r, g, tail=False)
+    cohorts = simulation.cohorts
+    nb_years = len(cohorts.grid.years)
+    discount = 1/hstack([1, (1 + hstack([r, r[-1]*ones(nb_years)]))[:nb_years-1].cumprod()])
+    growth = hstack([1, (1 + hstack([g, g[-1]*ones(nb_years)]))[:nb_years-1].cumprod()])
+    assert abs(cohorts.get_value((30, 0, 2030), 'tax')/growth[29] - 1) < 1e-12
+    assert abs(simulation.net_gov_spendings/(5*(growth*discount)[1:].sum()) - 1) < 1e-12
+    cube = cohorts.to_cube(['net_transfers', 'pop'])
+    flows = where(isnan(cube['net_transfers']), 0, cube['net_transfers']*cube['pop'])*discount
+    pv = diagonal_suffix_sum(flows)
+    assert abs(simulation.aggregate_pv.to_cube(['net_transfers'])['net_transfers'] - pv).max() < 1e-12*abs(pv).max()
+    
+    # After the horizon the rates of the last year of the cohorts apply, not the last rates of longer paths
+    r, g = arange(0.05, 0.03, -0.0001), arange(0.02, 0.01, -0.00005)
+    simulation = create_simulation(r, g, tail=True)
+    nb_years = len(simulation.cohorts.grid.years)
+    assert nb_years < len(r) and nb_years < len(g)
+    control = create_simulation(r[:nb_years], g[:nb_years], tail=True)
+    ipl = control.compute_ipl('net_transfers')
+    assert abs(simulation.compute_ipl('net_transfers')/ipl - 1) < 1e-12
+    ratio = control.compute_gen_imbalance('net_transfers')
+    assert abs(simulation.compute_gen_imbalance('net_transfers')/ratio - 1) < 1e-12
+    grid = ScenarioGrid(create_simulation(0.03, 0.01, tail=True))
+    scenarios = grid.evaluate_paths(5, discount_rate=[r], growth_rate=[g])
+    assert abs(scenarios['ipl'][0]/ipl - 1) < 1e-12 and abs(scenarios['ratio'][0]/ratio - 1) < 1e-12
+
+
+def test_reform():
+    """
+    Testing that a reform evaluated from its present value matches the projection of the reformed profiles
+    """
+    def create_simulation(reform):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+        simulation.set_tax_projection(method="per_capita", rate=0.01)
+        simulation.set_growth_rate(0.01)
+        simulation.set_discount_rate(0.03)
+        simulation.set_population_growth_rate(0.005)
+        simulation.create_cohorts()
+        if reform:
+            cohorts = simulation.cohorts
+            cohorts.loc[cohorts.row_mask(year=slice(2027, None)), 'sub'] *= 0.9
+            cohorts.loc[cohorts.row_mask(age=slice(20, 64), sex=1), 'tax'] += 0.05
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return simulation
+    
+    simulation = create_simulation(reform=False)
+    simulation.add_reform('sub', factor=0.9, year=slice(2027, None))
+    simulation.add_reform('tax', delta=0.05, age=slice(20, 64), sex=1)
+    simulation.create_reform_present_values('net_transfers')
+    control = create_simulation(reform=True)
+    
+    assert simulation.cohorts_alt is not simulation.cohorts
+    ipl = simulation.compute_ipl('net_transfers', default=False)
+    assert abs(ipl/control.compute_ipl('net_transfers') - 1) < 1e-12
+    n_1 = simulation.compute_gen_imbalance('net_transfers', default=False, to_return='n_1')
+    assert abs(n_1/control.compute_gen_imbalance('net_transfers', to_return='n_1') - 1) < 1e-12
+    assert (abs(simulation.percapita_pv_alt['net_transfers'] - control.percapita_pv['net_transfers']) < 1e-10).all()
+    
+    # The alternative cohorts can be changed without changing the baseline
+    baseline = simulation.cohorts['tax'].copy()
+    simulation.cohorts_alt['tax'] *= 2
+    assert (simulation.cohorts['tax'] == baseline).all()
+    
+    # Successive factors of a profile compound
+    simulation = create_simulation(reform=False)
+    simulation.add_reform('sub', factor=0.9**0.5, year=slice(2027, None))
+    simulation.add_reform('sub', factor=0.9**0.5, year=slice(2027, None))
+    simulation.add_reform('tax', delta=0.05, age=slice(20, 64), sex=1)
+    simulation.create_reform_present_values('net_transfers')
+    assert abs(simulation.compute_ipl('net_transfers', default=False)/ipl - 1) < 1e-12
+    
+    # An alternative hypotheses set defined otherwise is not overwritten
+    simulation = create_simulation(reform=False)
+    simulation.add_reform('tax', delta=0.05)
+    simulation.set_discount_rate(0.04, default=False)
+    try:
+        simulation.create_reform_present_values('net_transfers')
+    except Exception:
+        pass
+    else:
+        raise AssertionError('the alternative discount rate has been overwritten')
+    assert simulation.discount_rate_alt == 0.04
+
+
+def test_fiscal_gap():
+    """
+    Testing that the adjustment returned by the solver closes the budget of the reformed simulation
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.set_gov_wealth(-100)
+    simulation.set_gov_spendings(200, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    
+    simulation.add_reform('sub', factor=1.1, age=slice(60, None))
+    for method in ['factor', 'delta']:
+        adjustment = simulation.solve_fiscal_gap('net_transfers', 'tax', year=slice(2015, None), age=slice(20, 64), 
+                                                 method=method)
+        reform = {method: adjustment}
+        simulation.add_reform('tax', year=slice(2015, None), age=slice(20, 64), **reform)
+        simulation.create_reform_present_values('net_transfers')
+        ipl = simulation.compute_ipl('net_transfers', default=False)
+        assert abs(ipl) < 1e-9*abs(simulation.compute_ipl('net_transfers'))
+        simulation.reforms.pop()
+
+
+def test_scenario_grid():
+    """
+    Testing that the scenarios evaluated at once match the simulations of each hypotheses set
+    """
+    def create_simulation(r, g, n, pi):
+        population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+        profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+        profiles_dataframe.loc[profiles_dataframe.index.get_level_values(0) >= 60, 'sub'] = 2.0
+        simulation = Simulation()
+        simulation.set_population(population_dataframe)
+        simulation.set_profiles(profiles_dataframe)
+        simulation.set_year_length(60)
+        simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+        simulation.set_tax_projection(method="desynchronized", rate=g, inflation_rate=pi, 
+                                      typ=['tax'], payments_list=['sub'])
+        simulation.set_growth_rate(g)
+        simulation.set_discount_rate(r)
+        simulation.set_population_growth_rate(n)
+        simulation.create_cohorts()
+        simulation.set_gov_wealth(-10)
+        simulation.set_gov_spendings(5, compute=True)
+        simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+        simulation.create_present_values('net_transfers')
+        return simulation
+    
+    simulation = create_simulation(0.04, 0.01, 0.005, 0.015)
+    res = simulation.evaluate_scenarios('net_transfers', gov_spendings=5, discount_rate=[[0.035], [0.05]], 
+                                        growth_rate=[0, 0.015], inflation_rate=0.012)
+    assert len(res) == 4
+    for i, scenario in res.iterrows():
+        control = create_simulation(scenario['discount_rate'], scenario['growth_rate'], 
+                                    scenario['population_growth_rate'], scenario['inflation_rate'])
+        assert abs(scenario['ipl']/control.compute_ipl('net_transfers') - 1) < 1e-10
+        assert abs(scenario['ratio']/control.compute_gen_imbalance('net_transfers') - 1) < 1e-10
+    
+    accounts = ScenarioGrid(simulation).accounts(discount_rate=[0.03, 0.05])
+    control = create_simulation(0.05, 0.01, 0.005, 0.015)
+    assert abs(accounts.ix[1][(1, 30)] - control.percapita_pv.get_value((30, 1, 2001), 'net_transfers')) < 1e-10
+
+
+def test_sensitivities():
+    """
+    Testing the derivatives propagated through the factors against finite differences of the scenarios
+    """
+    population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2021, rate=0.01)
+    profiles_dataframe = create_constant_profiles_dataframe(population_dataframe, tax=1.0, sub=0.5)
+    profiles_dataframe.loc[profiles_dataframe.index.get_level_values(0) >= 60, 'sub'] = 2.0
+    simulation = Simulation()
+    simulation.set_population(population_dataframe)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_population_projection(year_length=60, method="exp_growth", tail=True)
+    simulation.set_tax_projection(method="desynchronized", rate=0.01, inflation_rate=0.015, typ=['tax'], 
+                                  payments_list=['sub'])
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.04)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.set_gov_wealth(-10)
+    simulation.set_gov_spendings(5, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+    
+    indicators, accounts = simulation.compute_sensitivities('net_transfers', gov_spendings=5, per_capita=True)
+    grid = ScenarioGrid(simulation)
+    step = 1e-6
+    for parameter in ['discount_rate', 'growth_rate', 'population_growth_rate', 'inflation_rate']:
+        rate = grid.parameters()[parameter].values[0]
+        up, down = {parameter: rate + step}, {parameter: rate - step}
+        difference = (grid.evaluate(5, True, **up) - grid.evaluate(5, True, **down))/(2*step)
+        for key in ['ipl', 'n_1', 'ratio']:
+            assert abs(indicators.get_value(parameter, key)/difference[key].values[0] - 1) < 1e-6
+        difference = (grid.accounts(**up) - grid.accounts(**down)).values[0]/(2*step)
+        assert (abs(accounts.loc[parameter].values - difference) < 1e-6*abs(difference).max()).all()
+
+
 def test_comparison():
     
     population_dataframe = create_testing_population_dataframe(year_start=2001, year_end=2261, population=2)
@@ -127,6 +658,8 @@ def test_save_simulation():
     
     store = HDFStore(os.path.join(SRC_PATH,'countries','france','sources', 'Output_folder','test_save.h5'))
     assert store['aggregate_pv'] is not None
+    assert (store['cohorts']['dsct'] == 1).all()
+    store.close()
 
 if __name__ == '__main__':
 #     test_compute_gen_imbalance()
@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+'''
+Tests of the sweep over population scenarios
+'''
+from __future__ import division
+import os
+import nose
+from src.lib.simulation import Simulation
+from src.lib.sweep import population_sweep
+from src.scripts.tests.utils import (create_testing_population_dataframe,
+                                     create_constant_profiles_dataframe)
+
+
+def load_population_scenario(population_filename, population_scenario):
+    """
+    Returns a population growing at the rate given by the name of the scenario
+    """
+    if population_scenario == 'broken':
+        raise Exception('unreadable population scenario')
+    if population_scenario == 'dead':
+        os._exit(1)
+    return create_testing_population_dataframe(year_start=2001, year_end=2021, rate=float(population_scenario))
+
+
+def configure(simulation):
+    profiles_dataframe = create_constant_profiles_dataframe(simulation.population, tax=1.0, sub=0.5)
+    simulation.set_profiles(profiles_dataframe)
+    simulation.set_year_length(60)
+    simulation.set_population_projection(year_length=60, method="exp_growth")
+    simulation.set_tax_projection(method="per_capita", rate=0.01)
+    simulation.set_growth_rate(0.01)
+    simulation.set_discount_rate(0.03)
+    simulation.set_population_growth_rate(0.005)
+    simulation.create_cohorts()
+    simulation.set_gov_spendings(5, compute=True)
+    simulation.cohorts.compute_net_transfers(taxes_list=['tax'], payments_list=['sub'])
+    simulation.create_present_values('net_transfers')
+
+
+def test_population_sweep():
+    """
+    Testing that the sweep over a pool keeps the results of the scenarios which did not fail
+    """
+    received = list()
+    scenarios = ['0.0', 'broken', '0.01']
+    results, errors = population_sweep(None, configure, scenarios, gov_spendings=5, processes=2,
+                                       callback=received.append, loader=load_population_scenario,
+                                       discount_rate=[0.03, 0.04])
+    assert list(errors.keys()) == ['broken'] and 'unreadable population scenario' in errors['broken']
+    assert len(received) == 2
+    assert list(results['population_scenario']) == ['0.0', '0.0', '0.01', '0.01']
+    
+    simulation = Simulation()
+    simulation.set_population(load_population_scenario(None, '0.01'))
+    configure(simulation)
+    assert abs(results['ipl'][2]/simulation.compute_ipl('net_transfers') - 1) < 1e-10
+    
+    sequential, errors = population_sweep(None, configure, scenarios, gov_spendings=5, processes=1,
+                                          loader=load_population_scenario, discount_rate=[0.03, 0.04])
+    assert (sequential['ipl'] == results['ipl']).all()
+
+
+def test_population_sweep_failures():
+    """
+    Testing that the sweep keeps the results received when the callback fails or a worker process dies
+    """
+    def callback(res):
+        raise Exception('full disk')
+    
+    results, errors = population_sweep(None, configure, ['0.0', 'dead', '0.01'], gov_spendings=5, processes=2,
+                                       callback=callback, loader=load_population_scenario, timeout=5)
+    assert sorted(errors.keys()) == ['0.0', '0.01', 'dead']
+    assert 'full disk' in errors['0.0'] and 'no result' in errors['dead']
+    assert list(results['population_scenario']) == ['0.0', '0.01']
+
+
+if __name__ == '__main__':
+    nose.core.runmodule(argv=[__file__, '-v', '-i test_*.py'])
@@ -18,6 +18,7 @@ from pandas import HDFStore
 
 from Config import CONF, VERSION, ConfigDialog,  PathConfigPage
 from core.cohorte import Cohorts
+from lib.spendings import spendings_path, path_present_value
 from core.qthelpers import create_action, add_actions, get_icon
 
 from widgets.PopulationData import PopulationDataWidget
@@ -258,28 +259,26 @@ class MainWindow(QMainWindow):
         elif self._param_widget.taxes_proj == "global_g":
             cohorts.proj_tax(method = 'global')
 
+        # Prolongation of state expenses: spendings of every year relative to the first year, 
+        # shown with the cohorts and the plot, and their present value per unit of first year spendings
+        state_proj = getattr(self._param_widget, "state_proj", "global_g")
+        if state_proj in ["global_r", "head_r"]:
+            rate = r
+        else:
+            rate = g
+        per_capita = state_proj in ["head_r", "head_g"]
+        state_path = spendings_path(1, cohorts['pop'], rate, per_capita)
+        cohorts['state'] = state_path.reindex(cohorts.index.get_level_values('year')).values
+        self.state_pv = float(path_present_value(state_path, r))
+        self.statusbar.showMessage(u"Valeur actualisée des dépenses de l'Etat : %.2f fois celles de la première année" 
+                                   % self.state_pv)
+
         self._cohorts_widget.set_dataframe(cohorts.reset_index())
         self._cohorts_widget.update_view()
 
         self._plot_widget.set_dataframe(cohorts)
         self._plot_widget.refresh()
 
-
-        
-        state = False
-        if state is False:
-            return
-        
-        # Prolongation of state expenses
-        if self._param_widget.state_proj == "global_r":
-            pass
-        elif self._param_widget.state_proj == "global_g":
-            pass
-        elif self._param_widget.state_proj == "head_r":
-            pass
-        elif self._param_widget.state_proj == "head_g":
-            pass
-
         
     def refresh_population(self):
         '''